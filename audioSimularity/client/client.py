@@ -1,12 +1,17 @@
 import sys
 import re
+import time
+from collections import Counter
 import pjsua2 as pj
-from utils import sleep4PJSUA2, handleErr, quitPJSUA
+from utils import sleep4PJSUA2, handleErr, quitPJSUA, resetPJSUA, controlLoop
 import argparse
 from envDefault import EnvDefault
 
 DBG = 1
 
+# the call slots pjsua is built with, a larger uaConfig.maxCalls is silently lowered to it
+PJSUA_MAX_CALLS = getattr(pj, "PJSUA_MAX_CALLS", 32)
+
 
 class Unbuffered(object):
     def __init__(self, stream):
@@ -96,6 +101,165 @@ class Call(pj.Call):
                     aud_med.startTransmit(self.wav_recorder)
 
 
+class LoadCall(Call):
+    """Call placed by the LoadGenerator, it reports its state changes back"""
+
+    def __init__(self, acc, gen, seq):
+        Call.__init__(self, acc)
+        self.gen = gen
+        self.seq = seq
+        self.start = time.monotonic()
+        self.confirmed = False
+
+    def onCallState(self, prm):
+        ci = self.getInfo()
+        if ci.state == pj.PJSIP_INV_STATE_CONFIRMED and not self.confirmed:
+            self.confirmed = True
+            self.gen.onConfirmed(self)
+        elif ci.state == pj.PJSIP_INV_STATE_DISCONNECTED:
+            self.gen.onDisconnected(self, ci.lastStatusCode)
+
+    def onCallMediaState(self, prm):
+        # a media error is counted, it doesn't stop the other calls like handleErr()
+        try:
+            aud_med = self.getAudioMedia(-1)
+        except pj.Error as e:
+            print("exception!!: {}".format(e.info()))
+            self.gen.mediaErrors["media"] += 1
+            return
+
+        if not self.wav_player:
+            self.wav_player = pj.AudioMediaPlayer()
+            try:
+                self.wav_player.createPlayer("./input.16.wav")
+            except pj.Error as e:
+                print("Exception!!: failed opening wav file")
+                self.wav_player = None
+                self.gen.mediaErrors["player"] += 1
+            else:
+                self.wav_player.startTransmit(aud_med)
+
+        if args.record and not self.wav_recorder:
+            # a file per call, the concurrent calls can't share one recorder file
+            self.wav_recorder = pj.AudioMediaRecorder()
+            try:
+                self.wav_recorder.createRecorder("./recordered.{}.wav".format(self.seq))
+            except pj.Error as e:
+                print("Exception!!: failed opening recordered wav file")
+                self.wav_recorder = None
+                self.gen.mediaErrors["recorder"] += 1
+            else:
+                aud_med.startTransmit(self.wav_recorder)
+
+
+class LoadGenerator:
+    """keep `concurrency` calls in flight until `total` calls are placed.
+    new calls are started at most `rate` calls/s, so the starts are staggered
+    instead of a burst. with no limit (rate 0) there is no timer, a call is
+    started when a finished one frees its slot. every confirmed call is hung
+    up after callTime seconds.
+    """
+
+    def __init__(self, acc, callURI, total, concurrency, rate, callTime):
+        self.acc = acc
+        # a comma separated list of uris is called round robin, e.g. the users of a sharded echo server
+        self.callURIs = [uri.strip() for uri in callURI.split(",") if uri.strip()]
+        self.total = total
+        self.concurrency = concurrency
+        self.rate = rate
+        self.callTime = callTime
+
+        self.calls = {}
+        self.finishedCalls = []
+        self.started = 0
+        self.finished = 0
+        self.setupLatency = []
+        self.failures = Counter()
+        self.mediaErrors = Counter()
+        self.begin = None
+        self.end = None
+
+    def run(self):
+        self.begin = time.monotonic()
+        timer = controlLoop.callEvery(1.0 / self.rate, self.tick) if self.rate > 0 else None
+        try:
+            self.tick()
+            controlLoop.run(-1)
+        finally:
+            if timer:
+                timer.cancel()
+        self.end = time.monotonic()
+
+    def tick(self):
+        self.finishedCalls.clear()
+        # start one call per tick when rate limited, otherwise fill the window
+        while self.started < self.total and len(self.calls) < self.concurrency:
+            self.startCall()
+            if self.rate > 0:
+                break
+        return self.finished >= self.total
+
+    def startCall(self):
+        call = LoadCall(self.acc, self, self.started)
+        self.started += 1
+        self.calls[call.seq] = call
+        prm = pj.CallOpParam(True)
+        prm.opt.audioCount = 1
+        prm.opt.videoCount = 0
+        try:
+            call.makeCall(self.callURIs[call.seq % len(self.callURIs)], prm)
+        except pj.Error as e:
+            print("makeCall failed: {}".format(e.info()))
+            self.failures["makeCall"] += 1
+            self.finish(call)
+
+    def onConfirmed(self, call):
+        self.setupLatency.append(time.monotonic() - call.start)
+        controlLoop.callLater(self.callTime, lambda: self.hangup(call))
+
+    def hangup(self, call):
+        if call.seq in self.calls:
+            try:
+                call.hangup(pj.CallOpParam())
+            except pj.Error as e:
+                print("hangup failed: {}".format(e.info()))
+
+    def onDisconnected(self, call, statusCode):
+        if not call.confirmed:
+            self.failures[statusCode] += 1
+        self.finish(call)
+
+    def finish(self, call):
+        if self.calls.pop(call.seq, None) is None:
+            return
+        self.finished += 1
+        # the call object can't be deleted inside its own callback,
+        # keep it until the next tick
+        self.finishedCalls.append(call)
+        if self.finished >= self.total:
+            controlLoop.quit()
+        elif self.rate <= 0:
+            # refill the freed slot, outside the callback of the call
+            controlLoop.callLater(0, self.tick)
+
+    def report(self):
+        elapsed = (self.end or time.monotonic()) - self.begin
+        latency = sorted(self.setupLatency)
+        print("*** load report ***")
+        print("calls: {} placed, {} confirmed, {} failed in {:.2f}s ({:.2f} calls/s)".format(
+            self.started, len(latency), sum(self.failures.values()), elapsed,
+            self.finished / elapsed if elapsed > 0 else 0))
+        if latency:
+            print("setup latency(ms): min {:.1f} avg {:.1f} p50 {:.1f} p95 {:.1f} max {:.1f}".format(
+                latency[0] * 1000, sum(latency) / len(latency) * 1000,
+                latency[len(latency) // 2] * 1000, latency[int(len(latency) * 0.95)] * 1000,
+                latency[-1] * 1000))
+        for reason, cnt in self.failures.most_common():
+            print("failure {}: {}".format(reason, cnt))
+        for reason, cnt in self.mediaErrors.most_common():
+            print("media error {}: {}".format(reason, cnt))
+
+
 def enumLocalMedia(ep):
     # important: the Endpoint::mediaEnumPorts2() and Call::getAudioMedia() only create a copy of device object
     # all memory should manage by developer
@@ -123,7 +287,7 @@ def main():
         help="Specify the registrarURI, example: `-R sip:kamailio` (can also be specified using REGISTER_URI environment variable)")
     parser.add_argument(
         "-c", "--callURI", action=EnvDefault, envvar='CALL_URI',
-        help="Specify the URI you wants to call, example: `-c sip:1@kamailio` (can also be specified using CALL_URI environment variable)")
+        help="Specify the URI you wants to call, example: `-c sip:1@kamailio`, the load generation mode takes a comma separated list called round robin (can also be specified using CALL_URI environment variable)")
     parser.add_argument(
         "-t", "--callTime", action=EnvDefault, envvar='CALL_TIME', type=int,
         help="Specify the time(second) you wants to call (can also be specified using CALL_TIME environment variable)")
@@ -132,9 +296,16 @@ def main():
         help="Specify the times it would repeat sequentially, default 1 times (can also be specified using REPEAT environment variable)")
     parser.add_argument(
         "-x", "--record", action=EnvDefault, envvar='RECORD', type=bool, default=False, required=False,
-        help="Specify the whether it would record the audio to /recordered.wav, default False (can also be specified using RECORD environment variable)")
+        help="Specify the whether it would record the audio to /recordered.wav, in load generation mode to recordered.<call>.wav, default False (can also be specified using RECORD environment variable)")
+    parser.add_argument(
+        "-n", "--concurrency", action=EnvDefault, envvar='CONCURRENCY', type=int, default=1, required=False,
+        help="Specify how many calls are kept in flight, more than 1 turns on the load generation mode, default 1 (can also be specified using CONCURRENCY environment variable)")
+    parser.add_argument(
+        "--rate", action=EnvDefault, envvar='RATE', type=float, default=0, required=False,
+        help="Specify the maximum calls/s the load generation mode starts, 0 means no limit, default 0 (can also be specified using RATE environment variable)")
 
     args = parser.parse_args()
+    loadMode = args.concurrency > 1 or args.rate > 0
 
     ep = None
     try:
@@ -148,6 +319,12 @@ def main():
         # using thread in python may cause some problem
         ep_cfg.uaConfig.threadCnt = 0
         ep_cfg.uaConfig.mainThreadOnly = True
+        # every call in flight needs a pjsua call slot
+        if args.concurrency > PJSUA_MAX_CALLS:
+            print("*** warning: --concurrency {} is above the {} calls pjsua is built with (PJSUA_MAX_CALLS), "
+                  "it is lowered to {} ***".format(args.concurrency, PJSUA_MAX_CALLS, PJSUA_MAX_CALLS))
+            args.concurrency = PJSUA_MAX_CALLS
+        ep_cfg.uaConfig.maxCalls = max(ep_cfg.uaConfig.maxCalls, args.concurrency)
         ep.libInit(ep_cfg)
 
         # add some config
@@ -175,7 +352,17 @@ def main():
         # use null device as conference bridge, instead of local sound card
         pj.Endpoint.instance().audDevManager().setNullDev()
 
-        for i in range(args.repeat):
+        if loadMode:
+            gen = LoadGenerator(acc, args.callURI, args.repeat,
+                                max(args.concurrency, 1), args.rate, args.callTime)
+            gen.run()
+            # the generator quit the loop, let it send the BYEs of the calls left
+            resetPJSUA()
+            ep.hangupAllCalls()
+            sleep4PJSUA2(1)
+            gen.report()
+
+        for i in range(0 if loadMode else args.repeat):
             call = Call(acc)
             prm = pj.CallOpParam(True)
             prm.opt.audioCount = 1
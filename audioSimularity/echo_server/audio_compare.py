@@ -1,11 +1,38 @@
 #!/bin/env python3
-import subprocess
+from concurrent.futures import ProcessPoolExecutor
 import numpy
-import os
+from numpy.lib.stride_tricks import sliding_window_view
+
+from fingerprint import PcmBuffer, as_fingerprints, default_backend
+from fingerprint_cache import FingerprintCache
+
+# fingerprints shared by every AudioSimilar of the process, so the reference
+# audio (e.g. input.16.wav) is only fingerprinted once
+DEFAULT_CACHE = FingerprintCache()
+
+# popcount of every 16 bits value, a uint32 is counted by its two halves
+POPCOUNT16 = numpy.array([bin(i).count("1") for i in range(1 << 16)], dtype=numpy.uint8)
+
+
+# upper bound of the (targets x offsets x points) elements xor-ed at once
+BATCH_ELEMENTS = 1 << 24
+
+
+def _fingerprint_job(backend, source, sample_time):
+    # runs in the worker process of calc_many
+    if isinstance(source, PcmBuffer):
+        return backend.fingerprint_pcm(source, sample_time)
+    return backend.fingerprint_file(source, sample_time)
+
+
+def popcount32(values):
+    """count the set bits of every element of a uint32 array"""
+    values = numpy.asarray(values, dtype=numpy.uint32)
+    return POPCOUNT16[values & 0xFFFF] + POPCOUNT16[values >> 16]
 
 
 class AudioSimilar:
-    def __init__(self, sample_time=1000, span=100, step=1, min_overlap=20, threshold=0.85):
+    def __init__(self, sample_time=1000, span=100, step=1, min_overlap=20, threshold=0.85, backend=None, cache=None):
         # seconds to sample audio file for
         self.sample_time = sample_time
 
@@ -21,25 +48,21 @@ class AudioSimilar:
         # exception is raised if this cannot be met
         self.threshold = threshold
 
-    # calculate fingerprint
-    # Generate file.mp3.fpcalc by "fpcalc -raw -length 500 file.mp3"
-    def calculate_fingerprints(self, filename):
-        if os.path.exists(filename + '.fpcalc'):
-            print("Found precalculated fingerprint for %s" % (filename))
-            f = open(filename + '.fpcalc', "r")
-            fpcalc_out = ''.join(f.readlines())
-            f.close()
-        else:
-            print("Calculating fingerprint by fpcalc for %s" % (filename))
-            fpcalc_out = str(subprocess.check_output(['fpcalc', '-raw', '-length', str(
-                self.sample_time), filename])).strip().replace('\\n', '').replace("'", "")
+        # fingerprint backend, libchromaprint in process if it is installed
+        self.backend = backend or default_backend()
 
-        fingerprint_index = fpcalc_out.find('FINGERPRINT=') + 12
-        # convert fingerprint to list of integers
-        fingerprints = list(
-            map(int, fpcalc_out[fingerprint_index:].split(',')))
+        # content addressed fingerprint cache
+        self.cache = cache or DEFAULT_CACHE
 
-        return fingerprints
+    def _fingerprint(self, source):
+        if isinstance(source, PcmBuffer):
+            return self.backend.fingerprint_pcm(source, self.sample_time)
+        print("Calculating fingerprint by %s for %s" % (type(self.backend).__name__, source))
+        return self.backend.fingerprint_file(source, self.sample_time)
+
+    # calculate fingerprint of a wav file, or of a PcmBuffer
+    def calculate_fingerprints(self, source):
+        return self.cache.get_or_compute(source, self.sample_time, self._fingerprint)
 
     # returns correlation between lists
     def correlation(self, listx, listy):
@@ -47,15 +70,12 @@ class AudioSimilar:
             # Error checking in main program should prevent us from ever being
             # able to get here.
             raise Exception('Empty lists cannot be correlated.')
-        if len(listx) > len(listy):
-            listx = listx[:len(listy)]
-        elif len(listx) < len(listy):
-            listy = listy[:len(listx)]
+        length = min(len(listx), len(listy))
+        listx = as_fingerprints(listx)[:length]
+        listy = as_fingerprints(listy)[:length]
 
-        covariance = 0
-        for i in range(len(listx)):
-            covariance += 32 - bin(listx[i] ^ listy[i]).count("1")
-        covariance = covariance / float(len(listx))
+        covariance = 32 * length - int(popcount32(listx ^ listy).sum(dtype=numpy.int64))
+        covariance = covariance / float(length)
 
         return covariance/32
     # return cross correlation, with listy offset from listx
@@ -83,10 +103,55 @@ class AudioSimilar:
             raise Exception('span >= sample size: %i >= %i\n'
                             % (span, min(len(listx), len(listy)))
                             + 'Reduce span, reduce crop or increase sample_time.')
-        corr_xy = []
-        for offset in numpy.arange(-span, span + 1, step):
-            corr_xy.append(self.cross_correlation(listx, listy, offset))
-        return corr_xy
+        corr = self.compare_batch(listx, [listy], span, step)[0]
+        return [None if numpy.isnan(value) else value for value in corr.tolist()]
+
+    def compare_batch(self, listx, targets, span, step):
+        """cross correlate listx with every target, offsets from -span to span.
+        the targets are zero padded into one 2-D array, and xor-ed against the
+        sliding windows of listx in one pass (chunked by BATCH_ELEMENTS).
+
+        Returns:
+            numpy.ndarray: (len(targets), number of offsets) correlation,
+                nan where the overlap is smaller than min_overlap
+        """
+        listx = as_fingerprints(listx)
+        targets = [as_fingerprints(target) for target in targets]
+        offsets = numpy.arange(-span, span + 1, step)
+        len_x = len(listx)
+        len_t = numpy.array([len(target) for target in targets], dtype=numpy.int64)
+        width = int(len_t.max())
+
+        batch = numpy.zeros((len(targets), width), dtype=numpy.uint32)
+        for i, target in enumerate(targets):
+            batch[i, :len(target)] = target
+
+        # with listx padded by span zeros in the front, the window starts at
+        # span + offset of the padded list lines up with the targets
+        padded_x = numpy.zeros(len_x + 2 * span + width, dtype=numpy.uint32)
+        padded_x[span:span + len_x] = listx
+        windows = sliding_window_view(padded_x, width)[span + offsets]
+
+        # only target[lo:hi] overlaps with listx at each offset
+        lo = numpy.broadcast_to(numpy.maximum(0, -offsets), (len(targets), len(offsets)))
+        hi = numpy.minimum(len_t[:, None], len_x - offsets[None, :])
+        length = hi - lo
+        index = numpy.arange(width)
+
+        covariance = numpy.empty((len(targets), len(offsets)), dtype=numpy.int64)
+        chunk = max(1, BATCH_ELEMENTS // (len(offsets) * width))
+        for start in range(0, len(targets), chunk):
+            end = start + chunk
+            overlap = ((index >= lo[start:end, :, None])
+                       & (index < hi[start:end, :, None]))
+            bits = popcount32(windows[None, :, :] ^ batch[start:end, None, :])
+            covariance[start:end] = 32 * length[start:end] - \
+                numpy.where(overlap, bits, 0).sum(axis=2, dtype=numpy.int64)
+
+        corr = numpy.full(covariance.shape, numpy.nan)
+        valid = length >= self.min_overlap
+        corr[valid] = covariance[valid] / length[valid].astype(numpy.float64) / 32
+        return corr
 
     # return index of maximum value in list
     def max_index(self, listx):
@@ -124,3 +189,71 @@ class AudioSimilar:
 
         corr_data = self.correlate(src, dst)
         return corr_data
+
+    def calculate_many_fingerprints(self, sources, processes=None):
+        """fingerprint every source, the cache misses are fanned out to a
+        process pool when processes is given"""
+        keys = [self.cache.key(source, self.sample_time) for source in sources]
+        fingerprints = [self.cache.get(key) for key in keys]
+        missing = [i for i, fingerprint in enumerate(fingerprints) if fingerprint is None]
+
+        if processes and len(missing) > 1:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                futures = {i: pool.submit(_fingerprint_job, self.backend, sources[i], self.sample_time)
+                           for i in missing}
+                for i, future in futures.items():
+                    fingerprints[i] = future.result()
+                    self.cache.put(keys[i], fingerprints[i])
+        else:
+            for i in missing:
+                fingerprints[i] = self._fingerprint(sources[i])
+                self.cache.put(keys[i], fingerprints[i])
+        return fingerprints
+
+    def calc_many(self, reference, targets, processes=None):
+        """compare one reference against many targets, the reference is
+        fingerprinted once and correlated with all targets in one batch.
+
+        Args:
+            reference (str | PcmBuffer): the reference audio
+            targets (list): wav files or PcmBuffer to compare with reference
+            processes (int): fingerprint the targets in a pool of this many processes
+
+        Returns:
+            list[dict]: one row per target, with "target", "max_corr_offset",
+                "max_corr" and "passed" (max_corr >= threshold). "error" is
+                set when the target can't be compared.
+        """
+        if not reference:
+            raise Exception("Source file not specified.")
+        if len(targets) == 0:
+            return []
+
+        fingerprint_source = self.calculate_fingerprints(reference)
+        fingerprint_targets = self.calculate_many_fingerprints(targets, processes)
+
+        rows = [{"target": target, "max_corr_offset": None, "max_corr": None, "passed": False}
+                for target in targets]
+        comparable = []
+        for i, fingerprint in enumerate(fingerprint_targets):
+            if self.span > min(len(fingerprint_source), len(fingerprint)):
+                rows[i]["error"] = 'span >= sample size: %i >= %i' % (
+                    self.span, min(len(fingerprint_source), len(fingerprint)))
+            else:
+                comparable.append(i)
+        if len(comparable) == 0:
+            return rows
+
+        corr = self.compare_batch(fingerprint_source,
+                                  [fingerprint_targets[i] for i in comparable], self.span, self.step)
+        best = numpy.where(numpy.isnan(corr), -numpy.inf, corr)
+        max_index = best.argmax(axis=1)
+        for row, i, j in zip(range(len(comparable)), comparable, max_index.tolist()):
+            max_corr = best[row, j]
+            if max_corr == -numpy.inf:
+                rows[i]["error"] = "overlap too small"
+                continue
+            rows[i]["max_corr_offset"] = -self.span + j * self.step
+            rows[i]["max_corr"] = float(max_corr)
+            rows[i]["passed"] = bool(max_corr >= self.threshold)
+        return rows
@@ -0,0 +1,46 @@
+import pjsua2 as pj
+
+
+class CachedInfoCall(pj.Call):
+    """pj.Call caching the snapshot of getInfo().
+
+    every getInfo() copies the whole CallInfo (with its media vector) across
+    SWIG, this class copies it once per event instead. the subclass must
+    call invalidateInfo() at the beginning of onCallState() and
+    onCallMediaState(), the next getInfo() refreshes the snapshot and the
+    later ones return the same python object. the durations of the snapshot
+    are the ones at the time of the event.
+
+    the cache is single-threaded: the snapshot is shared by every thread, so
+    with pjsua worker threads (e.g. callbackBridge) set enabled to False, and
+    hand the CallInfo taken in a callback to the other threads instead.
+    """
+
+    # False makes getInfo() copy the CallInfo every time
+    enabled = True
+    # profiling counters of all the calls
+    infoFetched = 0
+    infoAvoided = 0
+
+    def __init__(self, acc, call_id=pj.PJSUA_INVALID_ID):
+        pj.Call.__init__(self, acc, call_id)
+        self._info = None
+
+    def getInfo(self):
+        if not CachedInfoCall.enabled:
+            CachedInfoCall.infoFetched += 1
+            return pj.Call.getInfo(self)
+        if self._info is None:
+            self._info = pj.Call.getInfo(self)
+            CachedInfoCall.infoFetched += 1
+        else:
+            CachedInfoCall.infoAvoided += 1
+        return self._info
+
+    def invalidateInfo(self):
+        self._info = None
+
+
+def infoCacheStats():
+    """the number of getInfo() copied across SWIG, and avoided by the cache"""
+    return {"fetched": CachedInfoCall.infoFetched, "avoided": CachedInfoCall.infoAvoided}
@@ -0,0 +1,177 @@
+#!/bin/env python3
+"""JSON-lines call quality records of the echo server, and their columnar export
+
+every finished call is one flat json object per line, with the SCHEMA fields.
+the compact command turns those files into Parquet or Arrow IPC:
+
+    python3 callRecord.py compact server.log server.log.1 -o calls.parquet
+
+the echo server writes these records with --reportFormat jsonl.
+"""
+import argparse
+import json
+import re
+
+from parseLog import dumps
+
+SCHEMA_VERSION = 1
+
+# field name -> arrow type name, the order is the column order
+SCHEMA = [
+    ("v", "int32"),
+    ("timestamp", "string"),
+    ("status", "string"),
+    ("call_id", "string"),
+    ("remote_uri", "string"),
+    ("codec", "string"),
+    ("call_time_s", "int64"),
+    ("rx_bytes", "int64"),
+    ("tx_bytes", "int64"),
+    ("rx_packets", "int64"),
+    ("tx_packets", "int64"),
+    ("rx_loss_min", "float64"),
+    ("rx_loss_avg", "float64"),
+    ("rx_loss_max", "float64"),
+    ("tx_loss_min", "float64"),
+    ("tx_loss_avg", "float64"),
+    ("tx_loss_max", "float64"),
+]
+
+CALL_TIME_RE = re.compile(r"(\d+)h:(\d+)m:(\d+)s")
+
+
+def callTimeSeconds(call_time):
+    """turn the "00h:01m:05s" of Call.dump() into seconds"""
+    match = CALL_TIME_RE.match(call_time or "")
+    if not match:
+        return None
+    h, m, s = map(int, match.groups())
+    return h * 3600 + m * 60 + s
+
+
+def callRecord(stats, remote_uri, status, timestamp):
+    """build the record of a call
+
+    Args:
+        stats (dict): PjsuaLogParser.to_dict() of the call
+        remote_uri (str): the remote uri of the call
+        status (str): "Normal", "Error" or "NoMedia"
+        timestamp (datetime): the time the call is finished
+
+    Returns:
+        dict: the record, with every field of SCHEMA
+    """
+    record = dict.fromkeys(name for name, _ in SCHEMA)
+    record.update({
+        "v": SCHEMA_VERSION,
+        "timestamp": timestamp.isoformat(),
+        "status": status,
+        "call_id": stats["call_id"],
+        "remote_uri": remote_uri,
+        "call_time_s": callTimeSeconds(stats["call_time"]),
+    })
+    media = stats["media"].get("0")
+    if media:
+        record["codec"] = media["codec"]
+        for direction in ("rx", "tx"):
+            net = media[direction]
+            record[direction + "_bytes"] = net["total_packet_size"]
+            record[direction + "_packets"] = net["total_packet_cnt"]
+            record[direction + "_loss_min"] = net["pkt_loss_min"]
+            record[direction + "_loss_avg"] = net["pkt_loss_avg"]
+            record[direction + "_loss_max"] = net["pkt_loss_max"]
+    return record
+
+
+def recordLine(record):
+    return dumps(record) + "\n"
+
+
+def readRecords(paths):
+    """yield the records of JSON-lines files, the lines which are not
+    records (e.g. the former text log) are skipped"""
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if not line.startswith("{"):
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def compact(paths, output, fmt=None, batch_size=65536):
+    """write the records of paths into one Parquet or Arrow IPC file
+
+    Args:
+        paths (list): the JSON-lines files
+        output (str): the output file
+        fmt (str): "parquet" or "arrow", guessed from the output extension if None
+        batch_size (int): records per record batch / row group
+
+    Returns:
+        int: the number of records written
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise SystemExit("compact needs pyarrow, `pip install pyarrow`")
+
+    if fmt is None:
+        fmt = "parquet" if output.endswith(".parquet") else "arrow"
+    schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in SCHEMA])
+
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(output, schema)
+        write = writer.write_batch
+    else:
+        sink = pa.OSFile(output, "wb")
+        writer = pa.ipc.new_file(sink, schema)
+        write = writer.write_batch
+
+    count = 0
+    columns = {name: [] for name, _ in SCHEMA}
+
+    def flush():
+        if columns["v"]:
+            write(pa.record_batch([pa.array(columns[name], type=schema.field(name).type)
+                                   for name, _ in SCHEMA], schema=schema))
+            for values in columns.values():
+                values.clear()
+
+    try:
+        for record in readRecords(paths):
+            for name, values in columns.items():
+                values.append(record.get(name))
+            count += 1
+            if len(columns["v"]) >= batch_size:
+                flush()
+        flush()
+    finally:
+        writer.close()
+        if fmt != "parquet":
+            sink.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tools of the echo server call records")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser(
+        "compact", help="compact JSON-lines call records into Parquet or Arrow IPC")
+    compact_parser.add_argument("paths", nargs="+", help="the JSON-lines files, e.g. server.log*")
+    compact_parser.add_argument("-o", "--output", required=True,
+                                help="the output file, .parquet is written as Parquet, otherwise Arrow IPC")
+    compact_parser.add_argument("-f", "--format", choices=["parquet", "arrow"], default=None,
+                                help="the output format, guessed from the output extension by default")
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        count = compact(args.paths, args.output, args.format)
+        print("compacted {} records into {}".format(count, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import pjsua2 as pj
+import queue
+import threading
+import traceback
+import sys
+
+# tells the dispatcher thread to stop
+_STOP = object()
+
+
+def registerThread(name):
+    """register the calling python thread to pjlib, every thread which is not
+    created by pjlib must do it once before calling any pjsua2 api"""
+    ep = pj.Endpoint.instance()
+    if not ep.libIsThreadRegistered():
+        ep.libRegisterThread(name)
+
+
+def configureThreads(ep_cfg, threadCnt):
+    """set the pjsua worker threads of an EpConfig before libInit()
+
+    Args:
+        ep_cfg (pj.EpConfig): the endpoint config
+        threadCnt (int): number of pjsua worker threads, 0 keeps everything
+            on the thread calling libHandleEvents() (sleep4PJSUA2)
+    """
+    if threadCnt > 0:
+        ep_cfg.uaConfig.threadCnt = threadCnt
+        ep_cfg.uaConfig.mainThreadOnly = False
+        ep_cfg.medConfig.threadCnt = threadCnt
+    else:
+        # using thread in python may cause some problem
+        ep_cfg.uaConfig.threadCnt = 0
+        ep_cfg.uaConfig.mainThreadOnly = True
+
+
+class CallbackBridge:
+    """hand the pjsua2 callbacks over to one python dispatcher thread.
+
+    with pjsua worker threads, the callbacks are called from several pjlib
+    threads at once. a callback only copies what it needs out of its prm (prm
+    is invalid once the callback returns) and post()s the handler, which is
+    queued in a SimpleQueue (no python level lock) and run in order by the
+    dispatcher thread, which is registered to pjlib by registerThread().
+    the pjsua worker threads go back to SIP and media handling at once.
+
+    before start(), post() runs the handler inline, so the same code works
+    when uaConfig.threadCnt is 0.
+    """
+
+    def __init__(self, name="pjsua-dispatcher"):
+        self.name = name
+        self.queue = queue.SimpleQueue()
+        self.dispatched = 0
+        self._thread = None
+
+    def post(self, handler, *args):
+        """run handler(*args) on the dispatcher thread, it is thread-safe"""
+        if self._thread is None:
+            self._run(handler, args)
+        else:
+            self.queue.put((handler, args))
+
+    def _run(self, handler, args):
+        try:
+            handler(*args)
+        except Exception:
+            print("exception in {}:".format(getattr(handler, "__qualname__", handler)))
+            traceback.print_exception(*sys.exc_info())
+        self.dispatched += 1
+
+    def _loop(self):
+        registerThread(self.name)
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            self._run(*item)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """run the queued handlers, then stop the dispatcher thread"""
+        if self._thread is None:
+            return
+        self.queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def pending(self):
+        return self.queue.qsize()
+
+
+# the bridge of the process
+callbackBridge = CallbackBridge()
@@ -0,0 +1,181 @@
+import os
+import time
+
+# upper edges of the CPU-ms per call-second histogram buckets
+BUCKETS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, float("inf")]
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def threadCpu():
+    """the CPU time(second) of every thread of the process, read from
+    /proc/self/task, it is empty where /proc is not available
+
+    Returns:
+        dict: thread id -> (thread name, user + system time)
+    """
+    threads = {}
+    try:
+        tids = os.listdir("/proc/self/task")
+    except OSError:
+        return threads
+    for tid in tids:
+        try:
+            with open("/proc/self/task/{}/stat".format(tid)) as f:
+                stat = f.read()
+        except OSError:
+            # the thread is gone
+            continue
+        # the name is in parentheses and may contain spaces
+        name = stat[stat.index("(") + 1:stat.rindex(")")]
+        fields = stat[stat.rindex(")") + 2:].split()
+        # utime and stime are the 14th and 15th fields of stat
+        threads[int(tid)] = (name, (int(fields[11]) + int(fields[12])) / _CLK_TCK)
+    return threads
+
+
+def portBucket(ports):
+    """the power of 2 bucket of a bridge port count, e.g. 5 -> "5-8" """
+    if ports <= 1:
+        return "0-1"
+    upper = 1 << (ports - 1).bit_length()
+    return "{}-{}".format(upper // 2 + 1, upper)
+
+
+class Histogram:
+    """histogram of the CPU-ms per call-second, with BUCKETS"""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        for i, edge in enumerate(BUCKETS):
+            if value <= edge:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self):
+        return {
+            "calls": self.count,
+            "mean": round(self.mean, 3),
+            "max": round(self.max, 3),
+            "buckets": {"<={}".format(edge): n for edge, n in zip(BUCKETS, self.counts) if n},
+        }
+
+
+class CallCpuProfiler:
+    """attribute the process CPU time to the calls, by codec and by bridge load.
+
+    the media of all calls is handled by the same pjmedia threads, so the CPU
+    of a single call can't be read directly. sample() is called at every
+    media event (callStarted()/callFinished()), the process CPU time spent
+    since the former sample is split evenly across the calls which were
+    active in between, and counted to the bridge port count of that moment.
+    when a call ends, its CPU-ms per call-second goes to the histogram of its
+    codec. the CPU time of every thread (from /proc/self/task) is summed too,
+    to tell the media threads from the python one.
+    """
+
+    def __init__(self, ep=None):
+        """
+        Args:
+            ep (pj.Endpoint): the endpoint, to read the active bridge ports, optional
+        """
+        self.ep = ep
+        # call key -> [started at, attributed CPU seconds]
+        self.active = {}
+        self.byCodec = {}
+        # bridge port bucket -> [CPU seconds, call seconds]
+        self.byPorts = {}
+        # thread name -> CPU seconds
+        self.byThread = {}
+        self.samples = 0
+        self._lastTime = time.monotonic()
+        self._lastCpu = time.process_time()
+        self._lastThreads = threadCpu()
+
+    def sample(self):
+        """split the CPU time since the former sample across the active calls"""
+        now = time.monotonic()
+        cpu = time.process_time()
+        threads = threadCpu()
+        cpuDelta = cpu - self._lastCpu
+        elapsed = now - self._lastTime
+
+        if self.active:
+            share = cpuDelta / len(self.active)
+            for call in self.active.values():
+                call[1] += share
+            ports = self.ep.mediaActivePorts() if self.ep is not None else len(self.active)
+            usage = self.byPorts.setdefault(portBucket(ports), [0.0, 0.0])
+            usage[0] += cpuDelta
+            usage[1] += elapsed * len(self.active)
+
+        for tid, (name, threadTime) in threads.items():
+            former = self._lastThreads.get(tid)
+            delta = threadTime - (former[1] if former else 0.0)
+            self.byThread[name] = self.byThread.get(name, 0.0) + delta
+
+        self._lastTime = now
+        self._lastCpu = cpu
+        self._lastThreads = threads
+        self.samples += 1
+
+    def callStarted(self, key):
+        """the media of the call key is active, it is a no-op for an active call"""
+        if key in self.active:
+            return
+        self.sample()
+        self.active[key] = [time.monotonic(), 0.0]
+
+    def callFinished(self, key, codec):
+        """the media of the call key is destroyed, count it to the codec
+
+        Returns:
+            float: the CPU-ms per call-second of the call, None if it wasn't active
+        """
+        if key not in self.active:
+            return None
+        self.sample()
+        started, cpu = self.active.pop(key)
+        seconds = time.monotonic() - started
+        if seconds <= 0:
+            return None
+        value = cpu * 1000 / seconds
+        self.byCodec.setdefault(codec or "unknown", Histogram()).add(value)
+        return value
+
+    def report(self):
+        return {
+            "samples": self.samples,
+            "cpu_ms_per_call_second": {codec: h.to_dict() for codec, h in sorted(self.byCodec.items())},
+            "by_bridge_ports": {
+                bucket: round(cpu * 1000 / callSeconds, 3)
+                for bucket, (cpu, callSeconds) in sorted(self.byPorts.items(),
+                                                         key=lambda item: int(item[0].split("-")[0]))
+                if callSeconds > 0},
+            "thread_cpu_s": {name: round(cpu, 3) for name, cpu in
+                             sorted(self.byThread.items(), key=lambda item: -item[1]) if cpu > 0},
+        }
+
+    def format(self):
+        """the report as a table of the histograms"""
+        lines = ["{:<16} {:>6} {:>8} {:>8}  {}".format("codec", "calls", "mean", "max", "CPU-ms per call-second")]
+        for codec, h in sorted(self.byCodec.items()):
+            lines.append("{:<16} {:>6} {:>8.3f} {:>8.3f}  {}".format(
+                codec, h.count, h.mean, h.max,
+                " ".join("{}:{}".format(k, v) for k, v in h.to_dict()["buckets"].items())))
+        report = self.report()
+        lines.append("by bridge ports: {}".format(report["by_bridge_ports"]))
+        lines.append("by thread(s): {}".format(report["thread_cpu_s"]))
+        return "\n".join(lines)
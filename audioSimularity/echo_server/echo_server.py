@@ -1,37 +1,60 @@
 import pjsua2 as pj
-from utils import sleep4PJSUA2
+from utils import sleep4PJSUA2, quitPJSUA, resetPJSUA, controlLoop
 from parseLog import PjsuaLogParser
+from callRegistry import CallRegistry
+from callInfoCache import CachedInfoCall, infoCacheStats
+from reportSink import ReportSink, ReportForwarder
+from supervisor import Supervisor
+from callRecord import callRecord, recordLine, callTimeSeconds
+from codecPolicy import POLICIES, CodecPolicy, CodecUsage
+from cpuProfiler import CallCpuProfiler
+from callbackBridge import callbackBridge, configureThreads
+from echoMode import ECHO_MODES, configureEcho, codecFilter, startEcho
+from mediaProfile import addMediaArgs, mediaProfileFromArgs, BridgeUsage
 import argparse
 from envDefault import EnvDefault
-import humanfriendly
 import re
+import os
+import socket
+from signal import signal, SIGINT, SIGTERM
 from datetime import datetime
 import traceback
 import sys
 from typing import Union
-import io
 
 # pjsua2 endpoint instance
 ep: Union[None, pj.Endpoint] = None
 
-# log file descriptor
-f: Union[None, io.TextIOWrapper] = None
+# call report writer of server.log
+sink: Union[None, ReportSink, ReportForwarder] = None
 
+# codec counters of the finished calls
+codecUsage = CodecUsage()
 
-class Call(pj.Call):
+# CPU time per call, by codec, if --cpuProfile
+profiler: Union[None, CallCpuProfiler] = None
+
+
+class Call(CachedInfoCall):
     """
     Call class, High level Python Call object, derived from pjsua2's Call object.
     there are Call class reference: https://www.pjsip.org/pjsip/docs/html/classpj_1_1Call.htm We may wants to implement our Call object to handle the "outgoing" call implement logic
     """
 
     def __init__(self, acc, call_id=pj.PJSUA_INVALID_ID):
-        pj.Call.__init__(self, acc, call_id)
+        CachedInfoCall.__init__(self, acc, call_id)
         self.acc = acc
 
     # override the function at original parent class
     # parent class's function can be called by super().onCallState()
+    # with --threads, the pjsua callbacks are called from the pjsua worker threads,
+    # they post the work to callbackBridge and return at once. the CallInfo is
+    # taken in the callback, the call slot is freed after a DISCONNECTED one
     def onCallState(self, prm):
-        ci = self.getInfo()
+        self.invalidateInfo()
+        callbackBridge.post(self.handleCallState, self.getInfo())
+
+    def handleCallState(self, ci):
         print("*** Call: {} [{}, {}]".format(ci.remoteUri,
               ci.lastStatusCode, ci.stateText))
 
@@ -41,6 +64,7 @@ class Call(pj.Call):
             del self
 
     def onCallMediaState(self, prm):
+        self.invalidateInfo()
         # Deprecated: for PJSIP version 2.8 or earlier
         # ci = self.getInfo()
         # for mi in ci.media:
@@ -57,81 +81,91 @@ class Call(pj.Call):
         try:
             # get the "local" media
             aud_med = self.getAudioMedia(-1)
-            # generate echo
-            aud_med.startTransmit(aud_med)
+            # generate echo, in the callback while the media port is surely the one of this call
+            startEcho(aud_med)
         except Exception as e:
             print("exception!!: {}".format(e.args))
+            return
+        if profiler:
+            callbackBridge.post(profiler.callStarted, self.getInfo().callIdString)
 
     def onStreamDestroyed(self, prm):
-        global f
+        # the stream statistics are gone once the callback returns, dump them here
         ci = self.getInfo()
-        call_id = ci.callIdString
-        parser = PjsuaLogParser(call_id)
-        parser.parseIndent(self.dump(True, "    "))
-        stats = parser.toJSON()
+        callbackBridge.post(self.report, ci, self.dump(True, "    "))
+
+    def report(self, ci, dump):
+        parser = PjsuaLogParser(ci.callIdString)
+        parser.parseIndent(dump)
+        stats = parser.to_dict()
+        codecUsage.count(stats, callTimeSeconds(stats["call_time"]))
+        if profiler:
+            profiler.callFinished(ci.callIdString, stats["media"]["0"]["codec"] if stats["media"] else "NoMedia")
 
         # flag the abnormal data
         is_abnormal = False
-        min_pktsz = ""
-        max_pktsz = ""
+        min_pktsz = 0
+        max_pktsz = 0
         log_str = ""
+        now = datetime.now()
 
-        if len(list(enumerate(stats["media"]))) != 0:
-            try:
-                min_pktsz = min(humanfriendly.parse_size(stats["media"]["0"]["rx"]["total_packet_size"]), humanfriendly.parse_size(
-                    stats["media"]["0"]["tx"]["total_packet_size"]))
-                max_pktsz = max(humanfriendly.parse_size(stats["media"]["0"]["rx"]["total_packet_size"]), humanfriendly.parse_size(
-                    stats["media"]["0"]["tx"]["total_packet_size"]))
-            except Exception as e:
-                print("err: {}, stats: {}".format(e.args, stats))
+        if len(stats["media"]) != 0:
+            # packet size is already parsed as bytes
+            rx_pktsz = stats["media"]["0"]["rx"]["total_packet_size"]
+            tx_pktsz = stats["media"]["0"]["tx"]["total_packet_size"]
+            min_pktsz = min(rx_pktsz, tx_pktsz)
+            max_pktsz = max(rx_pktsz, tx_pktsz)
 
             if min_pktsz == 0:
                 is_abnormal = True
-            elif float(min_pktsz) / float(max_pktsz) < args.threshold and float(max_pktsz) - float(min_pktsz) > 10240:  # larger than 10k
+            elif min_pktsz < args.threshold * max_pktsz and max_pktsz - min_pktsz > 10240:  # larger than 10k
                 is_abnormal = True
         else:
+            status = "NoMedia"
             log_str = "{} Error(no media) callid:{}\n".format(
-                datetime.now(), stats["call_id"])
+                now, stats["call_id"])
 
         if len(log_str) == 0:
+            status = "Error" if is_abnormal else "Normal"
             log_str = "{} {status} callid:{} caller:{} call_time:{} codec:{} tx:{} rx:{} ".format(
-                datetime.now(
-                ), stats["call_id"], ci.remoteUri, stats["call_time"], stats["media"]["0"]["codec"],
+                now, stats["call_id"], ci.remoteUri, stats["call_time"], stats["media"]["0"]["codec"],
                 stats["media"]["0"]["tx"]["total_packet_size"], stats["media"]["0"]["rx"]["total_packet_size"],
-                status=("Error" if is_abnormal else "Normal"))
+                status=status)
             if is_abnormal:
-                log_str = log_str + "dbg_msg: {}".format(stats)
+                log_str = log_str + "dbg_msg: {}".format(parser.dumps())
             log_str += '\n'
         print(log_str)
-        # reopen the original fd, to make open fd is still alive
-        f = open('server.log', "a", buffering=1)
-        f.write(log_str)
+        if sink:
+            if args.reportFormat == "jsonl":
+                sink.write(recordLine(callRecord(stats, ci.remoteUri, status, now)))
+            else:
+                sink.write(log_str)
 
 
 class Account(pj.Account):
     def __init__(self):
         pj.Account.__init__(self)
-        self.calls = []
+        self.calls = CallRegistry()
 
     def onRegState(self, prm):
         ai = self.getInfo()
         print("***{}: code={}".format(("*** Register" if ai.regIsActive else "*** Unregister"), prm.code))
 
     def onIncomingCall(self, iprm):
-        call = Call(self, call_id=iprm.callId)
+        # the Call must be created in the callback, otherwise pjsua2 hangs up the call
+        callbackBridge.post(self.answerCall, Call(self, call_id=iprm.callId))
+
+    def answerCall(self, call):
         call_prm = pj.CallOpParam()
         ci = call.getInfo()
 
         print("*** Incoming Call: {} [{}]".format(ci.remoteUri, ci.stateText))
-        self.calls.append(call)
+        self.calls.add(call, ci)
         call_prm.statusCode = 200
         call.answer(call_prm)
 
     def removeCall(self, call):
-        for tmpCall in self.calls:
-            if tmpCall.getInfo().callIdString == call.getInfo().callIdString:
-                self.calls.remove(tmpCall)
-                break
+        self.calls.remove(call)
 
 
 def enumLocalMedia(ep):
@@ -145,6 +179,38 @@ def enumLocalMedia(ep):
             med_info.portId, med_info.name, med_info.format.channelCount))
 
 
+def reusePortOption():
+    """the SO_REUSEPORT option of the SIP transport, every worker binds the same port.
+
+    experimental: the kernel picks the socket of a datagram by the hash of its
+    4-tuple, so a response may reach another worker than the one which sent
+    the request, and all the traffic of one proxy reaches a single worker.
+    """
+    return pj.SockOpt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+
+def handler(signal_received, frame):
+    # stop the event polling, main() then hangs up, destroys the lib and flushes the reports
+    print("*** received signal {} ***".format(signal_received))
+    quitPJSUA()
+
+
+def supervise(args):
+    """run args.workers echo server processes, restart them when they crash,
+    and write their call reports into server.log"""
+    global sink
+    sink = ReportSink('server.log', max_bytes=args.logMaxBytes, backup_count=args.logBackupCount)
+    supervisor = Supervisor(os.path.abspath(__file__), sys.argv[1:], args.workers, sink)
+    signal(SIGTERM, supervisor.stop)
+    signal(SIGINT, supervisor.stop)
+    try:
+        supervisor.run()
+    finally:
+        sink.close()
+        print("*** supervisor: {} ***".format(supervisor.stats()))
+        print("*** call report: {} ***".format(sink.stats()))
+
+
 def main():
     # parse the cmd element
     global args
@@ -165,14 +231,80 @@ def main():
         "-D", "--debug", action=EnvDefault, envvar='DBG', type=bool, default=False, required=False,
         help="Specify whether the debug mode is open, default False (can also be specified using DBG environment variable)")
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--reportFormat", action=EnvDefault, envvar='REPORT_FORMAT', choices=["text", "jsonl"], default="text", required=False,
+        help="Specify the format of server.log, the text line per call or one JSON-lines record per call (for `callRecord.py compact`), default text (can also be specified using REPORT_FORMAT environment variable)")
+    parser.add_argument(
+        "--logMaxBytes", action=EnvDefault, envvar='LOG_MAX_BYTES', type=int, default=64 * 1024 * 1024, required=False,
+        help="Specify the size server.log is rotated at, default 64MiB (can also be specified using LOG_MAX_BYTES environment variable)")
+    parser.add_argument(
+        "--logBackupCount", action=EnvDefault, envvar='LOG_BACKUP_COUNT', type=int, default=5, required=False,
+        help="Specify how many rotated server.log are kept, default 5 (can also be specified using LOG_BACKUP_COUNT environment variable)")
+    parser.add_argument(
+        "--threads", action=EnvDefault, envvar='THREADS', type=int, default=0, required=False,
+        help="Specify the number of pjsua worker threads, the callbacks are handled by one python dispatcher thread, default 0 handles everything on the main thread (can also be specified using THREADS environment variable)")
 
-    global ep, f
+    parser.add_argument(
+        "--echoMode", action=EnvDefault, envvar='ECHO_MODE', choices=ECHO_MODES, default="bridge", required=False,
+        help="Specify how the audio is echoed, both modes loop the audio through the conference bridge, bridge: the default 16KHz bridge, native-rate: the bridge runs at --echoClockRate "
+             "and only the codecs of this clock rate are enabled, so nothing is resampled, default bridge (can also be specified using ECHO_MODE environment variable)")
+    parser.add_argument(
+        "--echoClockRate", action=EnvDefault, envvar='ECHO_CLOCK_RATE', type=int, default=8000, required=False,
+        help="Specify the bridge clock rate of the native-rate echo mode, default 8000 (can also be specified using ECHO_CLOCK_RATE environment variable)")
+    parser.add_argument(
+        "--cpuProfile", action=EnvDefault, envvar='CPU_PROFILE', type=bool, default=False, required=False,
+        help="Specify whether the CPU time per call is profiled and reported by codec at shutdown, default False (can also be specified using CPU_PROFILE environment variable)")
+    addMediaArgs(parser, EnvDefault)
+    parser.add_argument(
+        "--codecPolicy", action=EnvDefault, envvar='CODEC_POLICY', default="default", required=False,
+        help="Specify the codec policy, one of {} or a json file with priorities/allow/deny/params, "
+             "default disables speex (can also be specified using CODEC_POLICY environment variable)".format(", ".join(POLICIES)))
+    parser.add_argument(
+        "-P", "--port", action=EnvDefault, envvar='SIP_PORT', type=int, default=5060, required=False,
+        help="Specify the SIP UDP port, default 5060 (can also be specified using SIP_PORT environment variable)")
+    parser.add_argument(
+        "-w", "--workers", action=EnvDefault, envvar='WORKERS', type=int, default=1, required=False,
+        help="Specify the number of echo server processes, each one has its own pjsua endpoint, default 1 (can also be specified using WORKERS environment variable)")
+    parser.add_argument(
+        "--shardMode", action=EnvDefault, envvar='SHARD_MODE', choices=["aor", "contact", "reuseport"], default="aor", required=False,
+        help="Specify how the workers share the SIP traffic, aor: worker i binds --port + i and registers its own user (see --workerUser), the callers spread the calls over the users, "
+             "contact: worker i binds --port + i and registers a contact of the same user, the proxy must pick one contact per call (e.g. serial forking by q-value), a parallel fork rings every worker, "
+             "reuseport (experimental): every worker binds --port with SO_REUSEPORT and none registers, the proxy must route to --port statically, "
+             "default aor (can also be specified using SHARD_MODE environment variable)")
+    parser.add_argument(
+        "--workerUser", action=EnvDefault, envvar='WORKER_USER', default="{username}-{worker}", required=False,
+        help="Specify the user worker i registers in --shardMode aor, the registrar must accept it with --password, default {username}-{worker}, e.g. 2-0, 2-1 (can also be specified using WORKER_USER environment variable)")
+    # set by the supervisor for its workers
+    parser.add_argument("--worker", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--reportSocket", default=None, help=argparse.SUPPRESS)
 
+    args = parser.parse_args()
     try:
-        f = open('server.log', "a", buffering=1)
-    except Exception as e:
-        print("can't open the log file")
+        codecPolicy = CodecPolicy.load(args.codecPolicy)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.workers > 1 and args.worker is None:
+        if args.shardMode == "reuseport":
+            print("*** warning: --shardMode reuseport is experimental, the responses may reach another worker "
+                  "and one proxy is served by a single worker, the workers don't register ***")
+        supervise(args)
+        return
+
+    global ep, sink, profiler
+
+    sharded = args.worker is not None
+    # a signal stops the event polling, so the shutdown below hangs up and dumps the stats
+    signal(SIGTERM, handler)
+    signal(SIGINT, handler)
+    if sharded:
+        # the supervisor writes server.log
+        sink = ReportForwarder(args.reportSocket)
+    else:
+        try:
+            sink = ReportSink('server.log', max_bytes=args.logMaxBytes, backup_count=args.logBackupCount)
+        except Exception as e:
+            print("can't open the log file")
 
     try:
         # init the lib
@@ -180,9 +312,10 @@ def main():
         ep.libCreate()
         ep_cfg = pj.EpConfig()
 
-        # using thread in python may cause some problem
-        ep_cfg.uaConfig.threadCnt = 0
-        ep_cfg.uaConfig.mainThreadOnly = True
+        # pjsua worker threads, see callbackBridge.py
+        configureThreads(ep_cfg, args.threads)
+        # the getInfo() snapshot cache is single-threaded
+        CachedInfoCall.enabled = args.threads == 0
         if args.debug:
             ep_cfg.logConfig.level = 10
             ep_cfg.logConfig.consoleLevel = 10
@@ -190,29 +323,56 @@ def main():
             ep_cfg.logConfig.level = 1
             ep_cfg.logConfig.consoleLevel = 1
         # do some logging
-        ep_cfg.logConfig.filename = "pjsua2.log"
+        ep_cfg.logConfig.filename = "pjsua2.log" if not sharded else "pjsua2.{}.log".format(args.worker)
         # disable the VAD
         ep_cfg.medConfig.noVad = True
+        profile = mediaProfileFromArgs(args)
+        profile.apply(ep_cfg)
+        # the native-rate echo mode sets its own clock rate over the profile
+        configureEcho(ep_cfg, args.echoMode, args.echoClockRate)
+        if args.echoMode == "native-rate":
+            profile = profile.override(clockRate=args.echoClockRate, sndClockRate=args.echoClockRate, channelCount=1)
+        print("*** media profile: {} ***".format(profile))
 
         # disable the echo cancelation
         # ep_cfg.medConfig.setEcOptions(pj.PJMEDIA_ECHO_USE_SW_ECHO)
 
         ep.libInit(ep_cfg)
+        if args.threads > 0:
+            # the dispatcher thread registers itself by libRegisterThread()
+            callbackBridge.start()
 
         # add some config
         tcfg = pj.TransportConfig()
-        tcfg.port = 5060
+        tcfg.port = args.port
+        if sharded and args.shardMode in ("aor", "contact"):
+            tcfg.port = args.port + args.worker
+        elif sharded:
+            tcfg.sockOptParams.sockOpts.append(reusePortOption())
         ep.transportCreate(pj.PJSIP_TRANSPORT_UDP, tcfg)
+        # quitPJSUA() from other threads interrupts the event polling,
+        # with reuseport the wakeup datagram may go to another worker, so the poll is only bounded
+        if not (sharded and args.shardMode == "reuseport"):
+            controlLoop.setWakeupTransport(tcfg.port)
 
         # add account config
         acc_cfg = pj.AccountConfig()
-        acc_cfg.idUri = "sip:{}@{}".format(args.username,
+        username = args.username
+        if sharded and args.shardMode == "aor":
+            # a user per worker, a call to it reaches this worker only
+            username = args.workerUser.format(username=args.username, worker=args.worker)
+        acc_cfg.idUri = "sip:{}@{}".format(username,
                                            re.findall("sip:(.*)", args.registrarURI)[0])
-        print("*** start sending SIP REGISTER ***")
-        acc_cfg.regConfig.registrarUri = args.registrarURI
+        if sharded and args.shardMode == "reuseport":
+            # the REGISTER responses and refreshes may be delivered to any worker,
+            # which has no transaction for them, so no worker registers
+            print("*** worker {} doesn't register, the proxy routes to port {} ***".format(args.worker, args.port))
+        else:
+            print("*** start sending SIP REGISTER ***")
+            acc_cfg.regConfig.registrarUri = args.registrarURI
 
         # if there needed credential to login, just add following lines
-        cred = pj.AuthCredInfo("digest", "*", args.username, 0, args.password)
+        cred = pj.AuthCredInfo("digest", "*", username, 0, args.password)
         acc_cfg.sipConfig.authCreds.append(cred)
 
         acc = Account()
@@ -224,8 +384,26 @@ def main():
         # use null device as conference bridge, instead of local sound card
         pj.Endpoint.instance().audDevManager().setNullDev()
 
-        # disable speex codec
-        ep.codecSetPriority("speex", 0)
+        print("*** codec policy: {} ***".format(codecPolicy))
+        try:
+            # the echo mode restriction is checked with the policy, before any codec is changed
+            warnings = codecPolicy.apply(ep, codecFilter(args.echoMode, args.echoClockRate))
+        except ValueError as e:
+            print("*** can't start: {} (echo mode {}, --echoClockRate {}) ***".format(
+                e, args.echoMode, args.echoClockRate))
+            del acc
+            return
+        for warning in warnings:
+            print("*** codec policy warning: {} ***".format(warning))
+        print("*** echo mode {}, codec: {} ***".format(
+            args.echoMode, [codec.codecId for codec in ep.codecEnum2() if codec.priority > 0]))
+        for warning in profile.validate(ep, ep_cfg.uaConfig.maxCalls):
+            print("*** media profile warning: {} ***".format(warning))
+        bridgeUsage = BridgeUsage(ep)
+        if args.cpuProfile:
+            profiler = CallCpuProfiler(ep)
+        if args.bridgeReport > 0:
+            controlLoop.callEvery(args.bridgeReport, bridgeUsage.sample)
 
         # enumerate current supported codec
         print("*** supported codec(priority 0 means disable) ***")
@@ -236,6 +414,19 @@ def main():
         # sleep forever
         sleep4PJSUA2(-1)
 
+        # the loop is quit, let it send the BYEs and handle their callbacks
+        resetPJSUA()
+        ep.hangupAllCalls()
+        sleep4PJSUA2(1)
+
+        # run the callbacks which are still queued
+        callbackBridge.stop()
+        print("*** callback bridge: {} dispatched ***".format(callbackBridge.dispatched))
+        print("*** bridge slots: {} ***".format(bridgeUsage.stats()))
+        print("*** codec usage: {} ***".format(codecUsage.stats()))
+        if profiler:
+            print("*** CPU profile ***\n{}".format(profiler.format()))
+        print("*** getInfo() snapshot cache: {} ***".format(infoCacheStats()))
         print("*** PJSUA2 SHUTTING DOWN ***")
         del acc
 
@@ -248,8 +439,10 @@ def main():
         except Exception as e:
             print("catch exception!!, exception error is: {}".format(e.args))
             traceback.print_exception(*sys.exc_info())
-            # close the log file descriptor
-            f.close()
+        # flush the pending call reports
+        if sink:
+            sink.close()
+            print("*** call report: {} ***".format(sink.stats()))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,175 @@
+#!/bin/env python3
+"""chromaprint fingerprint backends of AudioSimilar
+
+a backend turns a wav file, or a pcm buffer which never touched the disk,
+into the raw chromaprint fingerprint (uint32 numpy array).
+
+- ChromaprintBackend: calls libchromaprint in process through ctypes
+- FpcalcBackend: forks the fpcalc command, kept for compatibility
+"""
+import ctypes
+import ctypes.util
+import os
+import subprocess
+import tempfile
+import wave
+
+import numpy
+
+# CHROMAPRINT_ALGORITHM_DEFAULT of chromaprint.h, the one fpcalc uses
+CHROMAPRINT_ALGORITHM_DEFAULT = 1
+
+
+def as_fingerprints(fingerprints):
+    """convert a fingerprint list into a uint32 numpy array,
+    signed values (printed by old fpcalc) are wrapped into uint32"""
+    if isinstance(fingerprints, numpy.ndarray) and fingerprints.dtype == numpy.uint32:
+        return fingerprints
+    return numpy.asarray(fingerprints, dtype=numpy.int64).astype(numpy.uint32)
+
+
+def parse_fpcalc(fpcalc_out):
+    """parse the "FINGERPRINT=..." output of `fpcalc -raw`"""
+    fingerprint_index = fpcalc_out.find('FINGERPRINT=') + 12
+    fingerprint = fpcalc_out[fingerprint_index:].splitlines()[0]
+    return as_fingerprints(list(map(int, fingerprint.split(','))))
+
+
+class PcmBuffer:
+    """interleaved 16 bits pcm samples in memory
+
+    Args:
+        samples (numpy.ndarray): the samples, float samples in [-1, 1] are scaled to int16
+        sample_rate (int): the sample rate (Hz) of samples
+        channels (int): number of interleaved channels
+    """
+
+    def __init__(self, samples, sample_rate, channels=1):
+        samples = numpy.asarray(samples)
+        if samples.dtype.kind == 'f':
+            samples = numpy.clip(samples, -1.0, 1.0) * 32767
+        self.samples = numpy.ascontiguousarray(samples, dtype=numpy.int16)
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+    @classmethod
+    def fromWav(cls, filename):
+        with wave.open(filename, "rb") as w:
+            if w.getsampwidth() != 2:
+                raise ValueError("only 16 bits wav is supported: {}".format(filename))
+            samples = numpy.frombuffer(w.readframes(w.getnframes()), dtype="<i2")
+            return cls(samples, w.getframerate(), w.getnchannels())
+
+    def head(self, seconds):
+        """the first seconds of the buffer"""
+        return PcmBuffer(self.samples[:int(seconds * self.sample_rate) * self.channels],
+                         self.sample_rate, self.channels)
+
+    def toWav(self, filename):
+        with wave.open(filename, "wb") as w:
+            w.setnchannels(self.channels)
+            w.setsampwidth(2)
+            w.setframerate(self.sample_rate)
+            w.writeframes(self.samples.astype("<i2").tobytes())
+
+
+class FingerprintBackend:
+    """interface of the fingerprint backends"""
+
+    def fingerprint_file(self, filename, sample_time):
+        """fingerprint the first sample_time seconds of a wav file"""
+        return self.fingerprint_pcm(PcmBuffer.fromWav(filename), sample_time)
+
+    def fingerprint_pcm(self, pcm, sample_time):
+        """fingerprint the first sample_time seconds of a PcmBuffer"""
+        raise NotImplementedError
+
+
+class FpcalcBackend(FingerprintBackend):
+    """fork `fpcalc -raw` for every fingerprint, pcm buffers go through a temp wav"""
+
+    def __init__(self, fpcalc='fpcalc'):
+        self.fpcalc = fpcalc
+
+    def fingerprint_file(self, filename, sample_time):
+        fpcalc_out = subprocess.check_output(
+            [self.fpcalc, '-raw', '-length', str(sample_time), filename]).decode()
+        return parse_fpcalc(fpcalc_out)
+
+    def fingerprint_pcm(self, pcm, sample_time):
+        fd, filename = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            pcm.toWav(filename)
+            return self.fingerprint_file(filename, sample_time)
+        finally:
+            os.remove(filename)
+
+
+class ChromaprintBackend(FingerprintBackend):
+    """feed the pcm to libchromaprint in process, no fork and no temp file"""
+
+    def __init__(self, library=None):
+        library = library or ctypes.util.find_library('chromaprint')
+        if not library:
+            raise OSError("libchromaprint is not found")
+        self.library = library
+        lib = ctypes.CDLL(library)
+
+        lib.chromaprint_new.argtypes = [ctypes.c_int]
+        lib.chromaprint_new.restype = ctypes.c_void_p
+        lib.chromaprint_free.argtypes = [ctypes.c_void_p]
+        lib.chromaprint_free.restype = None
+        lib.chromaprint_start.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int]
+        lib.chromaprint_start.restype = ctypes.c_int
+        lib.chromaprint_feed.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int]
+        lib.chromaprint_feed.restype = ctypes.c_int
+        lib.chromaprint_finish.argtypes = [ctypes.c_void_p]
+        lib.chromaprint_finish.restype = ctypes.c_int
+        lib.chromaprint_get_raw_fingerprint.argtypes = [
+            ctypes.c_void_p, ctypes.POINTER(ctypes.POINTER(ctypes.c_uint32)), ctypes.POINTER(ctypes.c_int)]
+        lib.chromaprint_get_raw_fingerprint.restype = ctypes.c_int
+        lib.chromaprint_dealloc.argtypes = [ctypes.c_void_p]
+        lib.chromaprint_dealloc.restype = None
+        self.lib = lib
+
+    def __reduce__(self):
+        # the ctypes handle can't be pickled, reload the library in the
+        # process pool workers instead
+        return (ChromaprintBackend, (self.library,))
+
+    def fingerprint_pcm(self, pcm, sample_time):
+        pcm = pcm.head(sample_time)
+        lib = self.lib
+        ctx = lib.chromaprint_new(CHROMAPRINT_ALGORITHM_DEFAULT)
+        if not ctx:
+            raise MemoryError("chromaprint_new failed")
+        try:
+            if not lib.chromaprint_start(ctx, pcm.sample_rate, pcm.channels):
+                raise RuntimeError("chromaprint_start failed")
+            # chromaprint_feed takes the number of samples of all channels
+            if not lib.chromaprint_feed(ctx, pcm.samples.ctypes.data, len(pcm.samples)):
+                raise RuntimeError("chromaprint_feed failed")
+            if not lib.chromaprint_finish(ctx):
+                raise RuntimeError("chromaprint_finish failed")
+
+            raw = ctypes.POINTER(ctypes.c_uint32)()
+            size = ctypes.c_int()
+            if not lib.chromaprint_get_raw_fingerprint(ctx, ctypes.byref(raw), ctypes.byref(size)):
+                raise RuntimeError("chromaprint_get_raw_fingerprint failed")
+            try:
+                if size.value == 0:
+                    return numpy.zeros(0, dtype=numpy.uint32)
+                return numpy.ctypeslib.as_array(raw, shape=(size.value,)).copy()
+            finally:
+                lib.chromaprint_dealloc(raw)
+        finally:
+            lib.chromaprint_free(ctx)
+
+
+def default_backend():
+    """libchromaprint when it is installed, otherwise fpcalc"""
+    try:
+        return ChromaprintBackend()
+    except OSError:
+        return FpcalcBackend()
@@ -0,0 +1,163 @@
+#!/bin/env python3
+"""content addressed cache of the fingerprints of AudioSimilar
+
+the key is the hash of the audio content plus the sample_time, so an
+overwritten recording never hits a stale entry.
+
+- memory tier: LRU of the latest max_entries fingerprints
+- disk tier (optional): one raw little endian uint32 file per fingerprint,
+  the oldest used files are evicted once max_disk_bytes is exceeded
+"""
+from collections import OrderedDict
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy
+
+from fingerprint import PcmBuffer
+
+# file extension of the fingerprints in the disk tier
+SUFFIX = ".u32"
+
+
+class FingerprintCache:
+    def __init__(self, max_entries=128, directory=None, max_disk_bytes=64 * 1024 * 1024):
+        """
+        Args:
+            max_entries (int): number of fingerprints kept in memory
+            directory (str): directory of the disk tier, None disables it
+            max_disk_bytes (int): size bound of the disk tier
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.disk_bytes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            for name in os.listdir(directory):
+                if name.endswith(SUFFIX):
+                    self.disk_bytes += os.path.getsize(os.path.join(directory, name))
+
+    @staticmethod
+    def key(source, sample_time):
+        """hash the content of a wav file or a PcmBuffer"""
+        digest = hashlib.sha1()
+        if isinstance(source, PcmBuffer):
+            digest.update("pcm:{}:{}:".format(source.sample_rate, source.channels).encode())
+            digest.update(source.samples.tobytes())
+        else:
+            with open(source, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+        return "{}-{}".format(digest.hexdigest(), sample_time)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key):
+        with self.lock:
+            fingerprints = self.memory.get(key)
+            if fingerprints is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return fingerprints
+
+        if self.directory:
+            path = self._path(key)
+            try:
+                fingerprints = numpy.fromfile(path, dtype="<u4").astype(numpy.uint32)
+                # mark it as recently used for the eviction
+                os.utime(path)
+            except OSError:
+                fingerprints = None
+            if fingerprints is not None:
+                with self.lock:
+                    self.disk_hits += 1
+                    self._remember(key, fingerprints)
+                return fingerprints
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, fingerprints):
+        fingerprints = numpy.asarray(fingerprints, dtype=numpy.uint32)
+        with self.lock:
+            self._remember(key, fingerprints)
+
+        if self.directory:
+            path = self._path(key)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(fingerprints.astype("<u4").tobytes())
+            existed = os.path.exists(path)
+            os.replace(tmp, path)
+            if not existed:
+                with self.lock:
+                    self.disk_bytes += fingerprints.nbytes
+                self._evict_disk()
+
+    def get_or_compute(self, source, sample_time, compute):
+        """return the cached fingerprint of source, compute(source) it on miss"""
+        key = self.key(source, sample_time)
+        fingerprints = self.get(key)
+        if fingerprints is None:
+            fingerprints = compute(source)
+            self.put(key, fingerprints)
+        return fingerprints
+
+    def _remember(self, key, fingerprints):
+        # caller holds the lock
+        self.memory[key] = fingerprints
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.evictions += 1
+
+    def _evict_disk(self):
+        if self.disk_bytes <= self.max_disk_bytes:
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+
+        with self.lock:
+            for mtime, size, path in entries:
+                if self.disk_bytes <= self.max_disk_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                self.disk_bytes -= size
+                self.evictions += 1
+
+    def stats(self):
+        """hit/miss counters of the cache"""
+        with self.lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "memory_entries": len(self.memory),
+                "disk_bytes": self.disk_bytes,
+            }
@@ -0,0 +1,153 @@
+import os
+import queue
+import socket
+import threading
+import time
+
+# tells the writer thread to stop
+_STOP = object()
+
+
+class ReportSink:
+    """write the call reports from a background thread.
+
+    write() never blocks the pjsua callback, it puts the record into a bounded
+    queue, and counts it as dropped when the queue is full. the writer thread
+    keeps one file handle, writes the records in batches and flushes when
+    batch_size records are pending or flush_interval seconds are passed.
+    the file is rotated to path.1 ... path.<backup_count> past max_bytes
+    (counted in encoded bytes).
+    """
+
+    def __init__(self, path, max_queue=10000, batch_size=256, flush_interval=1.0,
+                 max_bytes=64 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        # dropped is counted by the producer threads and by the writer thread
+        self._droppedLock = threading.Lock()
+
+        self._file = open(path, "ab")
+        self._size = self._file.tell()
+        self._thread = threading.Thread(target=self._run, name="report-sink", daemon=True)
+        self._thread.start()
+
+    def write(self, record: str):
+        """queue a record, it returns False if the record is dropped"""
+        try:
+            self.queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self._drop(1)
+            return False
+
+    def _drop(self, n):
+        with self._droppedLock:
+            self.dropped += n
+
+    def _rotate(self):
+        self._file.close()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                src = "{}.{}".format(self.path, i)
+                if os.path.exists(src):
+                    os.replace(src, "{}.{}".format(self.path, i + 1))
+            os.replace(self.path, self.path + ".1")
+            self._file = open(self.path, "ab")
+        else:
+            self._file = open(self.path, "wb")
+        self._size = 0
+        self.rotations += 1
+
+    def _writeBatch(self, batch):
+        data = "".join(batch).encode()
+        if self._size > 0 and self._size + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+        self.written += len(batch)
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        stop = False
+        while not stop:
+            timeout = max(0, deadline - time.monotonic())
+            try:
+                record = self.queue.get(timeout=timeout)
+                if record is _STOP:
+                    stop = True
+                else:
+                    batch.append(record)
+                    # drain what is already queued, without waiting
+                    while len(batch) < self.batch_size:
+                        record = self.queue.get_nowait()
+                        if record is _STOP:
+                            stop = True
+                            break
+                        batch.append(record)
+            except queue.Empty:
+                pass
+
+            if batch and (stop or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                try:
+                    self._writeBatch(batch)
+                except OSError as e:
+                    print("can't write the report: {}".format(e.args))
+                    self._drop(len(batch))
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+
+        self._file.close()
+
+    def close(self):
+        """flush the pending records and stop the writer thread"""
+        self.queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped,
+                "pending": self.queue.qsize(), "rotations": self.rotations}
+
+
+class ReportForwarder:
+    """the ReportSink of a sharded worker, it sends every record as one
+    datagram to the unix socket of the supervisor, which writes server.log.
+
+    like ReportSink.write(), write() never blocks, the record is dropped when
+    the socket buffer is full or the supervisor is gone.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.written = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+
+    def write(self, record: str):
+        try:
+            self._sock.sendto(record.encode(), self.address)
+        except OSError:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.written += 1
+        return True
+
+    def close(self):
+        self._sock.close()
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped}
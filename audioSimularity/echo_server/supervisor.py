@@ -0,0 +1,141 @@
+import os
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# a worker which lives longer than this (second) is healthy again,
+# its next crash is restarted without backoff
+HEALTHY_TIME = 60.0
+
+
+class Worker:
+    """one echo server process of the Supervisor"""
+
+    def __init__(self, index):
+        self.index = index
+        self.proc = None
+        self.started = 0.0
+        self.restarts = 0
+        self.backoff = 0.0
+        # the time it is restarted at, None if it is running
+        self.restartAt = None
+
+
+class Supervisor:
+    """run N echo server workers, each one with its own pjsua Endpoint, so the
+    calls are handled by N python interpreters.
+
+    the workers are started as `python3 echo_server.py <argv> --worker i`,
+    a crashed worker is restarted with an exponential backoff. every worker
+    sends its call reports to the unix socket of the supervisor (see
+    ReportForwarder), the supervisor merges them into one ReportSink.
+    """
+
+    def __init__(self, script, argv, workers, sink, restartDelay=1.0, maxRestartDelay=30.0):
+        """
+        Args:
+            script (str): path of echo_server.py
+            argv (list): the command line arguments passed to every worker
+            workers (int): the number of workers
+            sink (ReportSink): where the merged call reports are written
+            restartDelay (float): the first delay(second) before a crashed worker is restarted
+            maxRestartDelay (float): the longest restart delay(second)
+        """
+        self.script = script
+        self.argv = argv
+        self.sink = sink
+        self.restartDelay = restartDelay
+        self.maxRestartDelay = maxRestartDelay
+        self.workers = [Worker(i) for i in range(workers)]
+        self.received = 0
+        self._stop = False
+
+        self._dir = tempfile.mkdtemp(prefix="echo-server-")
+        self.reportAddress = os.path.join(self._dir, "report.sock")
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.reportAddress)
+        self._sock.setblocking(False)
+
+    def _spawn(self, worker):
+        cmd = [sys.executable, self.script] + self.argv + [
+            "--worker", str(worker.index), "--reportSocket", self.reportAddress]
+        worker.proc = subprocess.Popen(cmd)
+        worker.started = time.monotonic()
+        worker.restartAt = None
+        print("*** worker {} started, pid {} ***".format(worker.index, worker.proc.pid))
+
+    def _reap(self, now):
+        for worker in self.workers:
+            if worker.proc is None or worker.restartAt is not None:
+                continue
+            code = worker.proc.poll()
+            if code is None:
+                continue
+            if now - worker.started > HEALTHY_TIME:
+                worker.backoff = 0.0
+            worker.backoff = min(max(worker.backoff * 2, self.restartDelay), self.maxRestartDelay)
+            worker.restartAt = now + worker.backoff
+            worker.restarts += 1
+            print("*** worker {} exited with {}, restart in {:.1f}s ***".format(
+                worker.index, code, worker.backoff))
+
+    def _restart(self, now):
+        for worker in self.workers:
+            if worker.restartAt is not None and worker.restartAt <= now:
+                self._spawn(worker)
+
+    def _drain(self):
+        while True:
+            try:
+                data = self._sock.recv(65536)
+            except BlockingIOError:
+                return
+            self.received += 1
+            self.sink.write(data.decode())
+
+    def stop(self, *_):
+        """stop run(), it is safe to call from a signal handler"""
+        self._stop = True
+
+    def run(self):
+        """start the workers and watch them until stop() is called"""
+        for worker in self.workers:
+            self._spawn(worker)
+
+        selector = selectors.DefaultSelector()
+        selector.register(self._sock, selectors.EVENT_READ)
+        try:
+            while not self._stop:
+                if selector.select(timeout=0.5):
+                    self._drain()
+                now = time.monotonic()
+                self._reap(now)
+                self._restart(now)
+        finally:
+            selector.close()
+            self._shutdown()
+
+    def _shutdown(self, timeout=10.0):
+        running = [w.proc for w in self.workers if w.proc is not None and w.proc.poll() is None]
+        for proc in running:
+            proc.send_signal(signal.SIGTERM)
+        deadline = time.monotonic() + timeout
+        for proc in running:
+            try:
+                proc.wait(max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        # the reports sent by the workers before they exit
+        self._drain()
+        self._sock.close()
+        os.unlink(self.reportAddress)
+        os.rmdir(self._dir)
+
+    def stats(self):
+        return {"workers": len(self.workers), "reports": self.received,
+                "restarts": {w.index: w.restarts for w in self.workers}}
@@ -1,22 +1,95 @@
 import pprint
 import re
 import json
-import jsonpickle
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 DBG = 0
 
+# patterns of the pj.Call.dump() lines we care about
+CALL_STATUS_RE = re.compile(r"\[(.*)\]\ To: (.*)")
+CALL_TIME_RE = re.compile(
+    r"Call time: (\d{2}h:\d{2}m:\d{2}s), \d+st res in \d+ ms, conn in \d+ms")
+MEDIA_RE = re.compile(r"#(\d+) (\w+) (\w+) @(\w+), (\w+), peer=([\w\d\.:-]+)")
+LOSS_PERIOD_RE = re.compile(r"loss period:\s+([\d.]+)\s+([\d.]+)\s+([\d\.]+)")
+TOTAL_PKT_RE = re.compile(
+    r"total ([\d\.]+\w{0,1})pkt [\d\.]*\w{0,1}B \(([\d\.^\ ]+\w{0,1}B)")
+
+
+# multiplier of the unit suffix pjsua prints, e.g. "1.2K" or "230.4KB"
+UNITS = {"": 1, "K": 1000, "M": 1000 * 1000, "G": 1000 * 1000 * 1000}
+
+
+def parse_number(value):
+    """turn a pjsua human readable number, e.g. "1.2K" or "230.4KB", into an int
+
+    Args:
+        value (str): the number printed by pj.Call.dump(), may end with "B"
+
+    Returns:
+        int: the number, 0 if value can't be parsed
+    """
+    value = value.rstrip("B")
+    unit = value[-1:].upper()
+    if unit in UNITS:
+        value = value[:-1]
+    else:
+        unit = ""
+    try:
+        return int(round(float(value) * UNITS[unit]))
+    except ValueError:
+        return 0
+
+
+def dumps(obj):
+    """encode obj as a compact json string, with orjson if it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"))
+
 
 class PjsuaNetMatrics:
-    def __init__(self, name, pkt_loss_min, pkt_loss_avg, pkt_loss_max, total_packet_cnt, total_packet_size):
+    """rx or tx statistic of a media, packet count/size are plain ints
+    (packets and bytes) and the loss period are floats (msec).
+    raw_packet_cnt and raw_packet_size keep the strings printed by pjsua,
+    they are None unless the parser is asked to keep them.
+    """
+    __slots__ = ("type", "pkt_loss_min", "pkt_loss_avg", "pkt_loss_max",
+                 "total_packet_cnt", "total_packet_size",
+                 "raw_packet_cnt", "raw_packet_size")
+
+    def __init__(self, name, pkt_loss_min: float, pkt_loss_avg: float, pkt_loss_max: float, total_packet_cnt: int, total_packet_size: int,
+                 raw_packet_cnt=None, raw_packet_size=None):
         self.type = name
         self.pkt_loss_min = pkt_loss_min
         self.pkt_loss_avg = pkt_loss_avg
         self.pkt_loss_max = pkt_loss_max
         self.total_packet_cnt = total_packet_cnt
         self.total_packet_size = total_packet_size
+        self.raw_packet_cnt = raw_packet_cnt
+        self.raw_packet_size = raw_packet_size
+
+    def to_dict(self):
+        d = {
+            "type": self.type,
+            "pkt_loss_min": self.pkt_loss_min,
+            "pkt_loss_avg": self.pkt_loss_avg,
+            "pkt_loss_max": self.pkt_loss_max,
+            "total_packet_cnt": self.total_packet_cnt,
+            "total_packet_size": self.total_packet_size,
+        }
+        if self.raw_packet_cnt is not None:
+            d["raw_packet_cnt"] = self.raw_packet_cnt
+            d["raw_packet_size"] = self.raw_packet_size
+        return d
 
 
 class PjsuaMediaMatrics:
+    __slots__ = ("id", "media_type", "codec", "sample_rate", "peer_ip", "rx", "tx")
+
     def __init__(self, id: int, media_type: str, codec: str, sample_rate: str, peer_ip: str, rx: PjsuaNetMatrics, tx: PjsuaNetMatrics):
         self.id = id
         self.media_type = media_type
@@ -26,87 +99,86 @@ class PjsuaMediaMatrics:
         self.rx = rx
         self.tx = tx
 
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "media_type": self.media_type,
+            "codec": self.codec,
+            "sample_rate": self.sample_rate,
+            "peer_ip": self.peer_ip,
+            "rx": self.rx.to_dict(),
+            "tx": self.tx.to_dict(),
+        }
+
 
 class PjsuaLogParser:
-    def __init__(self, call_id):
+    __slots__ = ("call_id", "call_status", "media", "dst_URI", "call_time", "keep_raw")
+
+    def __init__(self, call_id, keep_raw=False):
+        """
+        Args:
+            call_id (str): the call id string of the dumped call
+            keep_raw (bool): also keep the packet count/size strings printed by pjsua
+        """
         self.call_id = call_id
+        self.keep_raw = keep_raw
         self.call_status = None
         self.media = {}
         self.dst_URI = None
         self.call_time = None
 
-    def toJSON(self):
-        return json.loads(str(jsonpickle.encode(self, unpicklable=False)))
-        # return jsonpickle.encode(self)
-
-    def _update(self, data):
-        # unpack the data
-        data = data[0]
-
-        # first line has the call status
-        call_status_match = re.match(r"\[(.*)\]\ To: (.*)", data[0])
-        if call_status_match:
-            self.call_status, self.dst_URI = call_status_match.groups()
-
-        # process the media part, and call time period part
-        data = data[1]
-
-        i = 0
-        while i < len(data):
-
-            # only media has list
-            if isinstance(data[i], list):
-                raise ValueError(
-                    'data get list, expect string: {}'.format(data[i]))
-
-            call_time_match = re.match(
-                r"Call time: (\d{2}h:\d{2}m:\d{2}s), \d+st res in \d+ ms, conn in \d+ms", data[i])
-            media_match = re.match(
-                r"#(\d+) (\w+) (\w+) @(\w+), (\w+), peer=([\w\d\.:-]+)", data[i])
-
-            if call_time_match:
-                self.call_time = call_time_match.groups()[0]
+    def to_dict(self):
+        return {
+            "call_id": self.call_id,
+            "call_status": self.call_status,
+            "media": {media_id: media.to_dict() for media_id, media in self.media.items()},
+            "dst_URI": self.dst_URI,
+            "call_time": self.call_time,
+        }
 
-            if media_match:
-                media_id, media_type, codec, sample_rate, media_attr, peer_ip = media_match.groups()
-
-                # next list contain the media message
-                i += 1
-
-                rx_data = data[i][2]
-                tx_data = data[i][4]
+    def toJSON(self):
+        # kept for the old callers, it is the same dict as to_dict()
+        return self.to_dict()
 
-                rx_loss_match = re.match(
-                    r"loss period:\s+([\d.]+)\s+([\d.]+)\s+([\d\.]+)", rx_data[3])
-                tx_loss_match = re.match(
-                    r"loss period:\s+([\d.]+)\s+([\d.]+)\s+([\d\.]+)", tx_data[3])
+    def dumps(self):
+        """encode the statistics as a json string, e.g. to write it to disk.
+        orjson is used when it is installed, otherwise the json module.
 
-                # print(rx_data[0])
-                # print(re.findall(r"total (\d+)pkt [\d\.]*.{0,1}B \(([\d\.^\ ]+).{0,1}B", rx_data[0])[0])
-                rx_packets_cnt = rx_packets_size = tx_packets_cnt = tx_packets_size ="0kB" 
-                try:
-                    rx_packets_cnt, rx_packets_size = re.findall(r"total ([\d\.]+\w{0,1})pkt [\d\.]*\w{0,1}B \(([\d\.^\ ]+\w{0,1}B)", rx_data[0])[0]
-                    tx_packets_cnt, tx_packets_size = re.findall(r"total ([\d\.]+\w{0,1})pkt [\d\.]*\w{0,1}B \(([\d\.^\ ]+\w{0,1}B)", tx_data[0])[0]
-                except Exception as e:
-                    print(e.args)
+        Returns:
+            str: the json string of to_dict()
+        """
+        return dumps(self.to_dict())
 
+    def _net_matrics(self, name, packets_cnt, packets_size, loss):
+        loss = [None if period is None else float(period) for period in loss]
+        if self.keep_raw:
+            return PjsuaNetMatrics(name, *loss, parse_number(packets_cnt), parse_number(packets_size),
+                                   packets_cnt, packets_size)
+        return PjsuaNetMatrics(name, *loss, parse_number(packets_cnt), parse_number(packets_size))
 
-                rx = PjsuaNetMatrics(
-                    "rx packet loss period", *rx_loss_match.groups(), rx_packets_cnt, rx_packets_size)
-                tx = PjsuaNetMatrics(
-                    "tx packet loss period", *tx_loss_match.groups(), tx_packets_cnt, tx_packets_size)
+    def _emit(self, media, stats):
+        media_id, media_type, codec, sample_rate, media_attr, peer_ip = media
+        rx = self._net_matrics("rx packet loss period", *stats["rx"])
+        tx = self._net_matrics("tx packet loss period", *stats["tx"])
 
-                self.media[media_id] = PjsuaMediaMatrics(
-                    media_id, media_type, codec, sample_rate, peer_ip, rx, tx)
-            i += 1
+        self.media[media_id] = PjsuaMediaMatrics(
+            media_id, media_type, codec, sample_rate, peer_ip, rx, tx)
 
     def parseIndent(self, lines):
+        """parse the output of pj.Call.dump() line by line, in a single pass.
+        the indentation only tells which block a line belongs to, the
+        PjsuaMediaMatrics are emitted as soon as their block ends.
+
+        Args:
+            lines (str | Iterable[str]): the dump string, or its lines
+        """
         if isinstance(lines, str):
             lines = lines.split('\n')
-        indentation = []
-        data = []
-        indentation.append(-1)
-        depth = 0
+        indentation = [-1]
+        # header of the media block we are in, and its rx/tx stats
+        media = None
+        stats = None
+        direction = None
         for line in lines:
             # remove newline and extra-space
             line = line.rstrip()
@@ -120,33 +192,69 @@ class PjsuaLogParser:
             indent = len(line) - len(content)
 
             if indent > indentation[-1]:
-                depth += 1
                 indentation.append(indent)
-                data.append([])
-
             elif indent < indentation[-1]:
                 while indent < indentation[-1]:
-                    depth -= 1
                     indentation.pop()
-                    top = data.pop()
-                    data[-1].append(top)
 
                 if indent != indentation[-1]:
                     raise RuntimeError("Bad Format")
 
-            data[-1].append(content)
+            depth = len(indentation) - 1
             if DBG:
                 print("******** process indent {} ********".format(depth))
                 print(content)
                 print("******** end process indent {} ********".format(depth))
 
-        # tidy up the unpacked element
-        while len(data) > 1:
-            top = data.pop()
-            data[-1].append(top)
-
-        self._update(data)
-        return data
+            # rx/tx statistic lines, "total ..." and "loss period: ..."
+            if depth == 4:
+                if direction is None:
+                    continue
+                if content.startswith("total"):
+                    total_match = TOTAL_PKT_RE.search(content)
+                    if total_match:
+                        direction[0], direction[1] = total_match.groups()
+                elif content.startswith("loss period"):
+                    loss_match = LOSS_PERIOD_RE.match(content)
+                    if loss_match:
+                        direction[2] = loss_match.groups()
+
+            # the "RX pt=..." and "TX pt=..." line open a statistic block
+            elif depth == 3:
+                if media is None:
+                    continue
+                direction = stats.get(content[:2].lower())
+
+            # call time line and media header
+            elif depth == 2:
+                if media is not None:
+                    self._emit(media, stats)
+                    media = None
+                direction = None
+
+                media_match = MEDIA_RE.match(content)
+                if media_match:
+                    media = media_match.groups()
+                    stats = {
+                        "rx": ["0kB", "0kB", (None, None, None)],
+                        "tx": ["0kB", "0kB", (None, None, None)],
+                    }
+                    continue
+
+                call_time_match = CALL_TIME_RE.match(content)
+                if call_time_match:
+                    self.call_time = call_time_match.groups()[0]
+
+            # first line has the call status
+            elif depth == 1:
+                call_status_match = CALL_STATUS_RE.match(content)
+                if call_status_match:
+                    self.call_status, self.dst_URI = call_status_match.groups()
+
+        if media is not None:
+            self._emit(media, stats)
+
+        return self
 
 
 if __name__ == '__main__':
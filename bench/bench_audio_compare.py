@@ -0,0 +1,73 @@
+"""benchmark of AudioSimilar.compare against the former pure python popcount loop
+
+usage: python3 bench/bench_audio_compare.py [--span 100] [--seconds 1000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "audioSimularity", "echo_server"))
+from audio_compare import AudioSimilar
+
+# chromaprint generates about 8 fingerprints per second of audio
+FINGERPRINTS_PER_SECOND = 8
+
+
+def loop_compare(listx, listy, span, step, min_overlap):
+    """the former implementation, one interpreted popcount per element"""
+    corr_xy = []
+    for offset in range(-span, span + 1, step):
+        x, y = listx, listy
+        if offset > 0:
+            x = x[offset:]
+            y = y[:len(x)]
+        elif offset < 0:
+            y = y[-offset:]
+            x = x[:len(y)]
+        if min(len(x), len(y)) < min_overlap:
+            corr_xy.append(None)
+            continue
+        length = min(len(x), len(y))
+        covariance = 0
+        for i in range(length):
+            covariance += 32 - bin(x[i] ^ y[i]).count("1")
+        corr_xy.append(covariance / float(length) / 32)
+    return corr_xy
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--span", type=int, default=100,
+                        help="offsets scanned are -span..span, default 100")
+    parser.add_argument("--seconds", type=int, default=1000,
+                        help="length of the fingerprinted audio, default 1000")
+    args = parser.parse_args()
+
+    rng = numpy.random.default_rng(0)
+    size = args.seconds * FINGERPRINTS_PER_SECOND
+    source = rng.integers(0, 1 << 32, size, dtype=numpy.uint32)
+    # the target is the source shifted by 42 points, with some noise bits
+    target = numpy.roll(source, 42) ^ (rng.integers(0, 1 << 32, size, dtype=numpy.uint32)
+                                       & rng.integers(0, 1 << 32, size, dtype=numpy.uint32)
+                                       & rng.integers(0, 1 << 32, size, dtype=numpy.uint32))
+
+    similar = AudioSimilar(span=args.span)
+
+    start = time.perf_counter()
+    loop_corr = loop_compare(source.tolist(), target.tolist(), args.span, similar.step, similar.min_overlap)
+    loop_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    corr = similar.compare(source, target, args.span, similar.step)
+    elapsed = time.perf_counter() - start
+
+    assert corr == loop_corr, "vectorized correlation differs from the loop"
+    print("span={} fingerprints={}: loop {:.3f}s, vectorized {:.3f}s, speedup x{:.1f}".format(
+        args.span, size, loop_elapsed, elapsed, loop_elapsed / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""A/B benchmark of the echo modes of the echo server (see utils/echoMode.py)
+
+the endpoint calls itself N times over the loopback: the caller legs play a
+tone, the callee legs echo it back. every mode runs in its own process, the
+CPU time of the process is measured over the steady state and reported per
+call-second. the caller legs cost the same in both modes, so the difference
+is the cost of the echo path.
+
+usage: python3 bench/bench_echo_mode.py [-n 20] [-t 20] [--codec PCMU/8000]
+it needs pjsua2
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pjsua2 as pj
+from utils.controlLoop import controlLoop
+from utils.echoMode import ECHO_MODES, configureEcho, restrictCodecs, startEcho
+
+
+class EchoCall(pj.Call):
+    def onCallMediaState(self, prm):
+        try:
+            startEcho(self.getAudioMedia(-1))
+        except pj.Error as e:
+            print("exception!!: {}".format(e.info()))
+
+
+class ToneCall(pj.Call):
+    def __init__(self, acc):
+        pj.Call.__init__(self, acc)
+        self.tone = None
+
+    def onCallMediaState(self, prm):
+        try:
+            aud_med = self.getAudioMedia(-1)
+        except pj.Error:
+            return
+        if self.tone is None:
+            tone = pj.ToneDesc()
+            tone.freq1 = 440
+            tone.freq2 = 880
+            tone.on_msec = 1000
+            tone.off_msec = 0
+            tones = pj.ToneDescVector()
+            tones.append(tone)
+            self.tone = pj.ToneGenerator()
+            self.tone.createToneGenerator()
+            self.tone.play(tones, True)
+        self.tone.startTransmit(aud_med)
+
+
+class Account(pj.Account):
+    def __init__(self):
+        pj.Account.__init__(self)
+        self.calls = []
+
+    def onIncomingCall(self, iprm):
+        call = EchoCall(self, iprm.callId)
+        self.calls.append(call)
+        call_prm = pj.CallOpParam()
+        call_prm.statusCode = 200
+        call.answer(call_prm)
+
+
+def cpuTime():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def runMode(mode, calls, seconds, codec, port):
+    ep = pj.Endpoint()
+    ep.libCreate()
+    ep_cfg = pj.EpConfig()
+    ep_cfg.uaConfig.threadCnt = 0
+    ep_cfg.uaConfig.mainThreadOnly = True
+    ep_cfg.uaConfig.maxCalls = 2 * calls + 2
+    ep_cfg.logConfig.level = 0
+    ep_cfg.logConfig.consoleLevel = 0
+    ep_cfg.medConfig.noVad = True
+    configureEcho(ep_cfg, mode)
+    ep.libInit(ep_cfg)
+
+    tcfg = pj.TransportConfig()
+    tcfg.port = port
+    ep.transportCreate(pj.PJSIP_TRANSPORT_UDP, tcfg)
+    controlLoop.setWakeupTransport(port)
+    ep.libStart()
+    ep.audDevManager().setNullDev()
+
+    # the same codec in both modes, only the bridge differs
+    restrictCodecs(ep, mode)
+    ep.codecSetPriority(codec, 255)
+
+    acc_cfg = pj.AccountConfig()
+    acc_cfg.idUri = "sip:echo@127.0.0.1:{}".format(port)
+    acc = Account()
+    acc.create(acc_cfg)
+
+    callers = []
+    for _ in range(calls):
+        call = ToneCall(acc)
+        call.makeCall(acc_cfg.idUri, pj.CallOpParam(True))
+        callers.append(call)
+
+    # wait for the media of every call, then let the jitter buffers settle
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline and sum(c.tone is not None for c in callers) < calls:
+        controlLoop.run(0.1)
+    controlLoop.run(1.0)
+
+    cpu = cpuTime()
+    elapsed = controlLoop.run(seconds)
+    cpu = cpuTime() - cpu
+    active = sum(c.tone is not None for c in callers)
+
+    ep.hangupAllCalls()
+    controlLoop.reset()
+    controlLoop.run(1.0)
+    del callers
+    acc.calls.clear()
+    del acc
+    ep.libDestroy()
+
+    return {
+        "mode": mode,
+        "calls": calls,
+        "active": active,
+        "seconds": round(elapsed, 3),
+        "cpu_s": round(cpu, 3),
+        "cpu_ms_per_call_second": round(cpu * 1000 / (max(active, 1) * elapsed), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="A/B benchmark of the echo modes")
+    parser.add_argument("-n", "--calls", type=int, default=20, help="echoed calls at the same time, default 20")
+    parser.add_argument("-t", "--seconds", type=float, default=20, help="measured time(second), default 20")
+    parser.add_argument("--codec", default="PCMU/8000", help="the codec of every call, default PCMU/8000")
+    parser.add_argument("--port", type=int, default=5090, help="the SIP port of the benchmark, default 5090")
+    parser.add_argument("--mode", choices=ECHO_MODES, default=None,
+                        help="run only this mode in this process and print its result as json")
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        print(json.dumps(runMode(args.mode, args.calls, args.seconds, args.codec, args.port)))
+        return
+
+    results = []
+    for mode in ECHO_MODES:
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--mode", mode, "-n", str(args.calls),
+             "-t", str(args.seconds), "--codec", args.codec, "--port", str(args.port)],
+            check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    print("{:<12} {:>6} {:>8} {:>10} {:>22}".format("mode", "calls", "time(s)", "cpu(s)", "cpu ms/call-second"))
+    for r in results:
+        print("{:<12} {:>6} {:>8} {:>10} {:>22}".format(
+            r["mode"], r["calls"], r["seconds"], r["cpu_s"], r["cpu_ms_per_call_second"]))
+    base = results[0]["cpu_ms_per_call_second"]
+    for r in results[1:]:
+        if r["cpu_ms_per_call_second"] > 0:
+            print("{}: x{:.2f} less cpu than {}".format(
+                r["mode"], base / r["cpu_ms_per_call_second"], results[0]["mode"]))
+
+
+if __name__ == '__main__':
+    main()
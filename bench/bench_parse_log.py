@@ -0,0 +1,56 @@
+"""micro-benchmark of PjsuaLogParser, parse N synthetic pj.Call.dump() outputs
+
+usage: python3 bench/bench_parse_log.py [-n 100000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.parseLog import PjsuaLogParser
+
+DUMP_TEMPLATE = """[CONFIRMED] To: <sip:{uri}@kamailio>;tag={tag}
+    Call time: 00h:00m:{sec:02d}s, 1st res in 45 ms, conn in 50ms
+    #0 audio PCMU @8kHz, sendrecv, peer=10.0.0.{host}:4000
+       SRTP status: Not active Crypto-suite: 
+       RX pt=0, last update:00h:00m:00.012s ago
+          total {pkt}pkt 80.0KB (100.0KB +IP hdr) @avg=64.0Kbps/80.0Kbps
+          pkt loss=0 (0.0%), discrd=0 (0.0%), dup=0 (0.0%), reord=0 (0.0%)
+                (msec)    min     avg     max     last    dev
+          loss period:   0.000   1.250   4.000   0.000   0.000
+          jitter     :   0.125   1.234   3.000   1.000   0.500
+       TX pt=0, ptime=20, last update:00h:00m:00.020s ago
+          total {pkt}pkt 80.0KB (99.5KB +IP hdr) @avg=64.0Kbps/80.0Kbps
+          pkt loss=0 (0.0%), dup=0 (0.0%), reorder=0 (0.0%)
+                (msec)    min     avg     max     last    dev
+          loss period:   0.000   0.000   0.000   0.000   0.000
+          jitter     :   0.000   0.000   0.000   0.000   0.000
+       RTT msec      :   1.000   2.000   3.000   2.000   0.500
+"""
+
+
+def synthetic_dump(i):
+    return DUMP_TEMPLATE.format(uri=i % 100, tag=i, sec=i % 60, host=i % 250,
+                                pkt="1.2K" if i % 2 else "500")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=100000,
+                        help="number of synthetic dumps to parse, default 100000")
+    args = parser.parse_args()
+
+    dumps = [synthetic_dump(i) for i in range(args.number)]
+
+    start = time.perf_counter()
+    for i, dump in enumerate(dumps):
+        PjsuaLogParser("bench-call-{}".format(i)).parseIndent(dump)
+    elapsed = time.perf_counter() - start
+
+    print("parsed {} dumps in {:.3f}s, {:.1f}us/dump".format(
+        args.number, elapsed, elapsed / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
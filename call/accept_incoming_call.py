@@ -1,32 +1,31 @@
 import pjsua2 as pj
-from utils import sleep4PJSUA2, handleErr
+import asyncio
+from utils import controlLoop, handleErr, sleep4PJSUA2
+from utils.asyncPJSUA import AsyncAccount, AsyncCall, CallDisconnected, runPJSUA
 
 
-class Call(pj.Call):
+class Call(AsyncCall):
     """
     Call class, High level Python Call object, derived from pjsua2's Call object.
     there are Call class reference: https://www.pjsip.org/pjsip/docs/html/classpj_1_1Call.htm
     We may wants to implement our Call object to handle the "outgoing" call implement logic
     """
 
-    def __init__(self, acc, peer_uri='', chat=None, call_id=pj.PJSUA_INVALID_ID):
-        pj.Call.__init__(self, acc, call_id)
-        self.acc = acc
+    def __init__(self, acc, peer_uri='', chat=None, call_id=pj.PJSUA_INVALID_ID, loop=None):
+        AsyncCall.__init__(self, acc, call_id, loop)
         self.wav_player = None
 
     # override the function at original parent class
     # parent class's function can be called by super().onCallState()
+    # the callbacks run on the event pump thread, serve() awaits their events
     def onCallState(self, prm):
+        super().onCallState(prm)
         ci = self.getInfo()
         print("*** Call: {} [{}, {}]".format(ci.remoteUri,
               ci.lastStatusCode, ci.stateText))
 
-        # python do not do the gc of underlaying C++ library, we need to do it by ourself
-        if ci.stateText == "DISCONNCTD":
-            self.acc.removeCall(self)
-            del self
-
     def onCallMediaState(self, prm):
+        super().onCallMediaState(prm)
         # Deprecated: for PJSIP version 2.8 or earlier
         # ci = self.getInfo()
         # for mi in ci.media:
@@ -44,7 +43,9 @@ class Call(pj.Call):
             # get the "local" media
             aud_med = self.getAudioMedia(-1)
         except pj.Error as e:
-            handleErr(e)
+            # don't quit the event pump, serve() still awaits the call
+            handleErr(e, False)
+            return
 
         if not self.wav_player:
             self.wav_player = pj.AudioMediaPlayer()
@@ -54,23 +55,19 @@ class Call(pj.Call):
                 print("Exception!!: failed opening wav file")
                 del self.wav_player
                 self.wav_player = None
-                handleErr(e)
+                handleErr(e, False)
 
         if self.wav_player:
             self.wav_player.startTransmit(aud_med)
 
 
-class Account(pj.Account):
+class Account(AsyncAccount):
     def __init__(self):
-        pj.Account.__init__(self)
+        AsyncAccount.__init__(self, Call)
         self.calls = []
 
-    def onRegState(self, prm):
-        ai = self.getInfo()
-        print("***{}: code={}".format(("*** Register: code=" if ai.regIsActive else "*** Unregister"), prm.code))
-
-    def onIncomingCall(self, iprm):
-        call = Call(self, call_id=iprm.callId)
+    async def answer(self, call):
+        """answer an incoming call, and forget it once it is disconnected"""
         call_prm = pj.CallOpParam()
         ci = call.getInfo()
 
@@ -78,12 +75,19 @@ class Account(pj.Account):
         self.calls.append(call)
         call_prm.statusCode = 200
         call.answer(call_prm)
+        try:
+            await call.confirmed()
+        except CallDisconnected as e:
+            print("*** {} ***".format(e))
+        await call.disconnected()
+        # python do not do the gc of underlaying C++ library, we need to do it by ourself
+        self.calls.remove(call)
 
-    def removeCall(self, call):
-        for tmpCall in self.calls:
-            if tmpCall.getInfo().callIdString == call.getInfo().callIdString:
-                self.calls.remove(tmpCall)
-                break
+    async def serve(self):
+        """answer every incoming call, until the task is cancelled"""
+        while True:
+            call = await self.incomingCall()
+            asyncio.get_running_loop().create_task(self.answer(call))
 
 
 def enumLocalMedia(ep):
@@ -104,12 +108,17 @@ def main():
         ep = pj.Endpoint()
         ep.libCreate()
         ep_cfg = pj.EpConfig()
+        # the events are polled by the event pump thread, pjsua2 is called from the asyncio one
+        ep_cfg.uaConfig.threadCnt = 0
+        ep_cfg.uaConfig.mainThreadOnly = False
         ep.libInit(ep_cfg)
 
         # add some config
         tcfg = pj.TransportConfig()
         tcfg.port = 5060
         ep.transportCreate(pj.PJSIP_TRANSPORT_UDP, tcfg)
+        # the event pump is stopped at once by a wakeup datagram
+        controlLoop.setWakeupTransport(tcfg.port)
 
         # add account config
         acc_cfg = pj.AccountConfig()
@@ -121,23 +130,30 @@ def main():
         cred = pj.AuthCredInfo("digest", "*", "2", 0, "test")
         acc_cfg.sipConfig.authCreds.append(cred)
 
-        acc = Account()
-        acc.create(acc_cfg)
-
         ep.libStart()
         print("*** PJSUA2 STARTED ***")
 
         # use null device as conference bridge, instead of local sound card
         pj.Endpoint.instance().audDevManager().setNullDev()
 
-        # hangup all call after 10 sec
-        sleep4PJSUA2(-1)
+        async def serve():
+            # the account needs the running asyncio loop
+            acc = Account()
+            acc.create(acc_cfg)
+            try:
+                await acc.serve()
+            finally:
+                print("*** PJSUA2 SHUTTING DOWN ***")
+                ep.hangupAllCalls()
+                del acc
 
-        print("*** PJSUA2 SHUTTING DOWN ***")
-        del acc
+        # answer the calls until Ctrl-C
+        runPJSUA(serve)
 
     except KeyboardInterrupt as e:
         print("catch KeyboardInterrupt!!, exception error is: {}".format(e.args))
+        # let the BYEs out, the pump is stopped
+        sleep4PJSUA2(1)
 
     # close the library
     try:
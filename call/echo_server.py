@@ -1,9 +1,9 @@
 import pjsua2 as pj
-from utils import sleep4PJSUA2
+from utils import sleep4PJSUA2, controlLoop, CallRegistry, CachedInfoCall
 import threading
 
 
-class Call(pj.Call):
+class Call(CachedInfoCall):
     """
     Call class, High level Python Call object, derived from pjsua2's Call object.
     there are Call class reference: https://www.pjsip.org/pjsip/docs/html/classpj_1_1Call.htm
@@ -11,12 +11,13 @@ class Call(pj.Call):
     """
 
     def __init__(self, acc, peer_uri='', chat=None, call_id=pj.PJSUA_INVALID_ID):
-        pj.Call.__init__(self, acc, call_id)
+        CachedInfoCall.__init__(self, acc, call_id)
         self.acc = acc
 
     # override the function at original parent class
     # parent class's function can be called by super().onCallState()
     def onCallState(self, prm):
+        self.invalidateInfo()
         ci = self.getInfo()
         print("*** Call: {} [{}, {}]".format(ci.remoteUri,
               ci.lastStatusCode, ci.stateText))
@@ -27,6 +28,7 @@ class Call(pj.Call):
             del self
 
     def onCallMediaState(self, prm):
+        self.invalidateInfo()
         # Deprecated: for PJSIP version 2.8 or earlier
         # ci = self.getInfo()
         # for mi in ci.media:
@@ -52,7 +54,7 @@ class Call(pj.Call):
 class Account(pj.Account):
     def __init__(self):
         pj.Account.__init__(self)
-        self.calls = []
+        self.calls = CallRegistry()
 
     def onRegState(self, prm):
         ai = self.getInfo()
@@ -64,15 +66,12 @@ class Account(pj.Account):
         ci = call.getInfo()
 
         print("*** Incoming Call: {} [{}]".format(ci.remoteUri, ci.stateText))
-        self.calls.append(call)
+        self.calls.add(call, ci)
         call_prm.statusCode = 200
         call.answer(call_prm)
 
     def removeCall(self, call):
-        for tmpCall in self.calls:
-            if tmpCall.getInfo().callIdString == call.getInfo().callIdString:
-                self.calls.remove(tmpCall)
-                break
+        self.calls.remove(call)
 
 
 def enumLocalMedia(ep):
@@ -103,6 +102,8 @@ def main():
         tcfg = pj.TransportConfig()
         tcfg.port = 5060
         ep.transportCreate(pj.PJSIP_TRANSPORT_UDP, tcfg)
+        # quitPJSUA() from other threads interrupts the event polling
+        controlLoop.setWakeupTransport(tcfg.port)
 
         # add account config
         acc_cfg = pj.AccountConfig()
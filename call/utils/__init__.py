@@ -1 +1,3 @@
-from .controlLoop import sleep4PJSUA2, handleErr
\ No newline at end of file
+from .controlLoop import sleep4PJSUA2, handleErr, quitPJSUA, resetPJSUA, controlLoop, ControlLoop
+from .callRegistry import CallRegistry
+from .callInfoCache import CachedInfoCall, infoCacheStats
@@ -2,14 +2,17 @@ import argparse
 import pjsua2 as pj
 import re
 import sys
-from enum import Enum
 from signal import signal, SIGINT, SIGTERM
 import threading
 import queue
 
 sys.path.append("../../")
-from utils.controlLoop import sleep4PJSUA2, quitPJSUA
+from utils.controlLoop import sleep4PJSUA2, quitPJSUA, resetPJSUA, controlLoop, handleErr
 from utils.envDefault import EnvDefault
+from utils.floorControl import Instruction
+from utils.floorChannel import FloorChannel, HEADER as FLOOR_HEADER, OFFER as FLOOR_OFFER, parseHeader
+from utils.talkgroup import headerValue
+from utils.latencyHistogram import GrantLatency
 
 DBG = 1
 
@@ -32,13 +35,32 @@ class Unbuffered(object):
 
 sys.stdout = Unbuffered(sys.stdout)
 
-class Instruction(Enum):
-    TB_REQUEST='request'
-    TB_GRANT='grant'
-    TB_DENY='deny'
-    TB_RELEASE='release'
-    TB_TAKEN='taken'
-    TB_IDLE='idle'
+# the floor request to reply latency, of the MESSAGE and of the floor channel replies
+grantLatency = GrantLatency()
+
+# the host of a contact uri, e.g. "10.0.0.2" of "<sip:1@10.0.0.2:5060;ob>"
+CONTACT_HOST_RE = re.compile(r"sips?:(?:[^@;>\s]*@)?([^:;>\s]+)")
+
+class Account(pj.Account):
+    def onInstantMessage(self, prm):
+        if prm.contentType != 'text/plain':
+            return
+        onFloorReply(prm.msgBody.strip(), "MESSAGE")
+
+
+def onFloorReply(body, transport):
+    """a floor control instruction of the server, matched to the pending request"""
+    try:
+        instruction = Instruction(body)
+    except ValueError:
+        print("*** unknown floor instruction {} ***".format(body))
+        return
+    elapsed = grantLatency.reply(instruction)
+    if elapsed is None:
+        print("*** floor {} by {} ***".format(instruction.value, transport))
+    else:
+        print("*** floor {} by {} in {:.3f}ms ***".format(instruction.value, transport, elapsed * 1000))
+
 
 class Call(pj.Call):
     """
@@ -53,6 +75,9 @@ class Call(pj.Call):
         self.wav_player = None
         self.wav_recorder = None
         self.curStatus = None
+        # (host, port) and token of the floor channel of the server, if it answered one
+        self.floorPeer = None
+        self.floorToken = None
 
     # override the function at original parent class
     # parent class's function can be called by super().onCallState()
@@ -62,6 +87,29 @@ class Call(pj.Call):
         if ci.lastStatusCode == 404:
             print("call can't established with code 404!")
             # quitPJSUA()
+        if ci.lastStatusCode == 200 and self.floorPeer is None:
+            self.readFloorChannel(prm, ci)
+
+    def readFloorChannel(self, prm, ci):
+        """read the floor channel of the server from the HEADER of its 200 OK"""
+        try:
+            wholeMsg = prm.e.body.tsxState.src.rdata.wholeMsg
+        except Exception:
+            # it isn't the event of a received message
+            return
+        channel = parseHeader(headerValue(wholeMsg, FLOOR_HEADER))
+        if channel is None:
+            return
+        host, port, token = channel
+        if host is None:
+            match = CONTACT_HOST_RE.search(ci.remoteContact)
+            host = match.group(1) if match else None
+        if host is None:
+            print("*** floor channel without host, use SIP MESSAGE ***")
+            return
+        self.floorPeer = (host, port)
+        self.floorToken = token
+        print("*** floor channel at {}:{} ***".format(host, port))
 
     def onCallMediaState(self, prm):
         aud_med = None
@@ -100,9 +148,7 @@ class Call(pj.Call):
 def handler(signal_received, frame):
     # Handle any cleanup here
     print('SIGTERM, SIGINT or CTRL-C detected. Exiting gracefully')
-    # quitPJSUA()
-
-    exit(0)
+    quitPJSUA()
 
 def main():
     global args
@@ -127,10 +173,15 @@ def main():
     parser.add_argument(
         "-x", "--record", action=EnvDefault, envvar='RECORD', type=bool, default=False, required=False,
         help="Specify the whether it would record the audio to /recordered.wav, default False (can also be specified using RECORD environment variable)")
+    parser.add_argument(
+        "--floorChannel", action=EnvDefault, envvar='FLOOR_CHANNEL', type=bool, default=False, required=False,
+        help="Specify whether the floor control is offered a UDP floor channel, SIP MESSAGE stays the fallback, default False (can also be specified using FLOOR_CHANNEL environment variable)")
 
     args = parser.parse_args()
 
     ep = None
+    # bound late in the try, the cleanup checks them
+    floorChannel = call = acc = None
     try:
         # init the lib
         ep = pj.Endpoint()
@@ -147,7 +198,9 @@ def main():
         # add some config
         tcfg = pj.TransportConfig()
         # tcfg.port = 5060
-        ep.transportCreate(pj.PJSIP_TRANSPORT_UDP, tcfg)
+        tid = ep.transportCreate(pj.PJSIP_TRANSPORT_UDP, tcfg)
+        # the retransmit timers of the floor channel interrupt the event polling
+        controlLoop.setWakeupTransport(int(ep.transportGetInfo(tid).localName.rsplit(":", 1)[1]))
 
         # add account config
         acc_cfg = pj.AccountConfig()
@@ -160,7 +213,7 @@ def main():
         cred = pj.AuthCredInfo("digest", "*", args.username, 0, args.password)
         acc_cfg.sipConfig.authCreds.append(cred)
 
-        acc = pj.Account()
+        acc = Account()
         acc.create(acc_cfg)
 
         ep.libStart()
@@ -175,13 +228,37 @@ def main():
         buddyCfg.uri = args.callURI
         buddy.create(acc, buddyCfg)
 
+        def onFloorPacket(instruction, token, priority, peer):
+            onFloorReply(instruction.value, "floor channel")
+
+        floorChannel = FloorChannel(controlLoop, onFloorPacket).start() if args.floorChannel else None
+
         # call to the dst uri
         call = Call(acc)
         prm = pj.CallOpParam(True)
         prm.opt.audioCount = 1
         prm.opt.videoCount = 0
+        if floorChannel is not None:
+            # the server answers the port and the token of its channel
+            header = pj.SipHeader()
+            header.hName = FLOOR_HEADER
+            header.hValue = FLOOR_OFFER
+            prm.txOption.headers.append(header)
         call.makeCall(args.callURI, prm)
 
+        def sendMessage(instruction):
+            instantMessagePrm = pj.SendInstantMessageParam()
+            instantMessagePrm.content = instruction.value
+            instantMessagePrm.contentType = "text/plain"
+            buddy.sendInstantMessage(instantMessagePrm)
+
+        def sendInstruction(instruction):
+            if floorChannel is not None and call.floorPeer is not None:
+                floorChannel.send(call.floorPeer, instruction, call.floorToken,
+                                  onFail=lambda: sendMessage(instruction))
+            else:
+                sendMessage(instruction)
+
         inputQueue = queue.Queue()
         def scanKeyboardPress():
             while True:
@@ -200,22 +277,20 @@ def main():
             isQuit = False;
             while not inputQueue.empty() and not isQuit:
                 # r stand for ptt request
-                instSet = set(["request", "release", "print"])
+                instSet = set(["request", "release", "print", "stats"])
                 inst = inputQueue.get()
                 print("****** pop {}".format(inst))
                 if inst in instSet:
                     if inst == "print":
                         print()
+                    elif inst == "stats":
+                        print(grantLatency.format())
                     elif inst == "request":
-                        instantMessagePrm = pj.SendInstantMessageParam()
-                        instantMessagePrm.content = Instruction.TB_REQUEST.value
-                        instantMessagePrm.contentType = "text/plain"
-                        buddy.sendInstantMessage(instantMessagePrm)
+                        grantLatency.request()
+                        sendInstruction(Instruction.TB_REQUEST)
                     elif inst == "release":
-                        instantMessagePrm = pj.SendInstantMessageParam()
-                        instantMessagePrm.content = Instruction.TB_RELEASE.value
-                        instantMessagePrm.contentType = "text/plain"
-                        buddy.sendInstantMessage(instantMessagePrm)
+                        grantLatency.release()
+                        sendInstruction(Instruction.TB_RELEASE)
             return isQuit
 
 
@@ -226,14 +301,24 @@ def main():
     except KeyboardInterrupt as e:
         print("catch KeyboardInterrupt!!, exception error is: {}".format(e.args))
     finally:
-        ep.hangupAllCalls()
-
-        del call
-
+        if call is not None:
+            # the loop is quit, let it send the BYEs
+            resetPJSUA()
+            ep.hangupAllCalls()
+            sleep4PJSUA2(1)
+        if floorChannel is not None:
+            print("*** floor channel: {} ***".format(floorChannel.stats()))
+            floorChannel.close()
+
+        call = None
+
+        print("*** floor request latency ***")
+        print(grantLatency.format())
         print("*** PJSUA2 SHUTTING DOWN ***")
-        del acc
+        acc = None
         # close the library
-        ep.libDestroy()
+        if ep is not None:
+            ep.libDestroy()
 
 
 if __name__ == '__main__':
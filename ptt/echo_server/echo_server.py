@@ -6,38 +6,36 @@ import sys
 from typing import Union
 import threading
 import queue
-from enum import Enum
 import sys
 from signal import signal, SIGINT, SIGTERM
 
 sys.path.append("../../")
-from utils.controlLoop import sleep4PJSUA2, quitPJSUA
+from utils.controlLoop import sleep4PJSUA2, quitPJSUA, resetPJSUA, controlLoop
 from utils.envDefault import EnvDefault
+from utils.callRegistry import CallRegistry, normalizeUri
+from utils.callInfoCache import CachedInfoCall
+from utils.mediaProfile import addMediaArgs, mediaProfileFromArgs, BridgeUsage
+from utils.floorControl import Instruction
+from utils.talkgroup import TalkgroupManager, headerValue
+from utils.floorChannel import FloorChannel, HEADER as FLOOR_HEADER, formatHeader, newToken
 
 # pjsua2 endpoint instance
 ep: Union[None, pj.Endpoint] = None
 
-class Instruction(Enum):
-    TB_REQUEST='request'
-    TB_GRANT='grant'
-    TB_DENY='deny'
-    TB_RELEASE='release'
-    TB_TAKEN='taken'
-    TB_IDLE='idle'
-
-class Call(pj.Call):
+class Call(CachedInfoCall):
     """
     Call class, High level Python Call object, derived from pjsua2's Call object.
     there are Call class reference: https://www.pjsip.org/pjsip/docs/html/classpj_1_1Call.htm We may wants to implement our Call object to handle the "outgoing" call implement logic
     """
 
     def __init__(self, acc, call_id=pj.PJSUA_INVALID_ID):
-        pj.Call.__init__(self, acc, call_id)
+        CachedInfoCall.__init__(self, acc, call_id)
         self.acc = acc
 
     # override the function at original parent class
     # parent class's function can be called by super().onCallState()
     def onCallState(self, prm):
+        self.invalidateInfo()
         ci = self.getInfo()
         print("*** Call: {} [{}, {}]".format(ci.remoteUri,
               ci.lastStatusCode, ci.stateText))
@@ -46,19 +44,18 @@ class Call(pj.Call):
             pass
 
         # python do not do the gc of underlaying C++ library, we need to do it by ourself
-        elif ci.stateText == "DISCONNECTED":
+        elif ci.state == pj.PJSIP_INV_STATE_DISCONNECTED:
             self.acc.removeCall(self)
             del self
 
     def onCallMediaState(self, prm):
-        if not self.acc.curLeader:
+        self.invalidateInfo()
+        group = self.acc.talkgroups.ofCall(self)
+        if group is None:
             return
-
         try:
-            # get the "local" media
-            aud_med = self.getAudioMedia(-1)
-            # generate echo
-            self.acc.curLeader.getAudioMedia(-1).startTransmit(aud_med)
+            # get the "local" media, the fan-out of its talkgroup connects it to the leader
+            group.fanOut.attach(self.getId(), self.getAudioMedia(-1))
         except Exception as e:
             print("exception!!: {}".format(e.args))
 
@@ -67,47 +64,74 @@ class Call(pj.Call):
         print(self.dump(with_media=True, indent="  "))
 
 class Account(pj.Account):
-    def __init__(self):
+    def __init__(self, talkgroupHeader="X-Talkgroup", defaultTalkgroup=None, notifyListeners=False):
         pj.Account.__init__(self)
-        self.calls = []
-        self.buddys = []
-        self.curLeader = None
+        self.calls = CallRegistry()
+        # normalized uri -> pj.Buddy, kept across the calls of the same ua
+        self.buddys = {}
+        self.talkgroups = TalkgroupManager(self.sendInstruction, talkgroupHeader, defaultTalkgroup,
+                                           notifyListeners=notifyListeners)
+        # the optional UDP floor channel, see enableFloorChannel()
+        self.floorChannel = None
+        self.floorHost = None
+        # token -> normalized uri, and normalized uri -> [token, peer address or None]
+        self.floorTokens = {}
+        self.floorPeers = {}
+
+    def enableFloorChannel(self, port, host=None):
+        """offer the floor channel to the calls which ask for it in their INVITE
+
+        Args:
+            port (int): the UDP port of the channel
+            host (str): the address given to the clients, default the one of the SIP contact
+        """
+        self.floorChannel = FloorChannel(controlLoop, self.onFloorPacket, port=port).start()
+        self.floorHost = host
+        print("*** floor channel on udp port {} ***".format(self.floorChannel.port))
 
     def findCall(self, uri=""):
-        for call in self.calls:
-            ci = call.getInfo()
-            if uri in ci.remoteUri:
-                print(ci.remoteUri)
-                return call
-        return None
+        group = self.talkgroups.ofUri(uri)
+        return (group.floor.findCall(uri) if group else None) or self.calls.findByUri(uri)
+
+    def sendInstruction(self, participant, instruction):
+        peer = self.floorPeers.get(participant.uri)
+        if self.floorChannel is not None and peer is not None and peer[1] is not None:
+            # SIP MESSAGE is the fallback when the channel gets no ack
+            self.floorChannel.send(peer[1], instruction, peer[0],
+                                   onFail=lambda: self.sendMessage(participant, instruction))
+            return
+        self.sendMessage(participant, instruction)
 
-    def setLeader(self, uri=""):
-        self.curLeader = self.findCall(uri)
-        if not self.curLeader:
-            print("can't set the ua as a leader")
+    def sendMessage(self, participant, instruction):
+        if participant.buddy is None:
             return
+        instantMessagePrm = pj.SendInstantMessageParam()
+        instantMessagePrm.contentType = "text/plain"
+        instantMessagePrm.content = instruction.value
+        try:
+            participant.buddy.sendInstantMessage(instantMessagePrm)
+        except pj.Error as e:
+            print("exception!!: {}".format(e.info()))
 
-        srcMed = self.curLeader.getAudioMedia(-1)
-        for call in self.calls:
-            ci = call.getInfo()
-            if uri not in ci.remoteUri:
-                srcMed.startTransmit(call.getAudioMedia(-1))
+    def setLeader(self, uri=""):
+        group = self.talkgroups.ofUri(uri)
+        if not group or not group.floor.force(uri):
+            print("can't set the ua as a leader")
 
-    def delLeader(self):
-        if not self.curLeader:
+    def delLeader(self, name=None):
+        """revoke the floor of the talkgroup name, or of every talkgroup"""
+        groups = [self.talkgroups.groups[name]] if name in self.talkgroups.groups else \
+            list(self.talkgroups.groups.values()) if name is None else []
+        if not any(group.leader for group in groups):
             print("can't delete the ua")
             return
+        for group in groups:
+            group.floor.revoke()
 
-        print(self.curLeader)
-        curMed = self.curLeader.getAudioMedia(-1)
-        for call in self.calls:
-            try:
-                if call.isActive():
-                    med = call.getAudioMedia(-1)
-                    curMed.stopTransmit(med)
-            except Exception as e:
-                print("exception!!: {}".format(e.args))
-        self.curLeader = None
+    def printTalkgroups(self):
+        print("talkgroups: {}".format(self.talkgroups.stats()))
+        for name, group in sorted(self.talkgroups.groups.items()):
+            print("  {}: {}, queue: {}".format(name, group.stats(), [p.uri for p in group.floor.queue()]))
 
     def onRegState(self, prm):
         ai = self.getInfo()
@@ -119,54 +143,81 @@ class Account(pj.Account):
         ci = call.getInfo()
 
         print("*** incoming call: {} [{}]".format(ci.remoteUri, ci.stateText))
-        self.calls.append(call)
-        call_prm.statusCode = 200
-        call.answer(call_prm)
+        self.calls.add(call, ci)
 
-        print("*** create a buddy")
-        curBuddy = None
-        # find remote buddy
-        for buddy in self.buddys:
-            if(buddy.getInfo().uri == ci.remoteUri):
-                curBuddy = self.findBuddy2(ci.remoteUri)
-                print("found buddy")
+        uri = normalizeUri(ci.remoteUri)
+        curBuddy = self.buddys.get(uri)
         if not curBuddy:
+            print("*** create a buddy")
             buddyCfg = pj.BuddyConfig()
-            buddyCfg.uri = ci.remoteUri
+            buddyCfg.uri = uri
             curBuddy = pj.Buddy()
             curBuddy.create(self, buddyCfg)
-            self.buddys.append(curBuddy)
-            print("not found buddy")
+            self.buddys[uri] = curBuddy
+        # join the talkgroup before answering, the media may be active in answer()
+        name = self.talkgroups.groupName(iprm.rdata.wholeMsg, ci.localUri)
+        self.talkgroups.join(name, uri, call, curBuddy)
+        print("*** {} joins talkgroup {}".format(uri, name))
+
+        call_prm.statusCode = 200
+        if self.floorChannel is not None and headerValue(iprm.rdata.wholeMsg, FLOOR_HEADER):
+            token = self.floorPeers.pop(uri, [None])[0]
+            self.floorTokens.pop(token, None)
+            token = newToken()
+            self.floorTokens[token] = uri
+            # the address of the client is learned from its first packet
+            self.floorPeers[uri] = [token, None]
+            header = pj.SipHeader()
+            header.hName = FLOOR_HEADER
+            header.hValue = formatHeader(self.floorChannel.port, token, self.floorHost)
+            call_prm.txOption.headers.append(header)
+        call.answer(call_prm)
 
     def removeCall(self, call):
-        for tmpCall in self.calls:
-            if tmpCall.getInfo().callIdString == call.getInfo().callIdString:
-                if self.curLeader and self.curLeader.getInfo().callIdString == call.getInfo().callIdString:
-                    print("del")
-                    self.curLeader = None
+        uri = self.calls.remoteUri(call)
+        removed = self.calls.remove(call)
+        if removed:
+            self.talkgroups.leave(call, uri)
+            key = normalizeUri(uri)
+            if self.talkgroups.ofUri(key) is None and key in self.floorPeers:
+                self.floorTokens.pop(self.floorPeers.pop(key)[0], None)
+
+    def onFloorPacket(self, instruction, token, priority, peer):
+        uri = self.floorTokens.get(token)
+        if uri is None:
+            print("*** floor {} with an unknown token from {}".format(instruction.value, peer))
+            return
+        self.floorPeers[uri][1] = peer
+        group = self.talkgroups.ofUri(uri)
+        if group is None:
+            print("*** floor {} from {}, which has no call".format(instruction.value, uri))
+            return
+        self.handleFloor(group, uri, instruction.value, priority)
+
+    def handleFloor(self, group, uri, opcode, priority=0):
+        """a floor instruction of a member, by MESSAGE or by the floor channel"""
+        if opcode == Instruction.TB_REQUEST.value:
+            state = group.floor.request(uri, priority)
+            print("*** talkgroup {} floor request from {}: {} ***".format(group.name, uri, state.value))
 
-                self.calls.remove(tmpCall)
-                break
+        elif opcode == Instruction.TB_RELEASE.value:
+            group.floor.release(uri)
 
     def onInstantMessage(self, prm):
-        if prm.contentType == 'text/plain':
-            if prm.msgBody == Instruction.TB_REQUEST.value:
-                instantMessagePrm = pj.SendInstantMessageParam()
-                instantMessagePrm.contentType = "text/plain"
-                if self.curLeader:
-                    print("send instant message")
-                    instantMessagePrm.content = Instruction.TB_DENY.value
-                else:
-                    instantMessagePrm.content = Instruction.TB_GRANT.value
-                    self.setLeader(prm.fromUri)
-                self.findBuddy2(prm.fromUri).sendInstantMessage(instantMessagePrm)
-
-            elif prm.msgBody == Instruction.TB_RELEASE.value:
-                    if self.curLeader:
-                        if prm.fromUri in self.curLeader.getInfo().remoteUri:
-                            self.delLeader()
-
-            print("end send instant message")
+        if prm.contentType != 'text/plain':
+            return
+        inst = prm.msgBody.split()
+        if not inst:
+            return
+        opcode, operand = inst[0], inst[1:]
+        group = self.talkgroups.ofMessage(prm.fromUri, prm.toUri)
+        if group is None:
+            print("*** floor {} from {}, which has no call".format(opcode, prm.fromUri))
+            return
+
+        # "request <priority>", the higher priority is granted first
+        priority = int(operand[0]) if operand and operand[0].lstrip("-").isdigit() else 0
+        self.handleFloor(group, prm.fromUri, opcode, priority)
 
 
 def enumLocalMedia():
@@ -183,9 +234,7 @@ def enumLocalMedia():
 def handler(signal_received, frame):
     # Handle any cleanup here
     print('SIGTERM, SIGINT or CTRL-C detected. Exiting gracefully')
-    # quitPJSUA()
-
-    exit(0)
+    quitPJSUA()
 
 def main():
     signal(SIGTERM, handler)
@@ -208,6 +257,25 @@ def main():
     parser.add_argument(
         "-D", "--debug", action=EnvDefault, envvar='DBG', type=bool, default=False, required=False,
         help="Specify whether the debug mode is open, default False (can also be specified using DBG environment variable)")
+    addMediaArgs(parser, EnvDefault)
+    parser.add_argument(
+        "--talkgroupHeader", action=EnvDefault, envvar='TALKGROUP_HEADER', default="X-Talkgroup", required=False,
+        help="Specify the INVITE header naming the talkgroup of a call, without it the user of the dialed uri is the talkgroup, default X-Talkgroup (can also be specified using TALKGROUP_HEADER environment variable)")
+    parser.add_argument(
+        "--defaultTalkgroup", action=EnvDefault, envvar='DEFAULT_TALKGROUP', default="default", required=False,
+        help="Specify the talkgroup of the calls which name none, default default (can also be specified using DEFAULT_TALKGROUP environment variable)")
+    parser.add_argument(
+        "--talkgroupReport", action=EnvDefault, envvar='TALKGROUP_REPORT', type=float, default=60.0, required=False,
+        help="Specify how often(second) the talkgroups are reported, 0 disables it, default 60 (can also be specified using TALKGROUP_REPORT environment variable)")
+    parser.add_argument(
+        "--floorNotifyAll", action=EnvDefault, envvar='FLOOR_NOTIFY_ALL', type=bool, default=False, required=False,
+        help="Specify whether every floor change is sent to every member of the talkgroup (one message per member), otherwise only to the requester and the old and new speaker, default False (can also be specified using FLOOR_NOTIFY_ALL environment variable)")
+    parser.add_argument(
+        "--floorPort", action=EnvDefault, envvar='FLOOR_PORT', type=int, default=0, required=False,
+        help="Specify the UDP port of the floor channel offered to the clients, 0 disables it and the floor control uses SIP MESSAGE only, default 0 (can also be specified using FLOOR_PORT environment variable)")
+    parser.add_argument(
+        "--floorHost", action=EnvDefault, envvar='FLOOR_HOST', default=None, required=False,
+        help="Specify the address of the floor channel given to the clients, default the address of the SIP contact (can also be specified using FLOOR_HOST environment variable)")
 
     args = parser.parse_args()
 
@@ -233,6 +301,9 @@ def main():
         else:
             ep_cfg.logConfig.level = 1
             ep_cfg.logConfig.consoleLevel = 1
+        profile = mediaProfileFromArgs(args)
+        profile.apply(ep_cfg)
+        print("*** media profile: {} ***".format(profile))
 
         ep.libInit(ep_cfg)
 
@@ -240,6 +311,8 @@ def main():
         tcfg = pj.TransportConfig()
         tcfg.port = 5060
         ep.transportCreate(pj.PJSIP_TRANSPORT_UDP, tcfg)
+        # quitPJSUA() from other threads interrupts the event polling
+        controlLoop.setWakeupTransport(tcfg.port)
 
         # add account config
         acc_cfg = pj.AccountConfig()
@@ -252,8 +325,10 @@ def main():
         cred = pj.AuthCredInfo("digest", "*", args.username, 0, args.password)
         acc_cfg.sipConfig.authCreds.append(cred)
 
-        acc = Account()
+        acc = Account(args.talkgroupHeader, args.defaultTalkgroup, args.floorNotifyAll)
         acc.create(acc_cfg)
+        if args.floorPort:
+            acc.enableFloorChannel(args.floorPort, args.floorHost)
 
         ep.libStart()
         print("*** PJSUA2 STARTED ***")
@@ -266,6 +341,21 @@ def main():
         for codec in ep.codecEnum2():
             print("codec_id: {} codec_priority: {}".format(
                 codec.codecId, codec.priority))
+        for warning in profile.validate(ep, ep_cfg.uaConfig.maxCalls):
+            print("*** media profile warning: {} ***".format(warning))
+        bridgeUsage = BridgeUsage(ep)
+        if args.bridgeReport > 0:
+            controlLoop.callEvery(args.bridgeReport, bridgeUsage.sample)
+
+        # print the talkgroups when their members or floors changed
+        lastReport = [None]
+        def reportTalkgroups():
+            stats = acc.talkgroups.stats()
+            if stats != lastReport[0]:
+                lastReport[0] = stats
+                acc.printTalkgroups()
+        if args.talkgroupReport > 0:
+            controlLoop.callEvery(args.talkgroupReport, reportTalkgroups)
 
         inputQueue = queue.Queue()
         def scanKeyboardPress():
@@ -289,17 +379,26 @@ def main():
                 if opcode in instSet:
                     if opcode == "p":
                         enumLocalMedia()
-                        print(acc.curLeader)
+                        acc.printTalkgroups()
                     elif opcode == "s":
                         acc.setLeader(operand[0])
                     elif opcode == "d":
-                        acc.delLeader()
+                        # "d <talkgroup>", or every talkgroup
+                        acc.delLeader(operand[0] if operand else None)
 
         sleep4PJSUA2(-1, control_loop, 0.5)
 
         # hangup all call after the time we specified at args(sec)
+        # the loop is quit, let it send the BYEs
+        resetPJSUA()
         ep.hangupAllCalls()
+        sleep4PJSUA2(1)
 
+        print("*** bridge slots: {} ***".format(bridgeUsage.stats()))
+        acc.printTalkgroups()
+        if acc.floorChannel is not None:
+            print("*** floor channel: {} ***".format(acc.floorChannel.stats()))
+            acc.floorChannel.close()
         print("*** PJSUA2 SHUTTING DOWN ***")
         del acc
 
@@ -0,0 +1,12 @@
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# the shared modules are imported as utils.X, the echo server ones by their
+# flat name. echo_server/utils.py would shadow the utils/ namespace package,
+# so it is imported before the echo server directory is on the path.
+sys.path.insert(0, ROOT)
+import utils  # noqa: E402,F401
+
+sys.path.append(os.path.join(ROOT, "audioSimularity", "echo_server"))
@@ -0,0 +1,101 @@
+import numpy
+import pytest
+
+from audio_compare import AudioSimilar
+from fingerprint import FingerprintBackend
+from fingerprint_cache import FingerprintCache
+
+
+def old_compare(listx, listy, span, step, min_overlap):
+    """AudioSimilar.compare before it was vectorized, one popcount per element"""
+    corr_xy = []
+    for offset in numpy.arange(-span, span + 1, step):
+        x, y = listx, listy
+        if offset > 0:
+            x = x[offset:]
+            y = y[:len(x)]
+        elif offset < 0:
+            y = y[-offset:]
+            x = x[:len(y)]
+        if min(len(x), len(y)) < min_overlap:
+            corr_xy.append(None)
+            continue
+        length = min(len(x), len(y))
+        covariance = 0
+        for i in range(length):
+            covariance += 32 - bin(x[i] ^ y[i]).count("1")
+        corr_xy.append(covariance / float(length) / 32)
+    return corr_xy
+
+
+class DictBackend(FingerprintBackend):
+    """the fingerprint of a file is looked up by its name"""
+
+    def __init__(self, fingerprints):
+        self.fingerprints = fingerprints
+
+    def fingerprint_file(self, filename, sample_time):
+        return self.fingerprints[filename]
+
+
+def fingerprints(rng, length):
+    return [int(value) for value in rng.integers(0, 1 << 32, length, dtype=numpy.uint64)]
+
+
+def shifted(rng, listx, offset, noise=0.05):
+    """listx delayed by offset points, with a few flipped bits"""
+    listy = fingerprints(rng, offset) + listx[:len(listx) - offset]
+    return [value ^ (1 << int(rng.integers(32))) if rng.random() < noise else value for value in listy]
+
+
+@pytest.mark.parametrize("lengths, span, step", [((120, 120), 30, 1), ((150, 90), 40, 3), ((80, 130), 25, 2)])
+def test_compare_matches_old(lengths, span, step):
+    rng = numpy.random.default_rng(sum(lengths) + span)
+    listx = fingerprints(rng, lengths[0])
+    listy = fingerprints(rng, lengths[1])
+    similar = AudioSimilar(span=span, step=step, backend=DictBackend({}))
+
+    expected = old_compare(listx, listy, span, step, similar.min_overlap)
+    assert similar.compare(listx, listy, span, step) == pytest.approx(expected)
+
+
+def test_compare_too_short_offsets_are_none():
+    rng = numpy.random.default_rng(1)
+    listx = fingerprints(rng, 30)
+    similar = AudioSimilar(span=25, backend=DictBackend({}))
+    corr = similar.compare(listx, listx, 25, 1)
+    assert corr[0] is None and corr[-1] is None
+    assert corr == pytest.approx(old_compare(listx, listx, 25, 1, similar.min_overlap))
+
+
+def test_correlation_of_signed_fingerprints():
+    # old fpcalc printed signed values, they are wrapped into uint32
+    similar = AudioSimilar(backend=DictBackend({}))
+    assert similar.correlation([-1, 0], [0xFFFFFFFF, 0]) == 1.0
+
+
+def test_calc_many_matches_calc(tmp_path):
+    rng = numpy.random.default_rng(7)
+    reference = fingerprints(rng, 200)
+    files = {"ref": reference, "late": shifted(rng, reference, 12),
+             "other": fingerprints(rng, 200), "short": fingerprints(rng, 10)}
+    # the cache hashes the file content
+    paths = {}
+    for name in files:
+        paths[name] = str(tmp_path / name)
+        with open(paths[name], "w") as f:
+            f.write(name)
+    backend = DictBackend({paths[name]: value for name, value in files.items()})
+    similar = AudioSimilar(span=50, backend=backend, cache=FingerprintCache())
+
+    rows = similar.calc_many(paths["ref"], [paths["late"], paths["other"], paths["short"]])
+
+    expected = old_compare(reference, files["late"], 50, 1, similar.min_overlap)
+    best = max(range(len(expected)), key=lambda i: (expected[i] is not None, expected[i] or 0))
+    assert rows[0]["max_corr_offset"] == -50 + best == -12
+    assert rows[0]["max_corr"] == pytest.approx(expected[best])
+    assert rows[0]["passed"]
+    assert similar.calc(paths["ref"], paths["late"])["max_corr_offset"] == -12
+
+    assert not rows[1]["passed"]
+    assert rows[2]["error"].startswith("span >= sample size")
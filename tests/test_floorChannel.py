@@ -0,0 +1,136 @@
+import threading
+import time
+
+import pytest
+
+from utils.floorChannel import (ACK, INSTRUCTIONS, OPCODES, PACKET, FloorChannel, decode, encode,
+                                formatHeader, parseHeader)
+from utils.floorControl import Instruction
+
+PEER = ("127.0.0.1", 5070)
+
+
+class Timer:
+    def __init__(self, delay, callback):
+        self.delay = delay
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Loop:
+    """the timers of a ControlLoop, fired by hand"""
+
+    def __init__(self):
+        self.timers = []
+        # the reader thread adds timers too
+        self.lock = threading.Lock()
+
+    def callLater(self, delay, callback):
+        timer = Timer(delay, callback)
+        with self.lock:
+            self.timers.append(timer)
+        return timer
+
+    def fire(self):
+        with self.lock:
+            timers, self.timers = self.timers, []
+        for timer in timers:
+            if not timer.cancelled:
+                timer.callback()
+        return [timer.delay for timer in timers if not timer.cancelled]
+
+
+@pytest.fixture
+def channel():
+    received = []
+    channel = FloorChannel(Loop(), lambda *args: received.append(args), host="127.0.0.1", rto=0.05, retries=3)
+    channel.received_instructions = received
+    channel._sendto = lambda packet, peer: None
+    yield channel
+    channel.close()
+
+
+@pytest.mark.parametrize("instruction", list(Instruction))
+def test_pack_unpack(instruction):
+    packet = encode(OPCODES[instruction], 0xFFFF, 0xDEADBEEF, 3)
+    assert len(packet) == PACKET.size
+    opcode, seq, token, priority = decode(packet)
+    assert (INSTRUCTIONS[opcode], seq, token, priority) == (instruction, 0xFFFF, 0xDEADBEEF, 3)
+
+
+def test_priority_is_clamped():
+    assert decode(encode(OPCODES[Instruction.TB_REQUEST], 1, 1, 1000))[3] == 127
+    assert decode(encode(OPCODES[Instruction.TB_REQUEST], 1, 1, -1000))[3] == -128
+
+
+def test_decode_rejects_garbage():
+    packet = encode(ACK, 1, 2)
+    assert decode(packet) == (ACK, 1, 2, 0)
+    assert decode(packet[:-1]) is None
+    assert decode(b"\x00" + packet[1:]) is None
+    assert decode(packet[:1] + b"\x55" + packet[2:]) is None
+
+
+def test_header():
+    assert parseHeader(formatHeader(5070, 1234)) == (None, 5070, 1234)
+    assert parseHeader(formatHeader(5070, 1234, "10.0.0.1")) == ("10.0.0.1", 5070, 1234)
+    assert parseHeader("port=5070") is None
+    assert parseHeader("port=x;token=1") is None
+    assert parseHeader(None) is None
+
+
+def test_duplicate_is_dropped(channel):
+    packet = decode(encode(OPCODES[Instruction.TB_REQUEST], 7, 42, 1))
+    channel._receive(packet, PEER)
+    channel._receive(packet, PEER)
+    # the same seq from another peer isn't a duplicate
+    channel._receive(packet, ("127.0.0.1", 5071))
+    assert channel.received_instructions == [(Instruction.TB_REQUEST, 42, 1, PEER),
+                                             (Instruction.TB_REQUEST, 42, 1, ("127.0.0.1", 5071))]
+    assert channel.duplicates == 1
+    assert channel.received == 2
+
+
+def test_ack_stops_retransmit(channel):
+    channel.send(PEER, Instruction.TB_GRANT, 42)
+    (_, seq), = channel.pending
+    assert channel.loop.fire() == [0.05]
+    assert channel.retransmits == 1
+
+    channel._receive((ACK, seq, 42, 0), PEER)
+    assert channel.pending == {}
+    assert channel.acked == 1
+    assert channel.loop.fire() == []
+
+
+def test_retransmit_backoff_then_fail(channel):
+    failed = []
+    channel.send(PEER, Instruction.TB_GRANT, 42, onFail=lambda: failed.append(True))
+    assert channel.loop.fire() == [0.05]
+    assert channel.loop.fire() == [0.1]
+    assert channel.loop.fire() == [0.2]
+    assert failed == [True]
+    assert channel.stats()["retransmits"] == 2
+    assert channel.failed == 1
+
+
+def test_over_udp():
+    received = []
+    loop = Loop()
+    server = FloorChannel(loop, lambda *args: received.append(args), host="127.0.0.1").start()
+    client = FloorChannel(loop, lambda *args: None, host="127.0.0.1").start()
+    try:
+        client.send(("127.0.0.1", server.port), Instruction.TB_REQUEST, 42, 2)
+        # the reader thread hands the packet and the ACK to the loop
+        deadline = time.monotonic() + 2
+        while (not received or client.pending) and time.monotonic() < deadline:
+            loop.fire()
+            time.sleep(0.01)
+    finally:
+        client.close()
+        server.close()
+    assert received == [(Instruction.TB_REQUEST, 42, 2, ("127.0.0.1", client.port))]
+    assert client.pending == {}
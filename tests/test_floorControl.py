@@ -0,0 +1,144 @@
+from utils.floorControl import FloorControl, FloorState, Instruction
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_floor(**kwargs):
+    sent = []
+    changes = []
+    floor = FloorControl(lambda participant, instruction: sent.append((participant.uri, instruction)),
+                         lambda old, new: changes.append((old and old.uri, new and new.uri)),
+                         clock=Clock(), **kwargs)
+    for user in ("a", "b", "c", "d"):
+        floor.join("sip:{}@kamailio".format(user))
+    return floor, sent, changes
+
+
+def test_join_normalizes_uri():
+    floor, _, _ = make_floor()
+    participant = floor.join('"a" <sip:a@kamailio>;tag=1', call="call")
+    assert participant is floor.participant("sip:a@kamailio")
+    assert floor.findCall("sip:a@kamailio") == "call"
+    assert floor.request("sip:nobody@kamailio") is None
+
+
+def test_grant_on_idle_floor():
+    floor, sent, changes = make_floor()
+    assert floor.request("sip:a@kamailio") is FloorState.GRANTED
+    assert sent == [("sip:a@kamailio", Instruction.TB_GRANT)]
+    assert changes == [(None, "sip:a@kamailio")]
+    assert floor.stateOf(floor.participant("sip:b@kamailio")) is FloorState.TAKEN
+    # the speaker asking again is granted again
+    assert floor.request("sip:a@kamailio") is FloorState.GRANTED
+    assert floor.granted == 1
+
+
+def test_queue_by_priority_then_fifo():
+    floor, sent, _ = make_floor()
+    floor.request("sip:a@kamailio")
+    assert floor.request("sip:b@kamailio") is FloorState.QUEUED
+    assert floor.request("sip:c@kamailio", priority=1) is FloorState.QUEUED
+    assert floor.request("sip:d@kamailio") is FloorState.QUEUED
+    assert [p.uri for p in floor.queue()] == ["sip:c@kamailio", "sip:b@kamailio", "sip:d@kamailio"]
+
+    del sent[:]
+    assert floor.release("sip:a@kamailio")
+    assert floor.speaker.uri == "sip:c@kamailio"
+    # only the old and the new speaker are told
+    assert sent == [("sip:c@kamailio", Instruction.TB_GRANT), ("sip:a@kamailio", Instruction.TB_TAKEN)]
+    floor.release("sip:c@kamailio")
+    assert floor.speaker.uri == "sip:b@kamailio"
+    floor.release("sip:b@kamailio")
+    assert floor.speaker.uri == "sip:d@kamailio"
+    floor.release("sip:d@kamailio")
+    assert floor.speaker is None
+    assert floor.stats()["queued"] == 0
+
+
+def test_repeated_request_keeps_its_place():
+    floor, _, _ = make_floor()
+    floor.request("sip:a@kamailio")
+    floor.request("sip:b@kamailio")
+    floor.request("sip:c@kamailio")
+    for _ in range(100):
+        assert floor.request("sip:b@kamailio") is FloorState.QUEUED
+    assert [p.uri for p in floor.queue()] == ["sip:b@kamailio", "sip:c@kamailio"]
+    assert len(floor._queue) == 2
+
+    # a higher priority moves it up
+    floor.request("sip:c@kamailio", priority=2)
+    assert [p.uri for p in floor.queue()] == ["sip:c@kamailio", "sip:b@kamailio"]
+    for priority in range(3, 200):
+        floor.request("sip:c@kamailio", priority=priority)
+    assert len(floor._queue) <= 2 * floor._queued + 16
+
+
+def test_queue_full_is_denied():
+    floor, sent, _ = make_floor(maxQueue=1)
+    floor.request("sip:a@kamailio")
+    floor.request("sip:b@kamailio")
+    assert floor.request("sip:c@kamailio") is FloorState.TAKEN
+    assert sent[-1] == ("sip:c@kamailio", Instruction.TB_DENY)
+    assert floor.denied == 1
+
+
+def test_cancel_and_leave():
+    floor, _, changes = make_floor()
+    floor.request("sip:a@kamailio")
+    floor.request("sip:b@kamailio")
+    floor.request("sip:c@kamailio")
+    assert floor.release("sip:b@kamailio")
+    assert floor.participant("sip:b@kamailio").state is FloorState.IDLE
+    assert not floor.release("sip:b@kamailio")
+
+    # the speaker leaving passes the floor to the queue head
+    floor.leave("sip:a@kamailio")
+    assert floor.speaker.uri == "sip:c@kamailio"
+    # a queued participant leaving is skipped
+    floor.request("sip:d@kamailio")
+    floor.leave("sip:d@kamailio")
+    floor.release("sip:c@kamailio")
+    assert floor.speaker is None
+    assert changes[-1] == ("sip:c@kamailio", None)
+
+
+def test_force_and_revoke():
+    floor, _, _ = make_floor()
+    floor.request("sip:a@kamailio")
+    floor.request("sip:b@kamailio")
+    assert floor.force("sip:b@kamailio")
+    assert floor.speaker.uri == "sip:b@kamailio"
+    assert floor.queue() == []
+    assert floor.stateOf(floor.participant("sip:a@kamailio")) is FloorState.TAKEN
+    floor.revoke()
+    assert floor.speaker is None
+    assert not floor.force("sip:nobody@kamailio")
+
+
+def test_notify_listeners():
+    floor, sent, _ = make_floor(notifyListeners=True)
+    floor.request("sip:a@kamailio")
+    floor.request("sip:b@kamailio")
+    del sent[:]
+    floor.force("sip:c@kamailio")
+    # everybody but the new speaker and the queued participant
+    assert sorted(sent) == sorted([("sip:c@kamailio", Instruction.TB_GRANT),
+                                   ("sip:a@kamailio", Instruction.TB_TAKEN),
+                                   ("sip:d@kamailio", Instruction.TB_TAKEN)])
+
+
+def test_grant_latency():
+    floor, _, _ = make_floor()
+    floor.request("sip:a@kamailio")
+    floor.request("sip:b@kamailio")
+    floor.clock.now = 0.25
+    floor.release("sip:a@kamailio")
+    stats = floor.stats()
+    assert stats["granted"] == 2
+    assert stats["grant_latency_ms"]["max"] == 250.0
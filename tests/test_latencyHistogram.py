@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from utils.floorControl import Instruction
+from utils.latencyHistogram import GrantLatency, LatencyHistogram
+
+
+def test_empty():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(0.5) is None
+    assert histogram.stats() == {"count": 0, "p50": None, "p99": None, "max": None, "mean": None}
+
+
+def test_small_values_are_exact():
+    histogram = LatencyHistogram()
+    for us in range(1, 101):
+        histogram.record(us / 1000000)
+    assert histogram.percentile(0.5) == 0.05
+    assert histogram.percentile(0.99) == 0.099
+    assert histogram.percentile(1) == 0.1
+    assert histogram.stats()["mean"] == pytest.approx(0.0505, abs=0.001)
+
+
+@pytest.mark.parametrize("subBits", [5, 7])
+def test_percentiles_within_bucket_error(subBits):
+    rng = random.Random(subBits)
+    values = [rng.lognormvariate(-4, 1.5) for _ in range(5000)]
+    histogram = LatencyHistogram(subBits)
+    for value in values:
+        histogram.record(value)
+
+    exact = sorted(int(value * 1000000) for value in values)
+    error = 1 / 2 ** (subBits - 1)
+    for q in (0.5, 0.9, 0.99, 0.999):
+        expected = exact[max(1, int(q * len(exact) + 0.999999)) - 1] / 1000
+        # the highest value of the bucket, never below the true value
+        assert expected <= histogram.percentile(q) <= expected * (1 + error) + 0.001
+    assert histogram.stats()["max"] == exact[-1] / 1000
+    # a few hundred counters at most
+    assert len(histogram.counts) < 64 * 2 ** subBits
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_grant_latency_queued_then_granted():
+    clock = Clock()
+    latency = GrantLatency(clock)
+    latency.request()
+    clock.now = 0.01
+    assert latency.reply(Instruction.TB_QUEUED) == pytest.approx(0.01)
+    # a repeated request keeps the first time
+    latency.request()
+    clock.now = 0.5
+    assert latency.reply(Instruction.TB_GRANT) == pytest.approx(0.5)
+
+    stats = latency.stats()
+    assert stats["requests"] == 2
+    assert not stats["pending"]
+    assert stats["latency_ms"]["response"]["p50"] == 10.0
+    assert stats["latency_ms"]["queued"]["count"] == 1
+    assert stats["latency_ms"]["grant"]["count"] == 0
+    assert stats["latency_ms"]["press_to_grant"]["max"] == 500.0
+
+
+def test_grant_latency_unmatched_and_cancelled():
+    latency = GrantLatency(Clock())
+    assert latency.reply(Instruction.TB_GRANT) is None
+    assert latency.reply(Instruction.TB_TAKEN) is None
+    latency.request()
+    latency.release()
+    assert latency.stats()["unmatched"] == 1
+    assert latency.stats()["cancelled"] == 1
+    assert "press_to_grant" in latency.format()
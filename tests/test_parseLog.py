@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from utils.parseLog import PjsuaLogParser, parse_number
+
+# a pj.Call.dump() of an echo call
+DUMP = """[CONFIRMED] To: <sip:echo@kamailio>;tag=a1b2c3
+    Call time: 00h:00m:12s, 1st res in 45 ms, conn in 50ms
+    #0 audio PCMU @8kHz, sendrecv, peer=10.0.0.7:4000
+       SRTP status: Not active Crypto-suite: 
+       RX pt=0, last update:00h:00m:00.012s ago
+          total 1.2Kpkt 80.0KB (100.0KB +IP hdr) @avg=64.0Kbps/80.0Kbps
+          pkt loss=0 (0.0%), discrd=0 (0.0%), dup=0 (0.0%), reord=0 (0.0%)
+                (msec)    min     avg     max     last    dev
+          loss period:   0.000   1.250   4.000   0.000   0.000
+          jitter     :   0.125   1.234   3.000   1.000   0.500
+       TX pt=0, ptime=20, last update:00h:00m:00.020s ago
+          total 500pkt 80.0KB (99.5KB +IP hdr) @avg=64.0Kbps/80.0Kbps
+          pkt loss=0 (0.0%), dup=0 (0.0%), reorder=0 (0.0%)
+                (msec)    min     avg     max     last    dev
+          loss period:   0.000   0.000   0.000   0.000   0.000
+          jitter     :   0.000   0.000   0.000   0.000   0.000
+       RTT msec      :   1.000   2.000   3.000   2.000   0.500
+"""
+
+EXPECTED = {
+    "call_id": "call-1",
+    "call_status": "CONFIRMED",
+    "dst_URI": "<sip:echo@kamailio>;tag=a1b2c3",
+    "call_time": "00h:00m:12s",
+    "media": {
+        "0": {
+            "id": "0",
+            "media_type": "audio",
+            "codec": "PCMU",
+            "sample_rate": "8kHz",
+            "peer_ip": "10.0.0.7:4000",
+            "rx": {"type": "rx packet loss period", "pkt_loss_min": 0.0, "pkt_loss_avg": 1.25,
+                   "pkt_loss_max": 4.0, "total_packet_cnt": 1200, "total_packet_size": 100000},
+            "tx": {"type": "tx packet loss period", "pkt_loss_min": 0.0, "pkt_loss_avg": 0.0,
+                   "pkt_loss_max": 0.0, "total_packet_cnt": 500, "total_packet_size": 99500},
+        },
+    },
+}
+
+
+def test_parse_dump():
+    parser = PjsuaLogParser("call-1").parseIndent(DUMP)
+    assert parser.to_dict() == EXPECTED
+
+
+def test_parse_lines_like_string():
+    lines = [line + "\n" for line in DUMP.split("\n")]
+    assert PjsuaLogParser("call-1").parseIndent(lines).to_dict() == EXPECTED
+
+
+def test_dumps_round_trip():
+    parser = PjsuaLogParser("call-1").parseIndent(DUMP)
+    assert json.loads(parser.dumps()) == EXPECTED
+    assert parser.toJSON() == parser.to_dict()
+
+
+def test_keep_raw():
+    media = PjsuaLogParser("call-1", keep_raw=True).parseIndent(DUMP).to_dict()["media"]["0"]
+    assert media["rx"]["raw_packet_cnt"] == "1.2K"
+    assert media["rx"]["raw_packet_size"] == "100.0KB"
+    assert media["tx"]["raw_packet_cnt"] == "500"
+
+
+def test_bad_indent():
+    with pytest.raises(RuntimeError):
+        PjsuaLogParser("call-1").parseIndent("[CONFIRMED] To: <sip:echo@kamailio>\n    a\n  b\n")
+
+
+def test_parse_number():
+    assert parse_number("500") == 500
+    assert parse_number("1.2K") == 1200
+    assert parse_number("230.4KB") == 230400
+    assert parse_number("2M") == 2000000
+    assert parse_number("n/a") == 0
@@ -0,0 +1,212 @@
+import pjsua2 as pj
+import asyncio
+import sys
+import threading
+
+from .callbackBridge import registerThread
+from .controlLoop import controlLoop
+
+
+class EventPump:
+    """run the pjsua event polling next to the asyncio loop, it replaces
+    sleep4PJSUA2() when uaConfig.threadCnt is 0.
+
+    the pump thread runs ControlLoop.run(), which sleeps inside pjsip's poll
+    until a SIP or media event, a timer or a wakeup, so nothing is polled
+    when idle. the pjsua2 callbacks are called on the pump thread, AsyncCall
+    and AsyncAccount hand their results to the asyncio loop with
+    call_soon_threadsafe(). the coroutines call pjsua2 from the asyncio
+    thread, so the endpoint must be initialized with uaConfig.mainThreadOnly
+    False. stop() quits the ControlLoop, at once with its wakeup transport
+    (ControlLoop.setWakeupTransport()), or else within its max_block.
+    """
+
+    def __init__(self, loop=controlLoop):
+        """
+        Args:
+            loop (ControlLoop): the loop run by the pump thread
+        """
+        self.loop = loop
+        self._thread = None
+
+    def _run(self):
+        registerThread("pjsua-pump")
+        self.loop.run(-1)
+
+    def start(self):
+        if self._thread is None:
+            # the coroutines call pjsua2 from this thread
+            registerThread("asyncio")
+            self.loop.reset()
+            self._thread = threading.Thread(target=self._run, name="pjsua-pump", daemon=True)
+            self._thread.start()
+        return self
+
+    async def stop(self):
+        if self._thread is None:
+            return
+        self.loop.quit()
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+        self._thread = None
+        # let the shutdown pump the events again, e.g. sleep4PJSUA2() before libDestroy()
+        self.loop.reset()
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+
+class CallDisconnected(Exception):
+    """the call is disconnected before the awaited event"""
+
+    def __init__(self, ci):
+        super().__init__("call disconnected: {} [{}] {}".format(
+            ci.remoteUri, ci.lastStatusCode, ci.lastReason))
+        self.ci = ci
+
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _fail(future, exc):
+    if not future.done():
+        future.set_exception(exc)
+        # don't warn when nobody awaits it
+        future.exception()
+
+
+class AsyncCall(pj.Call):
+    """pj.Call whose callbacks resolve awaitable events, e.g.
+    `await call.confirmed()` and `await call.disconnected()`.
+    the callbacks run on the EventPump thread, they resolve the events on
+    the asyncio loop of the call. the subclass overriding
+    onCallState/onCallMediaState must call super().
+    """
+
+    def __init__(self, acc, call_id=pj.PJSUA_INVALID_ID, loop=None):
+        """
+        Args:
+            loop (asyncio loop): the loop of the awaitables, default the running one
+        """
+        pj.Call.__init__(self, acc, call_id)
+        self.acc = acc
+        self._loop = loop or asyncio.get_running_loop()
+        self._confirmed = self._loop.create_future()
+        self._media_active = self._loop.create_future()
+        self._disconnected = self._loop.create_future()
+        self._state_changed = asyncio.Event()
+
+    def onCallState(self, prm):
+        ci = self.getInfo()
+        post = self._loop.call_soon_threadsafe
+        if ci.state == pj.PJSIP_INV_STATE_CONFIRMED:
+            post(_resolve, self._confirmed, ci)
+        elif ci.state == pj.PJSIP_INV_STATE_DISCONNECTED:
+            post(_fail, self._confirmed, CallDisconnected(ci))
+            post(_fail, self._media_active, CallDisconnected(ci))
+            post(_resolve, self._disconnected, ci)
+        post(self._state_changed.set)
+
+    def onCallMediaState(self, prm):
+        try:
+            aud_med = self.getAudioMedia(-1)
+        except pj.Error:
+            return
+        self._loop.call_soon_threadsafe(_resolve, self._media_active, aud_med)
+
+    async def confirmed(self):
+        """wait until the call is confirmed
+
+        Returns:
+            pj.CallInfo: the call info at the time it is confirmed
+        Raises:
+            CallDisconnected: the call is disconnected before that
+        """
+        return await asyncio.shield(self._confirmed)
+
+    async def mediaActive(self):
+        """wait until the audio media is active
+
+        Returns:
+            pj.AudioMedia: the audio media of the call
+        """
+        return await asyncio.shield(self._media_active)
+
+    async def disconnected(self):
+        """wait until the call is disconnected
+
+        Returns:
+            pj.CallInfo: the call info at the time it is disconnected
+        """
+        return await asyncio.shield(self._disconnected)
+
+    async def stateChanged(self):
+        """wait for the next onCallState()"""
+        self._state_changed.clear()
+        await self._state_changed.wait()
+
+
+class AsyncAccount(pj.Account):
+    """pj.Account with `await acc.registered()` and `await acc.incomingCall()`"""
+
+    def __init__(self, callClass=AsyncCall):
+        pj.Account.__init__(self)
+        self.callClass = callClass
+        self._loop = asyncio.get_running_loop()
+        self._registered = self._loop.create_future()
+        self._incoming = asyncio.Queue()
+
+    def onRegState(self, prm):
+        ai = self.getInfo()
+        print("***{}: code={}".format(("*** Register" if ai.regIsActive else "*** Unregister"), prm.code))
+        if ai.regIsActive:
+            self._loop.call_soon_threadsafe(_resolve, self._registered, prm.code)
+        elif prm.code // 100 != 2:
+            self._loop.call_soon_threadsafe(
+                _fail, self._registered, RuntimeError("register failed: {} {}".format(prm.code, prm.reason)))
+
+    def onIncomingCall(self, iprm):
+        # the Call must be created in the callback, otherwise pjsua2 hangs up the call
+        call = self.callClass(self, call_id=iprm.callId, loop=self._loop)
+        self._loop.call_soon_threadsafe(self._incoming.put_nowait, call)
+
+    async def registered(self):
+        """wait until the registration is active, return the status code"""
+        return await asyncio.shield(self._registered)
+
+    async def incomingCall(self):
+        """wait for the next incoming call, it is not answered yet"""
+        return await self._incoming.get()
+
+
+async def stdinLines():
+    """async iterator over the lines typed on stdin, instead of an input() thread"""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        yield line.decode().rstrip("\n")
+
+
+def runPJSUA(main, **pumpArgs):
+    """run the coroutine function main() with the pjsua event pump alive,
+    the endpoint must be initialized (libInit, with uaConfig.mainThreadOnly
+    False) before.
+
+    Args:
+        main (coroutine function): the script, called without argument
+        pumpArgs: arguments of EventPump
+    """
+    async def _main():
+        async with EventPump(**pumpArgs):
+            return await main()
+
+    return asyncio.run(_main())
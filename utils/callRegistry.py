@@ -0,0 +1,99 @@
+import re
+
+# the "sip:user@host" part of an uri like '"1" <sip:1@kamailio>;tag=xxx'
+URI_RE = re.compile(r"(sips?:[^<>;\s]+)")
+
+
+def normalizeUri(uri):
+    match = URI_RE.search(uri)
+    return match.group(1) if match else uri
+
+
+class CallRegistry:
+    """calls of an Account, indexed by pjsua call id, by Call-ID string and by
+    remote uri, so finding and removing a call is O(1) without getInfo().
+
+    the callables in onAdd/onRemove are called with the call after it is
+    added to/removed from the registry.
+    """
+
+    def __init__(self):
+        self.byId = {}
+        self.byCallIdString = {}
+        self.byRemoteUri = {}
+        # call id -> (Call-ID string, remote uri, normalized remote uri)
+        self._keys = {}
+        self.onAdd = []
+        self.onRemove = []
+
+    def add(self, call, ci=None):
+        """register call, ci is its pj.CallInfo if the caller already has one
+
+        Returns:
+            the call
+        """
+        if ci is None:
+            ci = call.getInfo()
+        call_id = call.getId()
+        uri = normalizeUri(ci.remoteUri)
+        self.byId[call_id] = call
+        self.byCallIdString[ci.callIdString] = call
+        self.byRemoteUri.setdefault(uri, {})[call_id] = call
+        self._keys[call_id] = (ci.callIdString, ci.remoteUri, uri)
+        for hook in self.onAdd:
+            hook(call)
+        return call
+
+    def remove(self, call):
+        """unregister call, it is a no-op if the call isn't registered, e.g.
+        when its call id is already reused by another call
+
+        Returns:
+            the removed call, or None
+        """
+        call_id = call.getId()
+        if self.byId.get(call_id) is not call:
+            return None
+        keys = self._keys.pop(call_id)
+        call = self.byId.pop(call_id)
+        call_id_string, _, uri = keys
+        self.byCallIdString.pop(call_id_string, None)
+        calls = self.byRemoteUri.get(uri)
+        if calls is not None:
+            calls.pop(call_id, None)
+            if not calls:
+                del self.byRemoteUri[uri]
+        for hook in self.onRemove:
+            hook(call)
+        return call
+
+    def get(self, call_id):
+        return self.byId.get(call_id)
+
+    def findByCallId(self, call_id_string):
+        return self.byCallIdString.get(call_id_string)
+
+    def findByUri(self, uri):
+        """find a call of the remote uri, it falls back to the substring match
+        of the remote uri (no getInfo()) when no call has exactly this uri"""
+        calls = self.byRemoteUri.get(normalizeUri(uri))
+        if calls:
+            return next(iter(calls.values()))
+        for call_id, (_, remote_uri, _) in self._keys.items():
+            if uri in remote_uri:
+                return self.byId[call_id]
+        return None
+
+    def remoteUri(self, call):
+        """the remote uri of a registered call, without getInfo()"""
+        keys = self._keys.get(call.getId())
+        return keys[1] if keys else None
+
+    def __contains__(self, call):
+        return call.getId() in self.byId
+
+    def __iter__(self):
+        return iter(list(self.byId.values()))
+
+    def __len__(self):
+        return len(self.byId)
@@ -0,0 +1,155 @@
+import fnmatch
+import json
+import os
+
+# the built-in policies, --codecPolicy also takes the path of a json file of the same shape:
+#   priorities: codec patterns, highest priority first, e.g. ["PCMU", "PCMA"]
+#   allow: only the codecs matching these patterns stay enabled (all if empty)
+#   deny: the codecs matching these patterns are disabled, it wins over allow
+#   params: codec pattern -> {CodecParam setting/info field: value}, e.g. {"PCMU": {"frmPerPkt": 2}}
+# a pattern matches the codec id ("PCMU/8000/1") with shell wildcards, or as a
+# prefix like ep.codecSetPriority() does ("speex" matches "speex/16000/1")
+POLICIES = {
+    "default": {"deny": ["speex"]},
+    "g711": {"priorities": ["PCMU", "PCMA"], "allow": ["PCMU", "PCMA"]},
+    "g722": {"priorities": ["G722"], "allow": ["G722"]},
+    "opus": {"priorities": ["opus"], "allow": ["opus"]},
+}
+
+# the priority of the first codec of priorities, the next ones count down
+TOP_PRIORITY = 255
+
+
+def matchCodec(codecId, pattern):
+    codecId = codecId.lower()
+    pattern = pattern.lower()
+    return fnmatch.fnmatchcase(codecId, pattern) or fnmatch.fnmatchcase(codecId, pattern + "/*")
+
+
+class CodecPolicy:
+    """a declarative codec policy, apply() it to the endpoint after libStart()"""
+
+    def __init__(self, name, priorities=None, allow=None, deny=None, params=None):
+        self.name = name
+        self.priorities = list(priorities or [])
+        self.allow = list(allow or [])
+        self.deny = list(deny or [])
+        self.params = dict(params or {})
+
+    @classmethod
+    def load(cls, nameOrPath):
+        """the built-in policy of this name, or the policy of this json file
+
+        Raises:
+            ValueError: the policy is neither a built-in policy nor a valid json file
+        """
+        if nameOrPath in POLICIES:
+            return cls(nameOrPath, **POLICIES[nameOrPath])
+        if not os.path.isfile(nameOrPath):
+            raise ValueError("unknown codec policy {}, use one of {} or a json file".format(
+                nameOrPath, ", ".join(POLICIES)))
+        with open(nameOrPath) as f:
+            config = json.load(f)
+        unknown = set(config) - {"priorities", "allow", "deny", "params"}
+        if unknown:
+            raise ValueError("unknown codec policy keys {}".format(", ".join(sorted(unknown))))
+        return cls(os.path.basename(nameOrPath), **config)
+
+    def priority(self, codecId, default):
+        """the priority of codecId under this policy, 0 means disabled"""
+        if any(matchCodec(codecId, pattern) for pattern in self.deny):
+            return 0
+        if self.allow and not any(matchCodec(codecId, pattern) for pattern in self.allow):
+            return 0
+        for i, pattern in enumerate(self.priorities):
+            if matchCodec(codecId, pattern):
+                return TOP_PRIORITY - i
+        return default
+
+    def _setParams(self, param, codecId, values):
+        for field, value in values.items():
+            if hasattr(param.setting, field):
+                setattr(param.setting, field, value)
+            elif hasattr(param.info, field):
+                setattr(param.info, field, value)
+            else:
+                raise ValueError("codec {} has no parameter {}".format(codecId, field))
+
+    def apply(self, ep, accept=None):
+        """set the codec priorities and parameters of ep, and validate the
+        policy against ep.codecEnum2(). everything is checked before ep is
+        changed, so a ValueError leaves the codecs as they were.
+
+        Args:
+            ep (pj.Endpoint): the endpoint, after libStart()
+            accept (callable): accept(codecId), the codecs it refuses are disabled too, e.g. by the echo mode
+
+        Returns:
+            list: the warnings, e.g. a pattern which matches no codec
+
+        Raises:
+            ValueError: the policy disables every codec, or sets an unknown parameter
+        """
+        warnings = []
+        codecs = [(codec.codecId, codec.priority) for codec in ep.codecEnum2()]
+        ids = [codecId for codecId, _ in codecs]
+        for kind in ("priorities", "allow", "deny", "params"):
+            for pattern in getattr(self, kind):
+                if not any(matchCodec(codecId, pattern) for codecId in ids):
+                    warnings.append("{} pattern {} matches no codec".format(kind, pattern))
+
+        priorities = []
+        for codecId, default in codecs:
+            priority = self.priority(codecId, default)
+            if priority > 0 and accept is not None and not accept(codecId):
+                priority = 0
+            priorities.append((codecId, priority, default))
+        if not any(priority > 0 for _, priority, _ in priorities):
+            raise ValueError("codec policy {} leaves no codec enabled{}, the codecs are {}".format(
+                self.name, " with the other restrictions" if accept is not None else "", ", ".join(ids)))
+
+        # codec id -> CodecParam, a codec matched by several patterns gets all of their values
+        params = {}
+        for pattern, values in self.params.items():
+            for codecId in ids:
+                if matchCodec(codecId, pattern):
+                    if codecId not in params:
+                        params[codecId] = ep.codecGetParam(codecId)
+                    self._setParams(params[codecId], codecId, values)
+
+        for codecId, priority, default in priorities:
+            if priority != default:
+                ep.codecSetPriority(codecId, priority)
+        for codecId, param in params.items():
+            ep.codecSetParam(codecId, param)
+        return warnings
+
+    def __str__(self):
+        return "{}(priorities={}, allow={}, deny={}, params={})".format(
+            self.name, self.priorities, self.allow, self.deny, self.params)
+
+
+class CodecUsage:
+    """per codec counters of the finished calls, from PjsuaLogParser.to_dict()"""
+
+    def __init__(self):
+        # "PCMU@8kHz" -> {"calls", "call_seconds", "rx_bytes", "tx_bytes"}
+        self.codecs = {}
+
+    def count(self, stats, seconds=None):
+        """count a finished call
+
+        Args:
+            stats (dict): PjsuaLogParser.to_dict() of the call
+            seconds (int): the call time, not counted if None
+        """
+        for media in stats["media"].values():
+            key = "{}@{}".format(media["codec"], media["sample_rate"])
+            usage = self.codecs.setdefault(key, {"calls": 0, "call_seconds": 0, "rx_bytes": 0, "tx_bytes": 0})
+            usage["calls"] += 1
+            usage["call_seconds"] += seconds or 0
+            usage["rx_bytes"] += media["rx"]["total_packet_size"] or 0
+            usage["tx_bytes"] += media["tx"]["total_packet_size"] or 0
+
+    def stats(self):
+        return {key: dict(usage) for key, usage in sorted(self.codecs.items())}
@@ -1,43 +1,187 @@
 import pjsua2 as pj
-from datetime import datetime
+import heapq
+import itertools
+import math
+import socket
+import threading
+import time
 import traceback
 import sys
 
-isquit = False
+
+class Timer:
+    """a callback scheduled on the ControlLoop, cancel() it to unschedule"""
+
+    def __init__(self, deadline, cb, interval=None):
+        self.deadline = deadline
+        self.cb = cb
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class ControlLoop:
+    """drive pjsua2 when uaConfig.threadCnt is 0, without busy polling.
+
+    libHandleEvents() is given the time left until the next deadline (the end
+    of run(), or the next timer), so an idle loop sleeps inside pjsip's poll.
+    the poll is bounded by max_block, so quit() and callLater() from other
+    threads are noticed within max_block. With setWakeupTransport(), they
+    interrupt the poll immediately by sending a keep-alive datagram (which
+    pjsip silently drops) to our own UDP transport.
+    """
+
+    def __init__(self, max_block=0.2):
+        """
+        Args:
+            max_block (float): the longest time(second) libHandleEvents() may block
+        """
+        self.max_block = max_block
+        self._timers = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._quit = False
+        self._wakeup_addr = None
+        self._wakeup_sock = None
+
+    def callLater(self, delay, cb, interval=None):
+        """schedule cb after delay seconds, then every interval seconds if
+        interval is given. cb returning a true value stops run().
+        it is safe to call from other threads.
+
+        Returns:
+            Timer: the scheduled timer
+        """
+        timer = Timer(time.monotonic() + delay, cb, interval)
+        with self._lock:
+            heapq.heappush(self._timers, (timer.deadline, next(self._seq), timer))
+        self.wakeup()
+        return timer
+
+    def callEvery(self, interval, cb):
+        """schedule cb every interval seconds, the first call is after interval"""
+        return self.callLater(interval, cb, interval)
+
+    def setWakeupTransport(self, port, host="127.0.0.1"):
+        """send the wakeup datagram to the local UDP transport at host:port"""
+        self._wakeup_addr = (host, port)
+        if self._wakeup_sock is None:
+            self._wakeup_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def wakeup(self):
+        """interrupt the current libHandleEvents(), if a wakeup transport is set"""
+        if self._wakeup_addr is not None:
+            try:
+                self._wakeup_sock.sendto(b"\r\n\r\n", self._wakeup_addr)
+            except OSError:
+                pass
+
+    def quit(self):
+        """stop run(), it is safe to call from other threads.
+        the loop stays quit until reset(), the later run() returns immediately"""
+        self._quit = True
+        self.wakeup()
+
+    def reset(self):
+        """let run() handle the events again after quit(), e.g. to send the
+        BYEs and the unregistration of the shutdown before libDestroy()"""
+        self._quit = False
+
+    @property
+    def isquit(self):
+        return self._quit
+
+    def _runTimers(self, now):
+        while True:
+            with self._lock:
+                if not self._timers or self._timers[0][0] > now:
+                    return
+                _, _, timer = heapq.heappop(self._timers)
+            if timer.cancelled:
+                continue
+
+            if timer.interval is not None:
+                timer.deadline += timer.interval
+                # don't burst to catch up with missed periods
+                if timer.deadline <= now:
+                    timer.deadline = now + timer.interval
+                with self._lock:
+                    heapq.heappush(self._timers, (timer.deadline, next(self._seq), timer))
+
+            if timer.cb():
+                self.quit()
+            if self._quit:
+                return
+
+    def _nextTimer(self):
+        with self._lock:
+            while self._timers and self._timers[0][2].cancelled:
+                heapq.heappop(self._timers)
+            return self._timers[0][0] if self._timers else None
+
+    def run(self, t=-1):
+        """handle the pjsua2 events for t seconds, or forever if t is -1,
+        or until quit() is called.
+
+        Returns:
+            float: the time(second) it ran
+        """
+        ep = pj.Endpoint.instance()
+        start = time.monotonic()
+        end = None if t == -1 else start + t
+        now = start
+        while not self._quit:
+            self._runTimers(now)
+            if self._quit:
+                break
+
+            now = time.monotonic()
+            if end is not None and now >= end:
+                break
+
+            deadline = now + self.max_block
+            if end is not None:
+                deadline = min(deadline, end)
+            next_timer = self._nextTimer()
+            if next_timer is not None:
+                deadline = min(deadline, next_timer)
+
+            ep.libHandleEvents(max(0, math.ceil((deadline - now) * 1000)))
+            now = time.monotonic()
+
+        return time.monotonic() - start
+
+
+# the loop used by sleep4PJSUA2() and quitPJSUA()
+controlLoop = ControlLoop()
 
 
 def quitPJSUA():
-    isquit = True
+    controlLoop.quit()
+
+
+def resetPJSUA():
+    controlLoop.reset()
 
 
 def sleep4PJSUA2(t, cb=lambda : None, cb_time=1.0):
     """sleep for a perid time, it takes care of pjsua2's threading,
-    if the isquit is True, this function would immediately quit.
+    if quitPJSUA() is called, this function would immediately quit.
 
     Args:
         t (int): The time(second) you wants to sleep.
             if t equal -1, then it would sleep forever.
         cb (function): callback function you wants to execute,
-            return "false" mean you wants to stop this control loop
+            return a true value mean you wants to stop this control loop
         cb_time (float): execute callback function every cb_time
     """
-
-    global isquit
-
-    start = datetime.now()
-    last = start
-    end = start
-    # while not isquit:
-    while True:
-        end = datetime.now()
-        if ((end - start).total_seconds() >= t and t != -1) or isquit:
-            break
-        if (end - last).total_seconds() >= cb_time:
-            last = datetime.now()
-            isquit = cb()
-        pj.Endpoint.instance().libHandleEvents(20)
-
-    return (end - start).total_seconds()
+    timer = controlLoop.callEvery(cb_time, cb)
+    try:
+        return controlLoop.run(t)
+    finally:
+        timer.cancel()
 
 
 def handleErr(e: pj.Error, stopImmed=True):
@@ -0,0 +1,63 @@
+import pjsua2 as pj
+
+# bridge: the default conference bridge, clocked at 16KHz, every frame of an
+#     8KHz codec is resampled up before and down after the bridge
+# native-rate: the same conference bridge, clocked at the codec clock rate
+#     and only the codecs of this clock rate are enabled, so a frame looped
+#     to its own slot isn't resampled. the frames still go through the
+#     bridge, pjsua2 has no way to echo a stream without it
+ECHO_MODES = ["bridge", "native-rate"]
+
+
+def codecClockRate(codecId):
+    """the clock rate of a codec id like "PCMU/8000/1" """
+    try:
+        return int(codecId.split("/")[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def configureEcho(ep_cfg, mode, clockRate=8000):
+    """set the media config of the echo mode, before libInit()
+
+    Args:
+        ep_cfg (pj.EpConfig): the endpoint config
+        mode (str): one of ECHO_MODES
+        clockRate (int): the bridge clock rate of the native-rate mode
+    """
+    if mode == "native-rate":
+        ep_cfg.medConfig.clockRate = clockRate
+        ep_cfg.medConfig.sndClockRate = clockRate
+        ep_cfg.medConfig.channelCount = 1
+        # the echo canceller is useless when the audio is echoed on purpose
+        ep_cfg.medConfig.ecTailLen = 0
+
+
+def codecFilter(mode, clockRate=8000):
+    """the accept(codecId) of the codecs the echo mode keeps, None keeps every codec"""
+    if mode == "native-rate":
+        return lambda codecId: codecClockRate(codecId) == clockRate
+    return None
+
+
+def restrictCodecs(ep, mode, clockRate=8000):
+    """disable the codecs which would be resampled by the bridge, after libStart()
+
+    Returns:
+        list: the codec ids left enabled
+    """
+    accept = codecFilter(mode, clockRate)
+    enabled = []
+    for codec in ep.codecEnum2():
+        if codec.priority == 0:
+            continue
+        if accept is not None and not accept(codec.codecId):
+            ep.codecSetPriority(codec.codecId, 0)
+        else:
+            enabled.append(codec.codecId)
+    return enabled
+
+
+def startEcho(aud_med: pj.AudioMedia):
+    """loop the audio of a call back to it, it is the same for both modes"""
+    aud_med.startTransmit(aud_med)
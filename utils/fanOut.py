@@ -0,0 +1,127 @@
+import time
+from collections import deque
+
+
+class FanOut:
+    """the conference bridge connections of a talk group: the speaker
+    transmits to every other member.
+
+    the pj.AudioMedia of every member is cached when its media gets active,
+    and the set of members the speaker transmits to is kept, so nothing is
+    fetched across SWIG on a floor change, a joining/leaving member costs
+    one connection, and a request of the current speaker costs nothing.
+    a speaker change still rewires every listener (each one gets another
+    source), but only the connections which really exist are stopped.
+    members are keyed by their pjsua call id.
+    """
+
+    def __init__(self, maxSwitches=10000):
+        """
+        Args:
+            maxSwitches (int): how many speaker switch timings are kept
+        """
+        # call id -> pj.AudioMedia
+        self.media = {}
+        self.speaker = None
+        # the call ids the speaker transmits to
+        self.links = set()
+        # (seconds, bridge operations) of the speaker switches
+        self.switchTimes = deque(maxlen=maxSwitches)
+        self.switches = 0
+        self.errors = 0
+
+    def _connect(self, src, dst):
+        try:
+            src.startTransmit(dst)
+            return True
+        except Exception as e:
+            self.errors += 1
+            print("exception!!: {}".format(e.args))
+            return False
+
+    def _disconnect(self, src, dst):
+        try:
+            src.stopTransmit(dst)
+        except Exception as e:
+            self.errors += 1
+            print("exception!!: {}".format(e.args))
+
+    def attach(self, key, audMed):
+        """the media of a member is active, or renewed (e.g. by a re-INVITE)"""
+        self.media[key] = audMed
+        if self.speaker is None:
+            return
+        if key == self.speaker:
+            # the former port of the speaker is gone with its connections
+            self.links = set()
+            for other, med in self.media.items():
+                if other != key and self._connect(audMed, med):
+                    self.links.add(other)
+        else:
+            speakerMed = self.media.get(self.speaker)
+            self.links.discard(key)
+            if speakerMed is not None and self._connect(speakerMed, audMed):
+                self.links.add(key)
+
+    def detach(self, key):
+        """a member leaves, its bridge port is removed by pjsua with its connections"""
+        self.media.pop(key, None)
+        self.links.discard(key)
+        if key == self.speaker:
+            self.speaker = None
+            self.links = set()
+
+    def setSpeaker(self, key):
+        """let the member key transmit to every other member, instead of the
+        former speaker, None only silences the former one
+
+        Returns:
+            float: the time(second) it took
+        """
+        if key == self.speaker:
+            return 0.0
+        start = time.perf_counter()
+        ops = 0
+        oldMed = self.media.get(self.speaker) if self.speaker is not None else None
+        oldLinks = self.links
+
+        # connect the new speaker first, so the listeners never hear a gap
+        self.speaker = key
+        self.links = set()
+        newMed = self.media.get(key) if key is not None else None
+        if newMed is not None:
+            for other, med in self.media.items():
+                if other != key:
+                    ops += 1
+                    if self._connect(newMed, med):
+                        self.links.add(other)
+
+        if oldMed is not None:
+            for other in oldLinks:
+                med = self.media.get(other)
+                if med is not None:
+                    ops += 1
+                    self._disconnect(oldMed, med)
+
+        elapsed = time.perf_counter() - start
+        self.switches += 1
+        self.switchTimes.append((elapsed, ops))
+        return elapsed
+
+    def stats(self):
+        times = sorted(t for t, _ in self.switchTimes)
+
+        def percentile(q):
+            if not times:
+                return None
+            return round(times[min(len(times) - 1, int(q * len(times)))] * 1000, 3)
+
+        return {
+            "members": len(self.media),
+            "listeners": len(self.links),
+            "switches": self.switches,
+            "errors": self.errors,
+            "switch_ms": {"p50": percentile(0.5), "p99": percentile(0.99),
+                          "max": round(times[-1] * 1000, 3) if times else None},
+            "last_ops": self.switchTimes[-1][1] if self.switchTimes else 0,
+        }
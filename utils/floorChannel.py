@@ -0,0 +1,210 @@
+import itertools
+import random
+import re
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from .floorControl import Instruction
+
+# the header of the INVITE (offer) and of its 200 OK (port, token, optional host)
+HEADER = "X-Floor-Channel"
+OFFER = "offer"
+
+MAGIC = 0xF1
+# magic, opcode, sequence number, token of the call, priority
+PACKET = struct.Struct("!BBHIb")
+
+OPCODES = {
+    Instruction.TB_REQUEST: 1,
+    Instruction.TB_RELEASE: 2,
+    Instruction.TB_GRANT: 3,
+    Instruction.TB_DENY: 4,
+    Instruction.TB_TAKEN: 5,
+    Instruction.TB_IDLE: 6,
+    Instruction.TB_QUEUED: 7,
+}
+INSTRUCTIONS = {opcode: instruction for instruction, opcode in OPCODES.items()}
+ACK = 0x7F
+
+PARAM_RE = re.compile(r"(\w+)=([^;\s]+)")
+
+
+def encode(opcode, seq, token, priority=0):
+    return PACKET.pack(MAGIC, opcode, seq, token, max(-128, min(127, priority)))
+
+
+def decode(data):
+    """the (opcode, seq, token, priority) of a packet, None if it isn't one"""
+    if len(data) != PACKET.size:
+        return None
+    magic, opcode, seq, token, priority = PACKET.unpack(data)
+    if magic != MAGIC or (opcode != ACK and opcode not in INSTRUCTIONS):
+        return None
+    return opcode, seq, token, priority
+
+
+def newToken():
+    return random.getrandbits(32)
+
+
+def formatHeader(port, token, host=None):
+    """the HEADER value of the answer, e.g. "port=5070;token=1234" """
+    value = "port={};token={}".format(port, token)
+    return value + ";host={}".format(host) if host else value
+
+
+def parseHeader(value):
+    """the (host or None, port, token) of a HEADER value of an answer, None if it is not one"""
+    params = dict(PARAM_RE.findall(value or ""))
+    try:
+        return params.get("host"), int(params["port"]), int(params["token"])
+    except (KeyError, ValueError):
+        return None
+
+
+class _Pending:
+    __slots__ = ("packet", "peer", "tries", "timer", "sentAt", "onFail")
+
+    def __init__(self, packet, peer, onFail):
+        self.packet = packet
+        self.peer = peer
+        self.tries = 1
+        self.timer = None
+        self.sentAt = time.monotonic()
+        self.onFail = onFail
+
+
+class FloorChannel:
+    """floor control instructions over a plain UDP socket, instead of a SIP
+    MESSAGE transaction through the registrar.
+
+    a packet is PACKET.size bytes: an opcode, a sequence number and the token
+    of the call, given by the server in the HEADER of its 200 OK. every
+    packet but ACK is acknowledged at once by the reader thread, and sent
+    again by a timer of the ControlLoop after rto, rto*2, ... until retries
+    tries; then onFail() is called, which falls back to SIP MESSAGE. the
+    received instructions are handed to the loop thread by callLater(0),
+    which wakes up the pjsua polling, so onInstruction() may call pjsua2.
+    """
+
+    def __init__(self, loop, onInstruction, host="0.0.0.0", port=0, rto=0.05, retries=4):
+        """
+        Args:
+            loop (ControlLoop): runs the retransmit timers and the handlers
+            onInstruction (callable): onInstruction(instruction, token, priority, peer)
+            host (str): the address to bind
+            port (int): the port to bind, 0 picks one
+            rto (float): the first retransmit timeout(second)
+            retries (int): the tries of a packet before onFail()
+        """
+        self.loop = loop
+        self.onInstruction = onInstruction
+        self.rto = rto
+        self.retries = retries
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        # the reader checks close() this often
+        self.sock.settimeout(0.5)
+        self.port = self.sock.getsockname()[1]
+        self._seq = itertools.count(random.getrandbits(16))
+        # (peer, seq) -> _Pending, only touched by the loop thread
+        self.pending = {}
+        # (peer, seq) of the latest received packets, to drop the duplicates
+        self._seen = OrderedDict()
+        self._thread = None
+        self._stop = False
+        self.sent = 0
+        self.retransmits = 0
+        self.failed = 0
+        self.received = 0
+        self.duplicates = 0
+        self.acked = 0
+        self.rtt = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._read, name="floor-channel", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stop = True
+        if self._thread is not None:
+            self._thread.join()
+        self.sock.close()
+
+    def send(self, peer, instruction, token, priority=0, onFail=None):
+        """send an instruction to peer (host, port), it is called on the loop thread"""
+        seq = next(self._seq) & 0xFFFF
+        pending = _Pending(encode(OPCODES[instruction], seq, token, priority), peer, onFail)
+        key = (peer, seq)
+        self.pending[key] = pending
+        self._sendto(pending.packet, peer)
+        self.sent += 1
+        pending.timer = self.loop.callLater(self.rto, lambda: self._retransmit(key))
+
+    def _sendto(self, packet, peer):
+        try:
+            self.sock.sendto(packet, peer)
+        except OSError as e:
+            print("floor channel can't send to {}: {}".format(peer, e.args))
+
+    def _retransmit(self, key):
+        pending = self.pending.get(key)
+        if pending is None:
+            return
+        if pending.tries >= self.retries:
+            del self.pending[key]
+            self.failed += 1
+            if pending.onFail:
+                pending.onFail()
+            return
+        pending.tries += 1
+        self.retransmits += 1
+        self._sendto(pending.packet, pending.peer)
+        pending.timer = self.loop.callLater(self.rto * (1 << (pending.tries - 1)), lambda: self._retransmit(key))
+
+    def _read(self):
+        while not self._stop:
+            try:
+                data, peer = self.sock.recvfrom(64)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            packet = decode(data)
+            if packet is None:
+                continue
+            opcode, seq, token, priority = packet
+            if opcode != ACK:
+                # ack at once, the handler may wait for the loop thread
+                self._sendto(encode(ACK, seq, token), peer)
+            self.loop.callLater(0, lambda packet=packet, peer=peer: self._receive(packet, peer))
+
+    def _receive(self, packet, peer):
+        opcode, seq, token, priority = packet
+        key = (peer, seq)
+        if opcode == ACK:
+            pending = self.pending.pop(key, None)
+            if pending is not None:
+                pending.timer.cancel()
+                self.acked += 1
+                self.rtt = time.monotonic() - pending.sentAt
+            return
+
+        if key in self._seen:
+            self.duplicates += 1
+            return
+        self._seen[key] = True
+        if len(self._seen) > 1024:
+            self._seen.popitem(last=False)
+        self.received += 1
+        self.onInstruction(INSTRUCTIONS[opcode], token, priority, peer)
+
+    def stats(self):
+        return {"port": self.port, "sent": self.sent, "retransmits": self.retransmits, "failed": self.failed,
+                "received": self.received, "duplicates": self.duplicates, "acked": self.acked,
+                "last_rtt_ms": round(self.rtt * 1000, 3)}
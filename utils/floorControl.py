@@ -0,0 +1,300 @@
+import heapq
+import itertools
+import time
+from collections import deque
+from enum import Enum
+
+from .callRegistry import normalizeUri
+
+
+class Instruction(Enum):
+    """the text/plain MESSAGE bodies of the floor control"""
+    TB_REQUEST = 'request'
+    TB_GRANT = 'grant'
+    TB_DENY = 'deny'
+    TB_RELEASE = 'release'
+    TB_TAKEN = 'taken'
+    TB_IDLE = 'idle'
+    TB_QUEUED = 'queued'
+
+
+class FloorState(Enum):
+    """the floor state of a participant
+
+    IDLE: nobody has the floor
+    GRANTED: the participant has the floor
+    TAKEN: another participant has the floor
+    QUEUED: another participant has the floor, the request is queued
+    """
+    IDLE = 'idle'
+    GRANTED = 'granted'
+    TAKEN = 'taken'
+    QUEUED = 'queued'
+
+
+class Participant:
+    """a member of the floor, with its call and buddy"""
+
+    __slots__ = ("uri", "call", "buddy", "state", "priority", "requestedAt", "seq")
+
+    def __init__(self, uri, call=None, buddy=None):
+        self.uri = uri
+        self.call = call
+        self.buddy = buddy
+        # GRANTED, QUEUED, or IDLE for a listener, see FloorControl.stateOf()
+        self.state = FloorState.IDLE
+        self.priority = 0
+        # the time of the pending request, None if there isn't one
+        self.requestedAt = None
+        # the sequence number of the queue entry, a stale heap entry has another one
+        self.seq = None
+
+
+class FloorControl:
+    """the floor of a talk group: who may talk, and who waits.
+
+    the participants are indexed by their normalized uri, so the call and the
+    buddy of a MESSAGE sender are found in O(1). a request on a busy floor is
+    queued by priority (higher first), then FIFO, instead of denied; the
+    queue is a heap with lazy deletion, a cancelled entry is skipped when it
+    is popped. the engine doesn't touch pjsua2, it reports through:
+
+        send(participant, Instruction): a floor control message to a participant
+        onFloorChange(old, new): the speaker changed, old/new may be None
+
+    a floor change is only sent to the old and the new speaker, so it costs
+    O(1) messages whatever the size of the group; with notifyListeners every
+    other (not queued) participant gets TAKEN/IDLE too, one message each.
+    the time from a request to its grant is recorded per request.
+    """
+
+    def __init__(self, send, onFloorChange, maxQueue=32, clock=time.monotonic, maxLatencies=10000,
+                 notifyListeners=False):
+        """
+        Args:
+            send (callable): send(participant, instruction)
+            onFloorChange (callable): onFloorChange(oldSpeaker, newSpeaker)
+            maxQueue (int): the longest queue, the later requests are denied
+            clock (callable): the monotonic clock(second)
+            maxLatencies (int): how many grant latencies are kept
+            notifyListeners (bool): send every floor change to every participant
+        """
+        self.send = send
+        self.onFloorChange = onFloorChange
+        self.maxQueue = maxQueue
+        self.notifyListeners = notifyListeners
+        self.clock = clock
+        self.participants = {}
+        self.speaker = None
+        self._queue = []
+        self._queued = 0
+        self._seq = itertools.count()
+        self.latencies = deque(maxlen=maxLatencies)
+        self.granted = 0
+        self.denied = 0
+
+    def participant(self, uri):
+        return self.participants.get(normalizeUri(uri))
+
+    def stateOf(self, participant):
+        """the FloorState of a participant, a listener is TAKEN while there is a speaker"""
+        if participant.state is FloorState.IDLE and self.speaker is not None:
+            return FloorState.TAKEN
+        return participant.state
+
+    def findCall(self, uri):
+        participant = self.participant(uri)
+        return participant.call if participant else None
+
+    def findBuddy(self, uri):
+        participant = self.participant(uri)
+        return participant.buddy if participant else None
+
+    def join(self, uri, call=None, buddy=None):
+        """add a participant, or update the call/buddy of an existing one
+
+        Returns:
+            Participant: the participant
+        """
+        key = normalizeUri(uri)
+        participant = self.participants.get(key)
+        if participant is None:
+            participant = Participant(key, call, buddy)
+            self.participants[key] = participant
+        else:
+            if call is not None:
+                participant.call = call
+            if buddy is not None:
+                participant.buddy = buddy
+        return participant
+
+    def leave(self, uri):
+        """remove a participant, the floor is passed on if it is the speaker
+
+        Returns:
+            Participant: the removed participant, or None
+        """
+        participant = self.participants.pop(normalizeUri(uri), None)
+        if participant is None:
+            return None
+        if participant is self.speaker:
+            self._passFloor()
+        elif participant.state is FloorState.QUEUED:
+            self._dequeue(participant)
+        return participant
+
+    def request(self, uri, priority=0):
+        """a participant asks for the floor
+
+        Returns:
+            FloorState: the state of the participant after the request, None if it isn't a participant
+        """
+        participant = self.participant(uri)
+        if participant is None:
+            return None
+        if participant is self.speaker:
+            self.send(participant, Instruction.TB_GRANT)
+            return self.stateOf(participant)
+
+        if participant.requestedAt is None:
+            participant.requestedAt = self.clock()
+        if participant.state is FloorState.QUEUED:
+            # a repeated request may only raise the priority, it keeps its place otherwise
+            if priority > participant.priority:
+                participant.priority = priority
+                self._enqueue(participant)
+            self.send(participant, Instruction.TB_QUEUED)
+            return self.stateOf(participant)
+        participant.priority = priority
+        if self.speaker is None:
+            self._grant(participant)
+        elif self._queued >= self.maxQueue:
+            participant.requestedAt = None
+            self.denied += 1
+            self.send(participant, Instruction.TB_DENY)
+        else:
+            self._queued += 1
+            self._enqueue(participant)
+            participant.state = FloorState.QUEUED
+            self.send(participant, Instruction.TB_QUEUED)
+        return self.stateOf(participant)
+
+    def release(self, uri):
+        """the speaker gives the floor back, a queued participant cancels its request
+
+        Returns:
+            bool: whether anything changed
+        """
+        participant = self.participant(uri)
+        if participant is None:
+            return False
+        if participant is self.speaker:
+            self._passFloor()
+            return True
+        if participant.state is FloorState.QUEUED:
+            self._dequeue(participant)
+            participant.state = FloorState.IDLE
+            return True
+        return False
+
+    def force(self, uri):
+        """make a participant the speaker at once, e.g. by the operator,
+        it isn't counted as a granted request
+
+        Returns:
+            bool: False if it isn't a participant
+        """
+        participant = self.participant(uri)
+        if participant is None:
+            return False
+        if participant is not self.speaker:
+            if participant.state is FloorState.QUEUED:
+                self._dequeue(participant)
+            self._setSpeaker(participant)
+        return True
+
+    def revoke(self):
+        """take the floor from the speaker, e.g. by the operator"""
+        if self.speaker is not None:
+            self._passFloor()
+
+    def _enqueue(self, participant):
+        participant.seq = next(self._seq)
+        heapq.heappush(self._queue, (-participant.priority, participant.seq, participant))
+        # drop the stale entries once they outnumber the live ones
+        if len(self._queue) > 2 * self._queued + 16:
+            self._queue = [entry for entry in self._queue
+                           if entry[1] == entry[2].seq and self.participants.get(entry[2].uri) is entry[2]]
+            heapq.heapify(self._queue)
+
+    def _dequeue(self, participant):
+        # the heap entry is stale from now on
+        participant.seq = None
+        participant.requestedAt = None
+        self._queued -= 1
+
+    def _popQueue(self):
+        while self._queue:
+            _, seq, participant = heapq.heappop(self._queue)
+            if seq == participant.seq and self.participants.get(participant.uri) is participant:
+                participant.seq = None
+                self._queued -= 1
+                return participant
+        return None
+
+    def _grant(self, participant):
+        self.latencies.append(self.clock() - participant.requestedAt)
+        participant.requestedAt = None
+        self.granted += 1
+        self._setSpeaker(participant)
+
+    def _passFloor(self):
+        """give the floor to the head of the queue, or make it idle"""
+        participant = self._popQueue()
+        if participant is not None:
+            self._grant(participant)
+        else:
+            self._setSpeaker(None)
+
+    def _setSpeaker(self, participant):
+        old = self.speaker
+        self.speaker = participant
+        if old is not None:
+            old.state = FloorState.IDLE
+        if participant is not None:
+            participant.state = FloorState.GRANTED
+        self.onFloorChange(old, participant)
+
+        change = Instruction.TB_IDLE if participant is None else Instruction.TB_TAKEN
+        if participant is not None:
+            self.send(participant, Instruction.TB_GRANT)
+        if self.notifyListeners:
+            # tell the listeners, the queued ones stay queued
+            for other in self.participants.values():
+                if other is not participant and other.state is not FloorState.QUEUED:
+                    self.send(other, change)
+        elif old is not None and self.participants.get(old.uri) is old:
+            # the former speaker, unless it left
+            self.send(old, change)
+
+    def queue(self):
+        """the queued participants, in the order they would be granted"""
+        return [p for _, seq, p in sorted(self._queue) if seq == p.seq and self.participants.get(p.uri) is p]
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(q):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 3)
+
+        return {
+            "speaker": self.speaker.uri if self.speaker else None,
+            "participants": len(self.participants),
+            "queued": self._queued,
+            "granted": self.granted,
+            "denied": self.denied,
+            "grant_latency_ms": {"p50": percentile(0.5), "p99": percentile(0.99),
+                                 "max": round(latencies[-1] * 1000, 3) if latencies else None},
+        }
@@ -0,0 +1,144 @@
+import time
+
+from .floorControl import Instruction
+
+
+class LatencyHistogram:
+    """a latency histogram with log-linear buckets, like HdrHistogram.
+
+    a value (in microseconds) is counted in a bucket of its power of 2,
+    split into 2**subBits linear sub-buckets, so every bucket is within
+    1/2**(subBits-1) of its values whatever their magnitude, in a few
+    hundred counters at most. the percentiles are the highest value of
+    their bucket, the max is exact.
+    """
+
+    def __init__(self, subBits=7):
+        """
+        Args:
+            subBits (int): 2**subBits sub-buckets per power of 2, 7 keeps 2 significant digits
+        """
+        self.subBits = subBits
+        # the lowest value of a bucket -> count
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _bucket(self, value):
+        shift = max(0, value.bit_length() - self.subBits)
+        return (value >> shift) << shift, (1 << shift) - 1
+
+    def record(self, seconds):
+        value = max(0, int(seconds * 1000000))
+        low, _ = self._bucket(value)
+        self.counts[low] = self.counts.get(low, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        """the value(ms) q (0-1) of the recorded values are at most, None if there is none"""
+        if not self.count:
+            return None
+        rank = max(1, int(q * self.count + 0.999999))
+        seen = 0
+        for low in sorted(self.counts):
+            seen += self.counts[low]
+            if seen >= rank:
+                low, width = self._bucket(low)
+                return round(min(low + width, self.max) / 1000, 3)
+        return round(self.max / 1000, 3)
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "max": round(self.max / 1000, 3) if self.count else None,
+            "mean": round(self.total / self.count / 1000, 3) if self.count else None,
+        }
+
+
+class GrantLatency:
+    """the time from a floor request to the reply of the server.
+
+    request() timestamps a request with a monotonic clock, reply() matches
+    the next grant, deny or queued to it. the first reply of a request goes
+    to the "response" histogram, and to the one of its instruction; the
+    grant also goes to "press_to_grant", which includes the time in queue.
+    a queued request stays pending until its grant or deny, a release
+    cancels it. a reply without a request (e.g. the floor forced by the
+    operator) is only counted as unmatched.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        """
+        Args:
+            clock (callable): the monotonic clock(second)
+        """
+        self.clock = clock
+        self.histograms = {name: LatencyHistogram() for name in
+                           ("response", "press_to_grant", "grant", "deny", "queued")}
+        # the time of the pending request, and whether it got its first reply
+        self.requestedAt = None
+        self.answered = False
+        self.requests = 0
+        self.unmatched = 0
+        self.cancelled = 0
+
+    def request(self):
+        # a repeated request keeps the time of the first one
+        if self.requestedAt is None:
+            self.requestedAt = self.clock()
+            self.answered = False
+        self.requests += 1
+
+    def release(self):
+        if self.requestedAt is not None:
+            self.cancelled += 1
+            self.requestedAt = None
+
+    def reply(self, instruction):
+        """a reply of the server, the other instructions are ignored
+
+        Returns:
+            float: the latency(second) of the request, None if nothing was pending
+        """
+        if instruction not in (Instruction.TB_GRANT, Instruction.TB_DENY, Instruction.TB_QUEUED):
+            return None
+        if self.requestedAt is None:
+            self.unmatched += 1
+            return None
+        elapsed = self.clock() - self.requestedAt
+        if not self.answered:
+            self.answered = True
+            self.histograms["response"].record(elapsed)
+            self.histograms[instruction.value].record(elapsed)
+        if instruction is Instruction.TB_GRANT:
+            self.histograms["press_to_grant"].record(elapsed)
+        if instruction is not Instruction.TB_QUEUED:
+            self.requestedAt = None
+        return elapsed
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "pending": self.requestedAt is not None,
+            "unmatched": self.unmatched,
+            "cancelled": self.cancelled,
+            "latency_ms": {name: h.stats() for name, h in self.histograms.items()},
+        }
+
+    def format(self):
+        """the stats as a table of the histograms"""
+        lines = ["{:<16} {:>6} {:>9} {:>9} {:>9}".format("latency(ms)", "count", "p50", "p99", "max")]
+        for name, h in self.histograms.items():
+            stats = h.stats()
+            lines.append("{:<16} {:>6} {:>9} {:>9} {:>9}".format(
+                name, stats["count"], str(stats["p50"]), str(stats["p99"]), str(stats["max"])))
+        lines.append("requests: {}, unmatched replies: {}, cancelled: {}".format(
+            self.requests, self.unmatched, self.cancelled))
+        return "\n".join(lines)
@@ -0,0 +1,162 @@
+class MediaProfile:
+    """the conference bridge settings of pj.MediaConfig.
+
+    maxMediaPorts is the number of bridge slots (every call, player and
+    recorder takes one), clockRate the rate the bridge mixes at, and every
+    port of another clock rate is resampled to it. ptime is the bridge frame
+    length, a longer frame means fewer bridge ticks and more latency.
+    """
+
+    FIELDS = ("maxMediaPorts", "clockRate", "sndClockRate", "ptime", "channelCount")
+
+    def __init__(self, name, maxMediaPorts, clockRate, sndClockRate, ptime, channelCount, description=""):
+        self.name = name
+        self.maxMediaPorts = maxMediaPorts
+        self.clockRate = clockRate
+        self.sndClockRate = sndClockRate
+        self.ptime = ptime
+        self.channelCount = channelCount
+        self.description = description
+
+    def override(self, **fields):
+        """a copy of the profile, with the fields which are not None replaced"""
+        values = {field: getattr(self, field) for field in self.FIELDS}
+        values.update({k: v for k, v in fields.items() if v is not None})
+        changed = any(values[field] != getattr(self, field) for field in self.FIELDS)
+        return MediaProfile(self.name + ("+custom" if changed else ""), description=self.description, **values)
+
+    def apply(self, ep_cfg):
+        """set the profile to ep_cfg.medConfig, before libInit()"""
+        med = ep_cfg.medConfig
+        med.maxMediaPorts = self.maxMediaPorts
+        med.clockRate = self.clockRate
+        med.sndClockRate = self.sndClockRate
+        med.audioFramePtime = self.ptime
+        med.channelCount = self.channelCount
+
+    def validate(self, ep, maxCalls=None):
+        """check the profile against the enabled codecs of ep.codecEnum2(), after libStart()
+
+        Args:
+            ep (pj.Endpoint): the started endpoint
+            maxCalls (int): uaConfig.maxCalls, to check the bridge has a slot for every call
+
+        Returns:
+            list: the warnings, empty if the profile fits the codecs
+        """
+        warnings = []
+        enabled = [codec.codecId for codec in ep.codecEnum2() if codec.priority > 0]
+        if not enabled:
+            return ["no codec is enabled"]
+
+        resampled = [codecId for codecId in enabled if codecFormat(codecId)[0] != self.clockRate]
+        if len(resampled) == len(enabled):
+            warnings.append("no enabled codec runs at the bridge clock rate {}Hz, every call is resampled".format(
+                self.clockRate))
+        elif resampled:
+            warnings.append("resampled to the bridge clock rate {}Hz: {}".format(self.clockRate, ", ".join(resampled)))
+
+        if self.channelCount > 1 and all(codecFormat(codecId)[1] < self.channelCount for codecId in enabled):
+            warnings.append("the bridge has {} channels, but no enabled codec has".format(self.channelCount))
+        if self.ptime % 10 != 0:
+            warnings.append("the bridge ptime {}ms is not a multiple of the 10ms codec frame".format(self.ptime))
+        # slot 0 is the sound device (or null device) port
+        if maxCalls is not None and self.maxMediaPorts < maxCalls + 1:
+            warnings.append("{} bridge slots for {} calls, the later calls have no audio".format(
+                self.maxMediaPorts, maxCalls))
+        return warnings
+
+    def __str__(self):
+        return "{}(maxMediaPorts={}, clockRate={}, sndClockRate={}, ptime={}, channelCount={})".format(
+            self.name, self.maxMediaPorts, self.clockRate, self.sndClockRate, self.ptime, self.channelCount)
+
+
+# the sndClockRate 0 follows the clockRate
+PROFILES = {profile.name: profile for profile in [
+    MediaProfile("default", 254, 16000, 0, 20, 1,
+                 "the pjsua defaults"),
+    MediaProfile("narrowband-low-cpu", 1024, 8000, 8000, 20, 1,
+                 "G.711/GSM calls without resampling, many bridge slots"),
+    MediaProfile("wideband", 512, 16000, 16000, 20, 1,
+                 "G.722/speex-wb/16KHz opus calls without resampling"),
+    MediaProfile("superwideband", 256, 32000, 32000, 20, 1,
+                 "32KHz opus calls, the highest cost per slot"),
+]}
+
+
+def codecFormat(codecId):
+    """the (clock rate, channel count) of a codec id like "PCMU/8000/1" """
+    parts = codecId.split("/")
+    try:
+        clockRate = int(parts[1])
+    except (IndexError, ValueError):
+        clockRate = None
+    try:
+        channelCount = int(parts[2])
+    except (IndexError, ValueError):
+        channelCount = 1
+    return clockRate, channelCount
+
+
+def addMediaArgs(parser, envAction):
+    """add the media profile options to parser
+
+    Args:
+        parser (argparse.ArgumentParser): the parser of the entry point
+        envAction (argparse.Action): the EnvDefault action of the entry point
+    """
+    parser.add_argument(
+        "--mediaProfile", action=envAction, envvar='MEDIA_PROFILE', choices=list(PROFILES), default="default", required=False,
+        help="Specify the conference bridge profile, {}, default default (can also be specified using MEDIA_PROFILE environment variable)".format(
+            ", ".join("{}: {}".format(p.name, p.description) for p in PROFILES.values())))
+    for option, envvar, text in [
+            ("maxMediaPorts", 'MAX_MEDIA_PORTS', "the number of conference bridge slots"),
+            ("clockRate", 'CLOCK_RATE', "the conference bridge clock rate"),
+            ("sndClockRate", 'SND_CLOCK_RATE', "the sound device clock rate, 0 follows the clock rate"),
+            ("ptime", 'PTIME', "the conference bridge frame length(ms)"),
+            ("channelCount", 'CHANNEL_COUNT', "the conference bridge channel count")]:
+        parser.add_argument(
+            "--" + option, action=envAction, envvar=envvar, type=int, default=None, required=False,
+            help="Specify {}, overriding the media profile (can also be specified using {} environment variable)".format(text, envvar))
+    parser.add_argument(
+        "--bridgeReport", action=envAction, envvar='BRIDGE_REPORT', type=float, default=10.0, required=False,
+        help="Specify how often(second) the bridge slot utilisation is checked, 0 disables it, default 10 (can also be specified using BRIDGE_REPORT environment variable)")
+
+
+def mediaProfileFromArgs(args):
+    """the profile selected by the options of addMediaArgs()"""
+    return PROFILES[args.mediaProfile].override(**{field: getattr(args, field) for field in MediaProfile.FIELDS})
+
+
+class BridgeUsage:
+    """sample the conference bridge slot utilisation, sample() is meant to be
+    scheduled by controlLoop.callEvery(). it prints when the number of used
+    slots changes, and warns past warnAt of the slots."""
+
+    def __init__(self, ep, warnAt=0.9):
+        self.ep = ep
+        self.warnAt = warnAt
+        self.active = 0
+        self.peak = 0
+        self.maxPorts = 0
+
+    def sample(self):
+        active = self.ep.mediaActivePorts()
+        self.maxPorts = self.ep.mediaMaxPorts()
+        self.peak = max(self.peak, active)
+        if active != self.active:
+            self.active = active
+            print("*** bridge slots: {} ***".format(self))
+            if self.maxPorts and active >= self.warnAt * self.maxPorts:
+                print("*** bridge slots almost full, raise --maxMediaPorts ***")
+
+    @property
+    def utilisation(self):
+        return self.active / self.maxPorts if self.maxPorts else 0.0
+
+    def stats(self):
+        return {"active": self.active, "peak": self.peak, "max": self.maxPorts,
+                "utilisation": round(self.utilisation, 3)}
+
+    def __str__(self):
+        return "{}/{} used ({:.1%}), peak {}".format(self.active, self.maxPorts, self.utilisation, self.peak)
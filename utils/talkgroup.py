@@ -0,0 +1,190 @@
+import re
+
+from .callRegistry import normalizeUri
+from .fanOut import FanOut
+from .floorControl import FloorControl
+
+# the user part of an uri, e.g. "group1" of "<sip:group1@kamailio>"
+USER_RE = re.compile(r"sips?:([^@;>\s]+)@")
+
+
+def headerValue(wholeMsg, header):
+    """the value of a header of a raw SIP message, or None"""
+    match = re.search(r"^{}\s*:\s*(.*?)\s*$".format(re.escape(header)), wholeMsg or "", re.I | re.M)
+    return match.group(1) if match and match.group(1) else None
+
+
+def uriUser(uri):
+    match = USER_RE.search(uri or "")
+    return match.group(1) if match else None
+
+
+class Talkgroup:
+    """a talk group: its members, its floor and its bridge fan-out"""
+
+    def __init__(self, name, send, maxQueue=32, notifyListeners=False):
+        """
+        Args:
+            name (str): the name of the group
+            send (callable): send(participant, instruction) of FloorControl
+            maxQueue (int): the longest floor queue
+            notifyListeners (bool): send every floor change to every member, see FloorControl
+        """
+        self.name = name
+        self.floor = FloorControl(send, self._floorChange, maxQueue=maxQueue, notifyListeners=notifyListeners)
+        self.fanOut = FanOut()
+        self.floorChanges = 0
+
+    def _floorChange(self, old, new):
+        elapsed = self.fanOut.setSpeaker(new.call.getId() if new and new.call else None)
+        self.floorChanges += 1
+        print("*** talkgroup {} floor: {} -> {}, rewired in {:.3f}ms ***".format(
+            self.name, old.uri if old else None, new.uri if new else None, elapsed * 1000))
+
+    @property
+    def leader(self):
+        speaker = self.floor.speaker
+        return speaker.call if speaker else None
+
+    def __len__(self):
+        return len(self.floor.participants)
+
+    def stats(self):
+        floor = self.floor.stats()
+        return {
+            "members": len(self),
+            "speaker": floor["speaker"],
+            "queued": floor["queued"],
+            "floor_changes": self.floorChanges,
+            "granted": floor["granted"],
+            "denied": floor["denied"],
+            "grant_latency_ms": floor["grant_latency_ms"],
+            "switch_ms": self.fanOut.stats()["switch_ms"],
+        }
+
+
+class TalkgroupManager:
+    """the talk groups of the server, a group is created by its first member
+    and deleted with its last one.
+
+    a call joins the group named by its talkgroup header (e.g. X-Talkgroup),
+    or else by the user part of the dialed uri. a member uri is in one group
+    at a time, so its MESSAGE is routed to its group in O(1).
+    """
+
+    def __init__(self, send, header="X-Talkgroup", defaultGroup=None, maxQueue=32, notifyListeners=False):
+        """
+        Args:
+            send (callable): send(participant, instruction), for every group
+            header (str): the INVITE header naming the group
+            defaultGroup (str): the group of the calls without header nor dialed user
+            maxQueue (int): the longest floor queue of a group
+            notifyListeners (bool): send every floor change to every member
+        """
+        self.send = send
+        self.header = header
+        self.defaultGroup = defaultGroup
+        self.maxQueue = maxQueue
+        self.notifyListeners = notifyListeners
+        self.groups = {}
+        # call id -> (Talkgroup, Call), the call tells a reused call id apart
+        self.byCallId = {}
+        # normalized member uri -> Talkgroup
+        self.byUri = {}
+        self.created = 0
+        self.deleted = 0
+        # the floor changes of the deleted groups
+        self._formerChanges = 0
+
+    def groupName(self, wholeMsg, dialedUri):
+        """the group of an incoming INVITE, its raw message and its local (To) uri"""
+        return headerValue(wholeMsg, self.header) or uriUser(dialedUri) or self.defaultGroup
+
+    def group(self, name):
+        """the group of this name, it is created if needed"""
+        group = self.groups.get(name)
+        if group is None:
+            group = Talkgroup(name, self.send, self.maxQueue, self.notifyListeners)
+            self.groups[name] = group
+            self.created += 1
+        return group
+
+    def join(self, name, uri, call, buddy=None):
+        """add a call to a group, the member leaves its former group, and a
+        former call of the same uri is no longer a member
+
+        Returns:
+            Talkgroup: the group
+        """
+        key = normalizeUri(uri)
+        former = self.byUri.get(key)
+        if former is not None:
+            participant = former.floor.participant(key)
+            if participant is not None and participant.call is not None and participant.call is not call:
+                self._evict(former, participant.call)
+        group = self.group(name)
+        if former is not None and former is not group:
+            former.floor.leave(key)
+            self._dropIfEmpty(former)
+        group.floor.join(key, call, buddy)
+        self.byCallId[call.getId()] = (group, call)
+        self.byUri[key] = group
+        return group
+
+    def _evict(self, group, call):
+        """forget a call replaced by a newer call of its member"""
+        entry = self.byCallId.get(call.getId())
+        if entry is not None and entry[1] is call:
+            del self.byCallId[call.getId()]
+            group.fanOut.detach(call.getId())
+
+    def leave(self, call, uri):
+        """remove a call from its group
+
+        Returns:
+            Talkgroup: the group it left, or None
+        """
+        entry = self.byCallId.get(call.getId())
+        if entry is None or entry[1] is not call:
+            return None
+        group = self.byCallId.pop(call.getId())[0]
+        key = normalizeUri(uri)
+        # detach first, the port of the call is gone with it
+        group.fanOut.detach(call.getId())
+        participant = group.floor.participant(key)
+        if participant is not None and participant.call is call:
+            group.floor.leave(key)
+            if self.byUri.get(key) is group:
+                del self.byUri[key]
+        self._dropIfEmpty(group)
+        return group
+
+    def _dropIfEmpty(self, group):
+        if len(group) == 0 and self.groups.get(group.name) is group:
+            del self.groups[group.name]
+            self.deleted += 1
+            self._formerChanges += group.floorChanges
+
+    def ofCall(self, call):
+        entry = self.byCallId.get(call.getId())
+        return entry[0] if entry is not None and entry[1] is call else None
+
+    def ofUri(self, uri):
+        return self.byUri.get(normalizeUri(uri))
+
+    def ofMessage(self, fromUri, toUri):
+        """the group of a MESSAGE: the group named by its To user if the
+        sender is a member of it, or else the group of the sender"""
+        group = self.groups.get(uriUser(toUri))
+        if group is not None and group.floor.participant(fromUri) is not None:
+            return group
+        return self.ofUri(fromUri)
+
+    def stats(self):
+        return {
+            "groups": len(self.groups),
+            "members": len(self.byCallId),
+            "created": self.created,
+            "deleted": self.deleted,
+            "floor_changes": self._formerChanges + sum(group.floorChanges for group in self.groups.values()),
+        }